@@ -1,20 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ecu_frame
+
 # Define input and output file paths (use raw string `r` to handle backslashes)
 input_file = r"DataLogger_V2.0/data-20feb25/2.txt"
 output_file = r"DataLogger_V2.0/data-20feb25/output_2.txt"
 
-# Read the input file
-with open(input_file, "r") as file:
-    data = file.read().split()  # Split the data by spaces
-
-# Define the chunk size
-chunk_size = 82
+# Read the input file as byte values
+with open(input_file, "rb") as file:
+    tokens = ecu_frame.hex_tokens(file.read())
 
 # Split data into lines of 82 bytes
-chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+frames, leftover = ecu_frame.chunk_frames(tokens)
 
 # Write the formatted output
-with open(output_file, "w") as file:
-    for chunk in chunks:
-        file.write(" ".join(chunk) + "\n")
+with open(output_file, "wb") as file:
+    file.write(ecu_frame.format_frames(frames))
+    if leftover:
+        file.write(ecu_frame.format_frames(tokens[-leftover:].reshape(1, -1)))
 
 print("File processing complete. The output is saved in 'output.txt'.")
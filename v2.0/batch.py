@@ -0,0 +1,127 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import metrics as run_metrics
+import pipeline
+import plot_render
+
+# Per-log record of the last run, used to skip logs whose outputs are up to date
+SUMMARY_FILE = "summary.json"
+
+# Log files picked up in a folder: raw hex logs and binary logs
+LOG_PATTERNS = ["*.txt", "*.bin"]
+
+# Files in a log folder that are outputs of an earlier run, not logs
+OUTPUT_NAMES = {"processed_data.txt"}
+
+
+def find_logs(pattern):
+    """Logs in a directory (*.txt, *.bin) or matching a glob pattern."""
+    patterns = [os.path.join(pattern, name) for name in LOG_PATTERNS] if os.path.isdir(pattern) else [pattern]
+    return sorted(path for pattern in patterns for path in glob.glob(pattern, recursive=True)
+                  if os.path.isfile(path) and os.path.basename(path) not in OUTPUT_NAMES)
+
+
+def output_dir_for(log_path, output_root=None):
+    """Output folder of a log: <root>/<log name> or <log name>_out next to the log."""
+    name = os.path.splitext(os.path.basename(log_path))[0]
+    if output_root:
+        return os.path.join(output_root, name)
+    return os.path.join(os.path.dirname(log_path), name + "_out")
+
+
+def _stamp(log_path):
+    stat = os.stat(log_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def up_to_date(log_path, output_dir):
+    """Summary of the previous run if it was made from the same log, else None."""
+    try:
+        with open(os.path.join(output_dir, SUMMARY_FILE)) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if summary.get("stamp") != _stamp(log_path) or not os.path.exists(os.path.join(output_dir, "decrypted_data.csv")):
+        return None
+    return summary
+
+
+def run_one(log_path, output_dir, plots, keep_processed, profile=None, decode_workers=1):
+    """Process one log in a worker, plots are rendered serially inside the worker.
+
+    The summary includes the run report (stage times and rejection counters),
+    with profile ("cprofile" or "pyinstrument") a profile is saved next to it.
+    """
+    metrics = run_metrics.Metrics()
+    if profile:
+        profile_path = os.path.join(output_dir, "profile.html" if profile == "pyinstrument" else "profile.prof")
+        os.makedirs(output_dir, exist_ok=True)
+        with run_metrics.profile(profile_path, profile):
+            summary = pipeline.process_log(log_path, output_dir, plots, keep_processed, plot_workers=1, metrics=metrics,
+                                           decode_workers=decode_workers)
+    else:
+        summary = pipeline.process_log(log_path, output_dir, plots, keep_processed, plot_workers=1, metrics=metrics,
+                                       decode_workers=decode_workers)
+    summary["stamp"] = _stamp(log_path)
+    summary["report"] = metrics.report()
+    with open(os.path.join(output_dir, SUMMARY_FILE), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def print_summary(results):
+    print(f"{'Log':40} {'Status':10} {'Records':>9} {'Rejected':>9} {'Resyncs':>8} {'Coverage':>9} {'Time (s)':>9}")
+    for result in results:
+        print(f"{os.path.basename(result['input'])[:40]:40} {result['status']:10} {result.get('records', 0):>9} "
+              f"{result.get('rejected', 0):>9} {result.get('resyncs', 0):>8} {result.get('coverage', 0):>9.1%} "
+              f"{result.get('elapsed', 0):>9.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode and plot a folder of ECU SD logs without the GUI.")
+    parser.add_argument("logs", help="directory of .txt logs or a glob pattern")
+    parser.add_argument("-o", "--output", help="root folder for the per-log output folders")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of logs processed in parallel")
+    parser.add_argument("--decode-workers", type=int, default=1,
+                        help="processes decoding each raw log (0: one per core), for very large logs")
+    parser.add_argument("--plots", help="JSON plot set (see plot_render.load_plots)")
+    parser.add_argument("--keep-processed", action="store_true", help="also write processed_data.txt")
+    parser.add_argument("--force", action="store_true", help="reprocess logs that are up to date")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="save a profile of every log")
+    args = parser.parse_args(argv)
+
+    logs = find_logs(args.logs)
+    if not logs:
+        print(f"No logs found for {args.logs}")
+        return 1
+    plots = plot_render.load_plots(args.plots) if args.plots else plot_render.PLOTS
+
+    results = []
+    jobs = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for log_path in logs:
+            output_dir = output_dir_for(log_path, args.output)
+            previous = None if args.force else up_to_date(log_path, output_dir)
+            if previous:
+                results.append(dict(previous, status="skipped", elapsed=0.0))
+                continue
+            jobs[pool.submit(run_one, log_path, output_dir, plots, args.keep_processed, args.profile,
+                             args.decode_workers or None)] = log_path
+        for future in as_completed(jobs):
+            try:
+                results.append(dict(future.result(), status="ok"))
+            except Exception as e:
+                print(f"Error processing {jobs[future]}: {e}")
+                results.append({"input": jobs[future], "status": "failed"})
+
+    results.sort(key=lambda result: result["input"])
+    print_summary(results)
+    return 1 if any(result["status"] == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
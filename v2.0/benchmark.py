@@ -0,0 +1,251 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import synthetic_log
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, peak RSS is not reported there
+    resource = None
+
+# Allowed slowdown (records/s) or memory growth (peak RSS) against the baseline
+TOLERANCE = 0.2
+
+
+def _paths(workdir):
+    return {
+        "log": os.path.join(workdir, "synthetic.txt"),
+        "processed": os.path.join(workdir, "processed_data.txt"),
+        "csv": os.path.join(workdir, "decrypted_data.csv"),
+        "plots": os.path.join(workdir, "plots"),
+    }
+
+
+def _decoded(paths):
+    import ecu_frame
+    with open(paths["processed"], "rb") as f:
+        return ecu_frame.decode_frames(ecu_frame.hex_lines(f.read()))[0]
+
+
+# Every stage: (setup, timed run) where setup(paths) prepares untimed input and
+# run(paths, prepared) returns the number of records it handled. The first
+# four are the old three file path of DataLoggerApp.process_file and the single
+# pass decode it uses now (DataLoggerApp.process_stream), the rest the Gradio get_flight/plot_data path.
+
+def _format(paths, _):
+    # Old first step: tokenise, frame, validate, write processed_data.txt
+    import ecu_frame
+    import ecu_validate
+    with open(paths["log"], "rb") as f:
+        frames, _ = ecu_frame.chunk_frames(ecu_frame.hex_tokens(f.read()))
+    frames = frames[ecu_validate.valid_mask(frames)]
+    with open(paths["processed"], "wb") as f:
+        f.write(ecu_frame.format_frames(frames))
+    return len(frames)
+
+
+def _decode(paths, _):
+    return len(_decoded(paths)["Seconds"])
+
+
+def _csv_write(paths, columns):
+    import ecu_frame
+    ecu_frame.write_csv(paths["csv"], columns)
+    return len(columns["Seconds"])
+
+
+def _stream(paths, _):
+    # process_stream: single pass resync, filter, decode and CSV write (cache miss)
+    import pipeline
+    _, counts, _ = pipeline.decode_log(paths["log"], os.path.dirname(paths["csv"]))
+    return counts["records"]
+
+
+def _plot(paths, rows):
+    import pipeline
+    pipeline.plot_flight(paths["csv"], paths["plots"])
+    return rows
+
+
+def _rows(paths):
+    import flight_cache
+    return len(flight_cache.load_flight(paths["csv"])["Seconds"])
+
+
+def _gradio_load(paths, _):
+    # get_flight: read the uploaded CSV as a compact flight through the flight cache
+    import flight_data
+    return len(flight_data.load(paths["csv"]))
+
+
+def _gradio_plot(paths, flight):
+    # plot_data: time index, pyramids and one screen wide query per parameter
+    import ecu_frame
+    from plot_pyramid import MinMaxPyramid
+    from time_index import TimeIndex
+    time_index = TimeIndex(flight["Seconds"])
+    window = time_index.slice()
+    for param in ecu_frame.CSV_HEADERS[1:]:
+        index, values = MinMaxPyramid(flight[param]).query(window.start, window.stop, 1400)
+        time_index.time[index]
+    return len(flight)
+
+
+def _fresh_cache(paths):
+    import flight_cache
+    shutil.rmtree(flight_cache.CACHE_DIR, ignore_errors=True)
+
+
+def _load_flight(paths):
+    import flight_data
+    return flight_data.load(paths["csv"])
+
+
+STAGES = {
+    "format": (None, _format),
+    "decode": (None, _decode),
+    "csv_write": (_decoded, _csv_write),
+    "stream": (_fresh_cache, _stream),
+    "plot": (_rows, _plot),
+    "gradio_load_cold": (_fresh_cache, _gradio_load),
+    "gradio_load_cached": (_load_flight, _gradio_load),
+    "gradio_plot": (_load_flight, _gradio_plot),
+}
+
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process image, ru_maxrss on Linux survives the exec of a spawned worker
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _prepare(workdir, frames, seed, corruption):
+    # Synthetic log and the inputs of the later stages, so any subset of stages can run on its own
+    paths = _paths(workdir)
+    log_bytes = synthetic_log.generate_log(paths["log"], frames, seed, corruption)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _format(paths, None)
+        _csv_write(paths, _decoded(paths))
+    return log_bytes
+
+
+def _run_stage(name, workdir, repeat):
+    # Runs in a fresh process so the peak RSS belongs to this stage alone
+    setup, run = STAGES[name]
+    paths = _paths(workdir)
+    best = None
+    for _ in range(repeat):
+        prepared = setup(paths) if setup else None
+        # Warnings printed by the pipeline are not part of the measurement
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            records = run(paths, prepared)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "seconds": best,
+        "records": records,
+        "records_per_sec": records / best if best else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def run_benchmark(frames, seed=0, corruption=0.0, repeat=3, stages=None, workdir=None):
+    """Generate a synthetic log and time every stage in its own process, returns the results dict."""
+    workdir = workdir or tempfile.mkdtemp(prefix="ecu_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    # Stages run with their own empty flight cache
+    os.environ["ECU_CACHE_DIR"] = os.path.join(workdir, "cache")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        log_bytes = pool.submit(_prepare, workdir, frames, seed, corruption).result()
+
+    results = {
+        "frames": frames,
+        "seed": seed,
+        "corruption": corruption,
+        "log_bytes": log_bytes,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "stages": {},
+    }
+    for name in stages or STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results["stages"][name] = pool.submit(_run_stage, name, workdir, repeat).result()
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Regressions of results against a baseline, as a list of messages."""
+    regressions = []
+    if baseline.get("frames") != results["frames"]:
+        regressions.append(f"baseline was measured with {baseline.get('frames')} frames, not {results['frames']}")
+    for name, stage in results["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if not base:
+            continue
+        if base["records_per_sec"] and stage["records_per_sec"] < base["records_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {stage['records_per_sec']:.0f} records/s, baseline {base['records_per_sec']:.0f}")
+        if base["peak_rss_mb"] and stage["peak_rss_mb"] and stage["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {stage['peak_rss_mb']:.0f} MB, baseline {base['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def print_results(results):
+    print(f"{results['frames']} frames, {results['log_bytes'] / 1e6:.1f} MB log")
+    print(f"{'Stage':20} {'Time (s)':>9} {'Records/s':>12} {'Peak RSS (MB)':>14}")
+    for name, stage in results["stages"].items():
+        rss = f"{stage['peak_rss_mb']:.0f}" if stage["peak_rss_mb"] is not None else "-"
+        print(f"{name:20} {stage['seconds']:>9.3f} {stage['records_per_sec']:>12.0f} {rss:>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the log processing stages on a synthetic log.")
+    parser.add_argument("-n", "--frames", type=int, default=200000, help="frames in the synthetic log")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corruption", type=float, default=0.0, help="corruption events per frame")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest counts")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), help="stages to run (default: all)")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="results file")
+    parser.add_argument("--baseline", help="results file to compare against, exits 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative regression")
+    parser.add_argument("--workdir", help="keep the generated files here")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.frames, args.seed, args.corruption, args.repeat, args.stages, args.workdir)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"Regression: {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
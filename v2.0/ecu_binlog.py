@@ -0,0 +1,253 @@
+import argparse
+import os
+import numpy as np
+import ecu_frame
+import ecu_resync
+import ecu_validate
+from time_index import TimeIndex
+
+# Binary flight log: a 64 byte header, fixed 82 byte records (the raw ECU
+# frames) and a sparse time -> record index at the end. While a log is being
+# written its header has index_offset 0 and the records run to the end of the
+# file, so an interrupted capture can still be read and appended to.
+MAGIC = b"ECU-BLOG"
+VERSION = 1
+HEADER_SIZE = 64
+FRAME_SIZE = ecu_frame.FRAME_SIZE
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u2"),
+    ("frame_size", "<u2"),
+    ("index_stride", "<u4"),
+    ("count", "<u8"),
+    ("index_offset", "<u8"),
+    ("index_count", "<u8"),
+])
+
+# One index entry every INDEX_STRIDE records: flight time (unwrapped Seconds, see
+# TimeIndex) of the record and its number
+INDEX_STRIDE = 1024
+INDEX_DTYPE = np.dtype([("time", "<i8"), ("record", "<u8")])
+
+
+def is_binlog(path):
+    """True if path is a binary flight log."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a binary ECU log")
+    header = header[0]
+    if header["version"] != VERSION or header["frame_size"] != FRAME_SIZE:
+        raise ValueError(f"{path}: unsupported binary log version {header['version']}")
+    return header
+
+
+def _record_count(path, header):
+    # Unfinished logs (no index yet) end with their last whole record
+    if header["index_offset"] == 0:
+        return max(os.path.getsize(path) - HEADER_SIZE, 0) // FRAME_SIZE
+    return int(header["count"])
+
+
+def _header(count, index_stride, index_offset=0, index_count=0):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header[0] = (MAGIC, VERSION, FRAME_SIZE, index_stride, count, index_offset, index_count)
+    return header.tobytes().ljust(HEADER_SIZE, b"\0")
+
+
+def _records(path, count, dtype=ecu_frame.RAW_DTYPE, mode="r"):
+    # Zero-copy view of the records (np.memmap can not map zero records)
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE, shape=(count,))
+
+
+def build_index(seconds, stride=INDEX_STRIDE):
+    """Sparse index of a Seconds column: every stride-th record with its flight time."""
+    time = TimeIndex(seconds).time
+    index = np.zeros(-(-len(time) // stride), dtype=INDEX_DTYPE)
+    index["record"] = np.arange(0, len(time), stride)
+    index["time"] = time[::stride]
+    return index
+
+
+def to_frames(frames):
+    """Frames as uint8 records, token frames with an invalid decoded byte are dropped.
+
+    Returns (records, dropped). Invalid bytes outside the decoded part are stored as ff.
+    """
+    frames = np.asarray(frames)
+    if frames.dtype == np.uint8:
+        return frames, 0
+    valid = (frames[:, :ecu_frame.DECODED_BYTES] >= 0).all(axis=1)
+    return (frames[valid] & 0xff).astype(np.uint8), int((~valid).sum())
+
+
+class BinlogWriter:
+    """Append frames to a binary log, the index is rebuilt on close.
+
+    An existing binary log is appended to, also one whose writer was
+    interrupted before close (its records are counted from the file size).
+    """
+
+    def __init__(self, path, index_stride=INDEX_STRIDE):
+        self.path = path
+        self.index_stride = index_stride
+        self.count = 0
+        self.dropped = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.count = _record_count(path, _read_header(path))
+            self.f = open(path, "r+b")
+            # The old index (or a partly written record) is dropped, the index is written again on close
+            self.f.truncate(HEADER_SIZE + self.count * FRAME_SIZE)
+        else:
+            self.f = open(path, "wb")
+        # Valid header of an unfinished log until close
+        self.f.write(_header(self.count, index_stride))
+        self.f.flush()
+        self.f.seek(0, os.SEEK_END)
+
+    def write(self, frames):
+        """Append an (n, 82) array of frames (uint8 or tokens)."""
+        records, dropped = to_frames(frames)
+        self.f.write(np.ascontiguousarray(records).tobytes())
+        self.count += len(records)
+        self.dropped += dropped
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.flush()
+        index = build_index(_records(self.path, self.count)["seconds"], self.index_stride)
+        self.f.write(index.tobytes())
+        self.f.seek(0)
+        self.f.write(_header(self.count, self.index_stride, HEADER_SIZE + self.count * FRAME_SIZE, len(index)))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BinLog:
+    """Memory-mapped binary log.
+
+    self.frames is a zero-copy RAW_DTYPE view of the records and self.raw the
+    same bytes as an (n, 82) uint8 array. Time windows are found with the
+    sparse index and only the records of one index stride are read to
+    refine them, so slicing a large flight does not touch the rest of it.
+    The index of an unfinished log is built from its records when opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header = _read_header(path)
+        self.count = _record_count(path, header)
+        self.index_stride = int(header["index_stride"])
+        self.frames = _records(path, self.count)
+        self.raw = _records(path, self.count, np.dtype((np.uint8, FRAME_SIZE)))
+        if header["index_offset"] == 0:
+            self.index = build_index(self.frames["seconds"], self.index_stride)
+        else:
+            self.index = np.fromfile(path, dtype=INDEX_DTYPE, count=int(header["index_count"]), offset=int(header["index_offset"]))
+
+    def __len__(self):
+        return self.count
+
+    def _block_time(self, block):
+        # Flight time of the records of one index block
+        start = int(self.index["record"][block])
+        stop = int(self.index["record"][block + 1]) if block + 1 < len(self.index) else self.count
+        time = TimeIndex(self.frames["seconds"][start:stop]).time
+        return start, time - time[0] + self.index["time"][block]
+
+    @property
+    def end_time(self):
+        """Flight time of the last record."""
+        if not self.count:
+            return None
+        return int(self._block_time(len(self.index) - 1)[1][-1])
+
+    def slice_time(self, t0=None, t1=None):
+        """Slice of the records with t0 <= flight time <= t1."""
+        start = 0
+        if t0 is not None:
+            block = int(np.searchsorted(self.index["time"], t0, side="left")) - 1
+            if block >= 0:
+                first, time = self._block_time(block)
+                start = first + int(np.searchsorted(time, t0, side="left"))
+        stop = self.count
+        if t1 is not None:
+            block = int(np.searchsorted(self.index["time"], t1, side="right")) - 1
+            stop = 0
+            if block >= 0:
+                first, time = self._block_time(block)
+                stop = first + int(np.searchsorted(time, t1, side="right"))
+        return slice(start, max(start, stop))
+
+    def last(self, seconds):
+        """Slice of the records of the last seconds of the flight."""
+        end = self.end_time
+        return slice(0, 0) if end is None else self.slice_time(end - seconds, None)
+
+    def decode(self, records=slice(None)):
+        """Decoded CSV columns of a slice of the records, invalid frames are dropped."""
+        raw = self.raw[records]
+        return ecu_frame.decode_frames(raw[ecu_validate.valid_mask(raw)])[0]
+
+
+def iter_frames(f, block_size=ecu_frame.BLOCK_SIZE, counts=None):
+    """Yield (n, 82) uint8 frame arrays of the binary log open as f, block_size bytes of records at a time.
+
+    Frame source for ecu_frame.stream_csv like ecu_resync.iter_frames: the
+    blocks are slices of the memory map, so only the records in use are read.
+    """
+    log = BinLog(f.name)
+    step = max(block_size // FRAME_SIZE, 1)
+    for start in range(0, len(log), step):
+        yield log.raw[start:start + step]
+    if counts is not None:
+        counts["tokens"] = len(log) * FRAME_SIZE
+        counts["leftover"] = 0
+
+
+def convert_hex(input_path, output_path, aligned=False, block_size=ecu_frame.BLOCK_SIZE):
+    """Convert a raw hex log (resynchronised) or, with aligned, a processed_data.txt into a binary log.
+
+    Returns the number of records written.
+    """
+    frame_source = ecu_frame.iter_frames if aligned else ecu_resync.iter_frames
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    with open(input_path, "rb") as f, BinlogWriter(output_path) as writer:
+        for frames in frame_source(f, block_size, {}):
+            writer.write(frames)
+    if writer.dropped:
+        print(f"Warning: Dropped {writer.dropped} frames with invalid values")
+    return writer.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a hex ECU log into the binary log format.")
+    parser.add_argument("input", help="raw hex log or processed_data.txt")
+    parser.add_argument("-o", "--output", help="binary log to write (default: input name with .bin)")
+    parser.add_argument("--aligned", action="store_true", help="input is one frame per line (processed_data.txt), no resync")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.input)[0] + ".bin"
+    count = convert_hex(args.input, output, args.aligned)
+    print(f"Wrote {count} records to {output} ({os.path.getsize(output) / max(os.path.getsize(args.input), 1):.0%} of the hex log)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import csv
+import numpy as np
+import metrics as run_metrics
+
+# Every ECU response is a fixed 82 byte frame, only the first 28 bytes are decoded
+FRAME_SIZE = 82
+
+# Raw log bytes read per block when streaming
+BLOCK_SIZE = 1 << 20
+
+# Rows converted to Python values per step when writing a CSV
+WRITE_ROWS = 1 << 16
+
+CSV_HEADERS = [
+    "Seconds", "Injection Pulse Width 1 (us)", "Injection Pulse Width 2 (us)",
+    "RPM", "Ignition Advance Angle (deg)", "Injection Event Scheduling",
+    "Engine Status Ready", "Engine Status Crank", "Engine Status StartW",
+    "Engine Status Warmup", "Engine Status TPSAEN", "Engine Status TPSDEN",
+    "Air-Fuel Ratio Target 1", "Air-Fuel Ratio Target 2", "WBO2 Enabled 1",
+    "WBO2 Enabled 2", "Barometric Pressure (kPa)", "Manifold Absolute Pressure (kPa)",
+    "Manifold Air Temperature (deg C)", "Cylinder Temperature (deg C)",
+    "Throttle Position (%)", "Battery Voltage (V)"
+]
+
+
+def fahrenheit_to_celsius(f):
+    """Convert Fahrenheit to Celsius."""
+    return (f - 32) * 5 / 9
+
+
+def celsius_to_fahrenheit(c):
+    """Convert Celsius to Fahrenheit."""
+    return c * 9 / 5 + 32
+
+
+# Raw fields of a frame: (name, byte offset, little-endian numpy type)
+RAW_FIELDS = [
+    ("seconds", 0, "<u2"),
+    ("pw1", 2, "<u2"),
+    ("pw2", 4, "<u2"),
+    ("rpm", 6, "<u2"),
+    ("adv_deg", 8, "<u2"),
+    ("squirt", 10, "u1"),
+    ("engine", 11, "u1"),
+    ("afrtgt1", 12, "u1"),
+    ("afrtgt2", 13, "u1"),
+    ("wbo2_en1", 14, "u1"),
+    ("wbo2_en2", 15, "u1"),
+    ("baro", 16, "<i2"),
+    ("map", 18, "<i2"),
+    ("mat", 20, "<i2"),
+    ("clt", 22, "<i2"),
+    ("tps", 24, "<i2"),
+    ("batt", 26, "<i2"),
+]
+
+# Structured view over one 82 byte frame
+RAW_DTYPE = np.dtype({
+    "names": [name for name, _, _ in RAW_FIELDS],
+    "formats": [fmt for _, _, fmt in RAW_FIELDS],
+    "offsets": [offset for _, offset, _ in RAW_FIELDS],
+    "itemsize": FRAME_SIZE,
+})
+
+# Number of leading bytes the decoder actually reads
+DECODED_BYTES = max(offset + np.dtype(fmt).itemsize for _, offset, fmt in RAW_FIELDS)
+
+# CSV columns: (header, raw field, scale divisor, unit conversion, status bit)
+FIELDS = [
+    ("Seconds", "seconds", None, None, None),
+    ("Injection Pulse Width 1 (us)", "pw1", None, None, None),
+    ("Injection Pulse Width 2 (us)", "pw2", None, None, None),
+    ("RPM", "rpm", None, None, None),
+    ("Ignition Advance Angle (deg)", "adv_deg", 10, None, None),
+    ("Injection Event Scheduling", "squirt", None, None, None),
+    ("Engine Status Ready", "engine", None, None, 0),
+    ("Engine Status Crank", "engine", None, None, 1),
+    ("Engine Status StartW", "engine", None, None, 2),
+    ("Engine Status Warmup", "engine", None, None, 3),
+    ("Engine Status TPSAEN", "engine", None, None, 4),
+    ("Engine Status TPSDEN", "engine", None, None, 5),
+    ("Air-Fuel Ratio Target 1", "afrtgt1", None, None, None),
+    ("Air-Fuel Ratio Target 2", "afrtgt2", None, None, None),
+    ("WBO2 Enabled 1", "wbo2_en1", None, None, None),
+    ("WBO2 Enabled 2", "wbo2_en2", None, None, None),
+    ("Barometric Pressure (kPa)", "baro", 10, None, None),
+    ("Manifold Absolute Pressure (kPa)", "map", 10, None, None),
+    ("Manifold Air Temperature (deg C)", "mat", 10, fahrenheit_to_celsius, None),
+    ("Cylinder Temperature (deg C)", "clt", 10, fahrenheit_to_celsius, None),
+    ("Throttle Position (%)", "tps", 10, None, None),
+    ("Battery Voltage (V)", "batt", 10, None, None),
+]
+
+# Inverse of every unit conversion, used when encoding frames
+INVERSE_CONVERSIONS = {fahrenheit_to_celsius: celsius_to_fahrenheit}
+
+# Numpy dtype of every decoded CSV column
+COLUMN_DTYPES = {
+    header: np.dtype(bool) if bit is not None
+    else np.dtype(np.float64) if scale is not None
+    else RAW_DTYPE[field].newbyteorder("=")
+    for header, field, scale, convert, bit in FIELDS
+}
+
+# Lookup tables for tokenising hex text (whitespace matches str.split())
+_HEX_VALUE = np.full(256, -1, dtype=np.int16)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _HEX_VALUE[_c] = _i
+for _i, _c in enumerate(b"ABCDEF"):
+    _HEX_VALUE[_c] = 10 + _i
+_SPACE_BYTES = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+_IS_SPACE = np.zeros(256, dtype=bool)
+_IS_SPACE[list(_SPACE_BYTES)] = True
+_HEX_PAIRS = np.frombuffer(b"".join(b"%02x " % i for i in range(256)) + b"?? ", dtype=np.uint8).reshape(257, 3)
+
+
+def _token_spans(buf):
+    nonspace = ~_IS_SPACE[buf]
+    edges = np.diff(nonspace.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _token_values(buf, starts, ends):
+    # One or two hex digits per token (like zfill(2)), anything else is invalid (-1)
+    first = _HEX_VALUE[buf[starts]]
+    last = _HEX_VALUE[buf[ends - 1]]
+    lengths = ends - starts
+    values = np.where(lengths == 1, last, first * 16 + last).astype(np.int16)
+    values[(lengths > 2) | (first < 0) | (last < 0)] = -1
+    return values
+
+
+def hex_tokens(data):
+    """Convert space separated hex text into an int16 array of byte values (-1 = invalid token)."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return np.empty(0, dtype=np.int16)
+    starts, ends = _token_spans(buf)
+    return _token_values(buf, starts, ends)
+
+
+def hex_token_ends(data):
+    """Like hex_tokens, also returns the byte offset just past every token."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int64)
+    starts, ends = _token_spans(buf)
+    return _token_values(buf, starts, ends), ends
+
+
+def chunk_frames(tokens):
+    """Split a token stream into 82 value frames, returns (frames, leftover token count)."""
+    n = len(tokens) // FRAME_SIZE
+    return tokens[:n * FRAME_SIZE].reshape(n, FRAME_SIZE), len(tokens) - n * FRAME_SIZE
+
+
+def hex_lines(data):
+    """Read a one-frame-per-line hex file into an (n, 82) int16 array, short lines are dropped."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if buf.size == 0:
+        return np.empty((0, FRAME_SIZE), dtype=np.int16)
+    starts, ends = _token_spans(buf)
+    values = _token_values(buf, starts, ends)
+    # Line number of every token and its position inside the line
+    line = np.searchsorted(np.flatnonzero(buf == ord("\n")), starts)
+    first = np.flatnonzero(np.diff(line, prepend=-1))
+    counts = np.diff(first, append=len(line))
+    position = np.arange(len(line)) - np.repeat(first, counts)
+    # Lines too short for the decoder are parse errors, extra values are ignored
+    long_enough = counts >= DECODED_BYTES
+    frames = np.full((int(long_enough.sum()), FRAME_SIZE), -1, dtype=np.int16)
+    row = np.cumsum(long_enough) - 1
+    keep = np.repeat(long_enough, counts) & (position < FRAME_SIZE)
+    frames[np.repeat(row, counts)[keep], position[keep]] = values[keep]
+    return frames
+
+
+def hex_text(values):
+    """Format byte values as space separated hex text like the datalogger writes it."""
+    values = np.asarray(values)
+    return _HEX_PAIRS[np.where(values < 0, 256, values)].tobytes()
+
+
+def format_frames(frames):
+    """Format frames back into space separated hex lines."""
+    text = _HEX_PAIRS[np.where(frames < 0, 256, frames)]
+    text[:, -1, 2] = ord("\n")
+    return text.tobytes()
+
+
+def decode_raw(raw):
+    """Decode a RAW_DTYPE structured array into a dict of CSV columns."""
+    columns = {}
+    for header, field, scale, convert, bit in FIELDS:
+        values = raw[field]
+        if bit is not None:
+            values = (values & (1 << bit)) != 0
+        elif scale is not None:
+            values = values.astype(np.float64) / scale
+        if convert is not None:
+            values = convert(values)
+        columns[header] = values
+    return columns
+
+
+def decode_frames(frames):
+    """Decode an (n, 82) array of frames into a dict of CSV columns.
+
+    Frames with an invalid token in the decoded bytes are skipped, the number
+    skipped is returned alongside the columns. uint8 frames (binary logs)
+    are always valid and decoded without a copy.
+    """
+    frames = np.asarray(frames)
+    if frames.dtype == np.uint8:
+        return decode_raw(np.ascontiguousarray(frames).view(RAW_DTYPE)[:, 0]), 0
+    valid = (frames[:, :DECODED_BYTES] >= 0).all(axis=1)
+    raw = np.ascontiguousarray(frames[valid], dtype=np.uint8).view(RAW_DTYPE)[:, 0]
+    return decode_raw(raw), int((~valid).sum())
+
+
+def encode_raw(columns):
+    """Raw field values (a RAW_DTYPE array) of decoded CSV columns."""
+    raw = np.zeros(len(columns["Seconds"]), dtype=RAW_DTYPE)
+    for header, field, scale, convert, bit in FIELDS:
+        values = np.asarray(columns[header])
+        if bit is not None:
+            raw[field] |= values.astype(bool).astype(raw[field].dtype) << bit
+            continue
+        if convert is not None:
+            values = INVERSE_CONVERSIONS[convert](values.astype(np.float64))
+        if scale is not None:
+            values = np.round(values * scale)
+        raw[field] = values
+    return raw
+
+
+def encode_frames(columns, fill=None):
+    """Encode decoded CSV columns back into an (n, 82) uint8 array of raw frames.
+
+    The inverse of decode_frames, bytes past the decoded ones are copied from
+    fill (an (n, 82) array) or left zero.
+    """
+    raw = encode_raw(columns)
+    frames = raw.view(np.uint8).reshape(len(raw), FRAME_SIZE).copy()
+    if fill is not None:
+        frames[:, DECODED_BYTES:] = np.asarray(fill)[:, DECODED_BYTES:]
+    return frames
+
+
+def decode_line(line):
+    """Decode a single hex line into a CSV row, returns None if it can not be parsed."""
+    frames = hex_lines(line.encode() + b"\n")
+    if len(frames) == 0:
+        return None
+    columns, skipped = decode_frames(frames)
+    if skipped:
+        return None
+    return list(next(iter_rows(columns)))
+
+
+def iter_rows(columns):
+    """Yield CSV rows as plain Python values."""
+    return zip(*(values.tolist() for values in columns.values()))
+
+
+def last_space(data):
+    """Index of the last whitespace byte in data (-1 if there is none)."""
+    return max(data.rfind(bytes([c])) for c in _SPACE_BYTES)
+
+
+def iter_tokens(f, block_size=BLOCK_SIZE):
+    """Yield (tokens, last) for a raw hex log read in fixed size blocks.
+
+    Tokens split across block boundaries are carried over to the next block.
+    """
+    text = b""
+    while True:
+        block = f.read(block_size)
+        data = text + block
+        if block:
+            # Only tokenise up to the last whitespace so no token is cut in half
+            cut = last_space(data) + 1
+            data, text = data[:cut], data[cut:]
+        yield hex_tokens(data), not block
+        if not block:
+            break
+
+
+def iter_frames(f, block_size=BLOCK_SIZE, counts=None):
+    """Yield (n, 82) frame arrays from a raw hex log read in fixed size blocks.
+
+    Frames split across block boundaries are carried over to the next block.
+    If a counts dict is given the number of tokens read and the leftover
+    values at the end of the log are stored in it.
+    """
+    pending = np.empty(0, dtype=np.int16)
+    total = 0
+    for tokens, last in iter_tokens(f, block_size):
+        total += len(tokens)
+        if len(pending):
+            tokens = np.concatenate([pending, tokens])
+        frames, leftover = chunk_frames(tokens)
+        pending = tokens[len(tokens) - leftover:].copy()
+        if len(frames):
+            yield frames
+    if counts is not None:
+        counts["tokens"] = total
+        counts["leftover"] = len(pending)
+
+
+def concat_columns(parts):
+    """Concatenate a list of decoded column dicts."""
+    if not parts:
+        return decode_frames(np.empty((0, FRAME_SIZE), dtype=np.int16))[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def stream_csv(input_path, output_csv, processed_txt=None, block_size=BLOCK_SIZE, frame_source=None, columns_out=None,
+               metrics=None, quarantine_csv=None):
+    """Validate and decode a raw hex log into a CSV in a single pass with bounded memory.
+
+    Repeated frames (the datalogger logging the same packet again) are
+    dropped, counts["coverage"] is the flight_coverage report of the rest.
+    Optionally the kept frames are also written to processed_txt in the
+    processed_data.txt format and the rejected ones, with their reason
+    codes, to quarantine_csv (see ecu_validate). frame_source replaces
+    iter_frames for framing the log (e.g. ecu_resync.iter_frames). The
+    decoded columns of every block are appended to columns_out if given (a
+    list or a flight_cache.CacheWriter). Stage times and rejection reasons go to metrics (a
+    metrics.Metrics). Returns a dict of frame counts.
+    """
+    import ecu_validate  # both import this module itself
+    import flight_coverage
+
+    frame_source = frame_source or iter_frames
+    metrics = metrics or run_metrics.DISABLED
+    counts = {"frames": 0, "garbage": 0, "rejections": {}, "skipped": 0, "duplicates": 0, "records": 0}
+    validator = ecu_validate.FrameValidator()
+    deduplicator = flight_coverage.Deduplicator()
+    txt = open(processed_txt, "wb") if processed_txt else None
+    quarantine, quarantine_writer = ecu_validate.open_quarantine(quarantine_csv) if quarantine_csv else (None, None)
+
+    def write_block(writer, frames, reasons, positions):
+        kept = frames[reasons == 0]
+        if quarantine_writer:
+            ecu_validate.write_quarantine(quarantine_writer, frames, reasons, positions)
+        with metrics.stage("dedup"):
+            unique = deduplicator.push(flight_coverage.record_columns(ecu_validate.records(kept)[0]))
+        duplicates = len(kept) - int(unique.sum())
+        kept = kept[unique]
+        if txt:
+            with metrics.stage("format"):
+                txt.write(format_frames(kept))
+        with metrics.stage("decode"):
+            columns, skipped = decode_frames(kept)
+        with metrics.stage("csv_write"):
+            writer.writerows(iter_rows(columns))
+        if columns_out is not None:
+            columns_out.append(columns)
+        rejections = ecu_validate.first_reasons(reasons)
+        for code, n in rejections.items():
+            counts["rejections"][code] = counts["rejections"].get(code, 0) + n
+        counts["garbage"] += len(frames) - len(kept) - duplicates
+        counts["duplicates"] += duplicates
+        counts["skipped"] += skipped
+        counts["records"] += len(kept) - skipped
+        if metrics.enabled:
+            for code, n in rejections.items():
+                metrics.count(run_metrics.REJECT_PREFIX + code, n)
+            metrics.count(run_metrics.REJECT_PARSE, skipped)
+            metrics.count("duplicates", duplicates)
+            metrics.count("records", len(kept) - skipped)
+
+    try:
+        with open(input_path, "rb") as f, open(output_csv, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(CSV_HEADERS)
+            for frames in metrics.timed("frame", frame_source(f, block_size, counts)):
+                counts["frames"] += len(frames)
+                metrics.count("frames", len(frames))
+                with metrics.stage("validate"):
+                    block = validator.push(frames)
+                write_block(writer, *block)
+            write_block(writer, *validator.finish())
+    finally:
+        if txt:
+            txt.close()
+        if quarantine:
+            quarantine.close()
+    counts["coverage"] = deduplicator.report()
+    if metrics.enabled:
+        metrics.count(run_metrics.REJECT_SHORT_CHUNK, counts.get("leftover", 0))
+        metrics.count(run_metrics.REJECT_RESYNC, run_metrics.resync_values(counts))
+        metrics.count(run_metrics.RESYNCS, len(counts.get("resync_skips", [])))
+    return counts
+
+
+def write_csv(path, columns, header=True, mode="w"):
+    """Write decoded columns to a CSV file, WRITE_ROWS rows at a time."""
+    n = len(next(iter(columns.values()), ()))
+    with open(path, mode, newline="") as f:
+        writer = csv.writer(f)
+        if header:
+            writer.writerow(list(columns))
+        for start in range(0, n, WRITE_ROWS):
+            writer.writerows(iter_rows({name: values[start:start + WRITE_ROWS] for name, values in columns.items()}))
@@ -0,0 +1,293 @@
+import argparse
+import csv
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import ecu_frame
+import ecu_resync
+import ecu_validate
+import flight_coverage
+import metrics as run_metrics
+
+FRAME_SIZE = ecu_frame.FRAME_SIZE
+
+# Logs smaller than this per worker are not worth sharding
+MIN_SHARD_BYTES = 16 << 20
+
+# Every shard is also framed this far into the next one, the two framings must
+# meet there (on average a few frames after the boundary)
+OVERLAP_BYTES = 1 << 20
+
+# Decoded rows handed to columns_out per block
+APPEND_ROWS = 1 << 18
+
+# Frames of a shard closer than this many values to the end of its scanned range
+# may depend on values after it and are not used
+_MARGIN = 3 * FRAME_SIZE + ecu_resync.BACKTRACK
+
+# The decoded bytes of a frame as a structured record, RAW_DTYPE without the padding
+RECORD_DTYPE = np.dtype({"names": list(ecu_frame.RAW_DTYPE.names),
+                         "formats": [ecu_frame.RAW_DTYPE.fields[name][0] for name in ecu_frame.RAW_DTYPE.names],
+                         "offsets": [ecu_frame.RAW_DTYPE.fields[name][1] for name in ecu_frame.RAW_DTYPE.names],
+                         "itemsize": ecu_frame.DECODED_BYTES})
+
+
+class _Range:
+    # File-like view of length bytes of an open file from its current position
+
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _align(path, offset, size):
+    # First offset at or after offset just after a whitespace byte (or the end of the log)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while offset < size:
+            data = f.read(1 << 16)
+            if not data:
+                break
+            first = [i for i in (data.find(c) for c in ecu_frame._SPACE_BYTES) if i >= 0]
+            if first:
+                return offset + min(first) + 1
+            offset += len(data)
+    return size
+
+
+def shard_bounds(path, shards):
+    """Byte offsets splitting a log into shards, every one just after a whitespace byte."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    for i in range(1, shards):
+        bounds.append(_align(path, max(size * i // shards, bounds[-1]), size))
+    bounds.append(size)
+    return bounds
+
+
+def _count_tokens(path, begin, end):
+    # Number of values in a whitespace aligned byte range
+    with open(path, "rb") as f:
+        f.seek(begin)
+        return sum(len(tokens) for tokens, _ in ecu_frame.iter_tokens(_Range(f, end - begin)))
+
+
+def _scan(path, begin, end, stop, block_size=ecu_frame.BLOCK_SIZE):
+    # Frame the byte range begin..stop of a log and run the per frame checks. begin..end
+    # is the shard, end..stop the overlap into the next one. Only the decoded bytes of a
+    # frame are kept, the whole frame only for those that may be rejected (see jump_mask).
+    starts, reasons, records, extra_index, extra_frames = [], [], [], [], []
+    counts = {}
+    n = 0
+    with open(path, "rb") as f:
+        f.seek(begin)
+        for tokens, block_starts, base in ecu_resync.iter_frame_starts(_Range(f, stop - begin), block_size, counts):
+            frames = ecu_resync.take_frames(tokens, block_starts)
+            raw, invalid = ecu_validate.records(frames)
+            block_reasons = ecu_validate.frame_reasons(raw, invalid)
+            passed = np.flatnonzero(block_reasons == 0)
+            keep = block_reasons != 0
+            keep[passed[ecu_validate.jump_mask(raw[passed])]] = True
+            if len(passed):
+                keep[passed[[0, -1]]] = True
+            starts.append(block_starts + base)
+            reasons.append(block_reasons)
+            records.append(np.ascontiguousarray(frames[:, :ecu_frame.DECODED_BYTES] & 0xff, dtype=np.uint8))
+            extra_index.append(n + np.flatnonzero(keep))
+            extra_frames.append(frames[keep].astype(np.int16))
+            n += len(frames)
+    tokens = counts["tokens"]
+    return {
+        "tokens": tokens - (_count_tokens(path, end, stop) if stop > end else 0),
+        "scanned": tokens,
+        "complete": stop >= os.path.getsize(path),
+        "starts": np.concatenate(starts) if starts else np.empty(0, dtype=np.int64),
+        "reasons": np.concatenate(reasons) if reasons else np.empty(0, dtype=np.uint64),
+        "records": np.concatenate(records) if records else np.empty((0, ecu_frame.DECODED_BYTES), dtype=np.uint8),
+        "extra_index": np.concatenate(extra_index) if extra_index else np.empty(0, dtype=np.int64),
+        "extra_frames": np.concatenate(extra_frames) if extra_frames else np.empty((0, FRAME_SIZE), dtype=np.int16),
+    }
+
+
+def _meet(previous, shard, first, previous_base, base):
+    # Indexes in previous and shard of the first frame both framed alike (the framings agree
+    # from there on) after frame first of previous, None if they do not meet
+    trusted = np.inf if previous["complete"] else previous_base + previous["scanned"] - _MARGIN
+    starts = previous["starts"]
+    common, a, b = np.intersect1d(starts[first:] + previous_base, shard["starts"] + base,
+                                  assume_unique=True, return_indices=True)
+    a += first
+    # The next accepted frame must be trusted too, it is a neighbour in the spike checks
+    passed = np.flatnonzero(previous["reasons"] == 0)
+    following = np.searchsorted(passed, a, side="right")
+    ok = (common < trusted) & (previous["reasons"][a] == 0) & (following < len(passed))
+    ok[ok] &= starts[passed[following[ok]]] + previous_base < trusted
+    if not ok.any():
+        return None
+    i = int(np.argmax(ok))
+    return int(a[i]), int(b[i])
+
+
+def _merge(path, bounds, stops, shards, block_size):
+    # Join the shard framings into the frames of a serial run, returns [(shard, base, lo, hi)]
+    while True:
+        bases = np.concatenate([[0], np.cumsum([shard["tokens"] for shard in shards])])
+        pieces = [[0, 0, 0, len(shards[0]["starts"])]]
+        for i in range(1, len(shards)):
+            meet = _meet(shards[i - 1], shards[i], pieces[-1][2], bases[i - 1], bases[i])
+            if meet is None:
+                # No common frame in the overlap (e.g. a long stretch of noise): frame both shards as one
+                shards[i - 1:i + 1] = [_scan(path, bounds[i - 1], bounds[i + 1], stops[i], block_size)]
+                del bounds[i], stops[i - 1]
+                break
+            pieces[-1][3] = meet[0] + 1
+            pieces.append([i, bases[i], meet[1] + 1, len(shards[i]["starts"])])
+        else:
+            return pieces
+
+
+def _render(shm_name, rows, start, stop, layout, part_path):
+    # Decode records start..stop from shared memory into the shared output columns and
+    # write their CSV rows to part_path
+    shm = SharedMemory(name=shm_name)
+    try:
+        records = np.ndarray((rows,), dtype=RECORD_DTYPE, buffer=shm.buf)[start:stop]
+        columns = ecu_frame.decode_raw(records)
+        for name, (offset, dtype) in layout.items():
+            np.ndarray((rows,), dtype=dtype, buffer=shm.buf, offset=offset)[start:stop] = columns[name]
+        with open(part_path, "w", newline="") as f:
+            csv.writer(f).writerows(ecu_frame.iter_rows(columns))
+        records = columns = None
+    finally:
+        shm.close()
+    return part_path
+
+
+def decode_parallel(input_path, output_csv, workers=None, columns_out=None, metrics=None, quarantine_csv=None,
+                    block_size=ecu_frame.BLOCK_SIZE):
+    """Decode a raw hex log into a CSV on several cores, same output and counts as a serial stream_csv.
+
+    The log is cut into whitespace aligned byte ranges that are framed
+    (ecu_resync) and checked (ecu_validate) in a process pool, each one a
+    little into the next so the framings can be joined where they agree.
+    The spike and repeated frame checks then run over the joined frames and
+    the kept ones are decoded and formatted in the pool again, through
+    shared memory. The arguments are those of ecu_frame.stream_csv (no
+    processed_data.txt).
+    """
+    metrics = metrics or run_metrics.DISABLED
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(input_path)
+    shards = max(1, min(workers, size // MIN_SHARD_BYTES))
+    bounds = shard_bounds(input_path, shards)
+    stops = [_align(input_path, min(end + OVERLAP_BYTES, size), size) for end in bounds[1:]]
+
+    with metrics.stage("frame"):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_scan, input_path, bounds[i], bounds[i + 1], stops[i], block_size)
+                       for i in range(len(bounds) - 1)]
+            scanned = [future.result() for future in futures]
+        pieces = _merge(input_path, bounds, stops, scanned, block_size)
+
+    with metrics.stage("validate"):
+        starts = np.concatenate([scanned[i]["starts"][lo:hi] + base for i, base, lo, hi in pieces])
+        reasons = np.concatenate([scanned[i]["reasons"][lo:hi] for i, _, lo, hi in pieces])
+        records = np.concatenate([scanned[i]["records"][lo:hi] for i, _, lo, hi in pieces]).view(RECORD_DTYPE)[:, 0]
+        passed = np.flatnonzero(reasons == 0)
+        reasons[passed] = ecu_validate.spike_reasons(records[passed])
+        kept = np.flatnonzero(reasons == 0)
+        if quarantine_csv:
+            _write_quarantine(quarantine_csv, scanned, pieces, reasons)
+
+    with metrics.stage("dedup"):
+        deduplicator = flight_coverage.Deduplicator()
+        kept = kept[deduplicator.push(flight_coverage.record_columns(records[kept]))]
+
+    # Kept records in, decoded columns out, one shared memory block
+    rows = len(kept)
+    layout, offset = {}, rows * RECORD_DTYPE.itemsize
+    for name, dtype in ecu_frame.COLUMN_DTYPES.items():
+        layout[name] = (offset, np.dtype(dtype))
+        offset += rows * np.dtype(dtype).itemsize
+    shm = SharedMemory(create=True, size=max(offset, 1))
+    parts = []
+    try:
+        np.ndarray((rows,), dtype=RECORD_DTYPE, buffer=shm.buf)[:] = records[kept]
+        records = None
+        with metrics.stage("decode"):
+            cuts = np.linspace(0, rows, workers + 1).astype(np.int64)
+            directory = os.path.dirname(os.path.abspath(output_csv))
+            for _ in range(workers):
+                fd, part = tempfile.mkstemp(suffix=".csv", dir=directory)
+                os.close(fd)
+                parts.append(part)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_render, shm.name, rows, int(start), int(stop), layout, part)
+                           for start, stop, part in zip(cuts[:-1], cuts[1:], parts)]
+                for future in futures:
+                    future.result()
+        with metrics.stage("csv_write"):
+            with open(output_csv, "w", newline="") as out:
+                csv.writer(out).writerow(ecu_frame.CSV_HEADERS)
+            with open(output_csv, "ab") as out:
+                for part in parts:
+                    with open(part, "rb") as f:
+                        shutil.copyfileobj(f, out, 1 << 20)
+        if columns_out is not None:
+            # In blocks so a CacheWriter never holds the whole flight
+            for start in range(0, rows, APPEND_ROWS):
+                stop = min(start + APPEND_ROWS, rows)
+                columns_out.append({name: np.ndarray((rows,), dtype=dtype, buffer=shm.buf, offset=offset)[start:stop].copy()
+                                    for name, (offset, dtype) in layout.items()})
+    finally:
+        for part in parts:
+            os.remove(part)
+        shm.close()
+        shm.unlink()
+
+    tokens = sum(shard["tokens"] for shard in scanned)
+    expected = int(starts[-1]) + FRAME_SIZE if len(starts) else 0
+    counts = {"frames": len(starts), "garbage": len(starts) - rows - deduplicator.duplicates,
+              "rejections": ecu_validate.first_reasons(reasons), "skipped": 0, "duplicates": deduplicator.duplicates,
+              "records": rows, "tokens": tokens, "leftover": max(tokens - expected, 0),
+              "resync_skips": ecu_resync.skipped_ranges(starts), "coverage": deduplicator.report()}
+    run_metrics.count_rejections(metrics, counts)
+    return counts
+
+
+def _write_quarantine(path, scanned, pieces, reasons):
+    # Quarantine rows of the rejected frames, their whole frames were kept by _scan
+    f, writer = ecu_validate.open_quarantine(path)
+    with f:
+        position = 0
+        for i, _, lo, hi in pieces:
+            rejected = np.flatnonzero(reasons[position:position + hi - lo])
+            extra = np.searchsorted(scanned[i]["extra_index"], rejected + lo)
+            frames = scanned[i]["extra_frames"][extra]
+            ecu_validate.write_quarantine(writer, frames, reasons[position + rejected], position + rejected)
+            position += hi - lo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode a large raw hex log into a CSV on several cores.")
+    parser.add_argument("input", help="raw hex log")
+    parser.add_argument("-o", "--output", default="decrypted_data.csv", help="CSV to write")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--quarantine", help="also write the rejected frames to this CSV")
+    args = parser.parse_args(argv)
+
+    counts = decode_parallel(args.input, args.output, args.workers, quarantine_csv=args.quarantine)
+    print(f"{counts['records']} records of {counts['frames']} frames written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import numpy as np
+import ecu_frame
+import ecu_validate
+
+FRAME_SIZE = ecu_frame.FRAME_SIZE
+
+# Fields checked for a frame to count as aligned, against the validation ranges
+# (ecu_validate.RANGES in raw units) widened by RESYNC_MARGIN of their span on
+# both sides. Every reading the validator accepts keeps a run going, and out of
+# range ones are quarantined with a reason code instead of skipped as garbage
+RESYNC_FIELDS = ["rpm", "baro", "map", "mat", "clt", "tps", "batt"]
+RESYNC_MARGIN = 0.25
+RESYNC_RANGES = {
+    field: (low - RESYNC_MARGIN * (high - low), high + RESYNC_MARGIN * (high - low))
+    for field, (low, high) in ((field, ecu_validate.RAW_RANGES[field]) for field in RESYNC_FIELDS)
+}
+
+# Largest Seconds increase between two consecutive frames of one run
+MAX_SECONDS_STEP = 5
+
+# How many values before the expected position a new lock may start (dropped bytes)
+BACKTRACK = 8
+
+_FIELD_FORMATS = {name: (offset, fmt) for name, offset, fmt in ecu_frame.RAW_FIELDS}
+
+
+def _field(tokens, name, m):
+    # Value of a raw field for a frame starting at every offset < m
+    offset, fmt = _FIELD_FORMATS[name]
+    values = tokens[offset:offset + m].astype(np.int32)
+    if np.dtype(fmt).itemsize == 2:
+        values = values + tokens[offset + 1:offset + 1 + m].astype(np.int32) * 256
+        if np.dtype(fmt).kind == "i":
+            values = np.where(values >= 0x8000, values - 0x10000, values)
+    return values
+
+
+def plausible(tokens):
+    """Plausibility of a frame starting at every token offset, returns (ok, seconds)."""
+    m = len(tokens) - FRAME_SIZE + 1
+    # No invalid tokens in the decoded bytes
+    invalid = np.concatenate([[0], np.cumsum(tokens < 0)])
+    ok = invalid[ecu_frame.DECODED_BYTES:ecu_frame.DECODED_BYTES + m] == invalid[:m]
+    for name, (low, high) in RESYNC_RANGES.items():
+        values = _field(tokens, name, m)
+        ok &= (values >= low) & (values <= high)
+    return ok, _field(tokens, "seconds", m)
+
+
+def _next_true(mask):
+    # Index of the first True at or after every position (len(mask) if none)
+    index = np.where(mask, np.arange(len(mask)), len(mask))
+    return np.append(np.minimum.accumulate(index[::-1])[::-1], len(mask))
+
+
+def _next_false_in_phase(mask):
+    # Index of the first False at or after every position in steps of FRAME_SIZE
+    m = len(mask)
+    rows = -(-m // FRAME_SIZE)
+    padded = np.zeros(rows * FRAME_SIZE, dtype=bool)
+    padded[:m] = mask
+    index = np.where(padded, rows * FRAME_SIZE + m, np.arange(rows * FRAME_SIZE)).reshape(rows, FRAME_SIZE)
+    return np.minimum.accumulate(index[::-1], axis=0)[::-1].ravel()[:m]
+
+
+def find_frames(tokens, start=0, limit=None, lowest=0, locked=False, backtrack=BACKTRACK):
+    """Find aligned frame starts in a token stream in linear time.
+
+    A lock needs two consecutive plausible frames with a small Seconds step,
+    a run then continues every 82 values until a frame fails the checks and
+    the search restarts just before the expected position. Only frames
+    starting before limit and no lock before lowest are accepted. If locked,
+    the frame before start was accepted and the run may continue at start.
+    Returns (starts, resume) where resume is the position the search stopped at.
+    """
+    m = len(tokens) - FRAME_SIZE + 1
+    if m <= 0:
+        return np.empty(0, dtype=np.int64), start
+    limit = m if limit is None else max(0, min(limit, m))
+    ok, seconds = plausible(tokens)
+    step_ok = np.zeros(m, dtype=bool)
+    step_ok[FRAME_SIZE:] = (seconds[FRAME_SIZE:] - seconds[:-FRAME_SIZE]) % 0x10000 <= MAX_SECONDS_STEP
+    good = ok.copy()
+    good[FRAME_SIZE:] &= ok[:-FRAME_SIZE] & step_ok[FRAME_SIZE:]
+    link = np.zeros(m, dtype=bool)
+    link[:m - FRAME_SIZE] = ok[:m - FRAME_SIZE] & good[FRAME_SIZE:]
+    next_link = _next_true(link)
+    next_bad = _next_false_in_phase(good)
+
+    runs = []
+    pos = start
+    while pos < limit:
+        if locked and pos == start and pos >= FRAME_SIZE and good[pos]:
+            j = pos
+        else:
+            j = next_link[max(pos - backtrack, lowest)]
+            if j >= limit:
+                break
+        end = next_bad[j + FRAME_SIZE] if j + FRAME_SIZE < m else m
+        run = np.arange(j, min(end, limit), FRAME_SIZE)
+        runs.append(run)
+        lowest = run[-1] + 1
+        pos = run[-1] + FRAME_SIZE
+    starts = np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+    return starts, pos
+
+
+def take_frames(tokens, starts):
+    """Gather the (n, 82) frames starting at the given offsets."""
+    return tokens[starts[:, None] + np.arange(FRAME_SIZE)]
+
+
+def skipped_ranges(starts, expected=0, offset=0):
+    """List (position, count) of values skipped before each frame (negative count = dropped values)."""
+    if len(starts) == 0:
+        return []
+    previous_end = np.concatenate([[expected], starts[:-1] + FRAME_SIZE])
+    gaps = np.flatnonzero(starts != previous_end)
+    return [(int(previous_end[i] + offset), int(starts[i] - previous_end[i])) for i in gaps]
+
+
+def iter_frames(f, block_size=ecu_frame.BLOCK_SIZE, counts=None):
+    """Yield resynchronised (n, 82) frame arrays from a raw hex log read in blocks.
+
+    Drop-in replacement for ecu_frame.iter_frames. The counts dict also gets
+    the list of (position, count) skips, positions are value offsets in the log.
+    """
+    for tokens, starts, _ in iter_frame_starts(f, block_size, counts):
+        yield take_frames(tokens, starts)
+
+
+def iter_frame_starts(f, block_size=ecu_frame.BLOCK_SIZE, counts=None):
+    """Like iter_frames, yields (tokens, starts, base): a token block, the frame starts
+    in it and the log position of its first value."""
+    pending = np.empty(0, dtype=np.int16)
+    base = start = expected = total = 0
+    last_start = -1
+    locked = False
+    skips = []
+    for tokens, last in ecu_frame.iter_tokens(f, block_size):
+        total += len(tokens)
+        if len(pending):
+            tokens = np.concatenate([pending, tokens])
+        # Keep one frame of look-ahead for the lock check until the end of the log
+        limit = None if last else len(tokens) - 2 * FRAME_SIZE + 1
+        starts, pos = find_frames(tokens, start, limit, max(last_start - base + 1, 0), locked)
+        if len(starts):
+            skips += skipped_ranges(starts + base, expected)
+            last_start = int(starts[-1]) + base
+            expected = last_start + FRAME_SIZE
+            yield tokens, starts, base
+        if last:
+            break
+        # Carry the unsearched tail, plus the last frame while a run is still going
+        stop = max(pos, limit, start)
+        locked = last_start >= 0 and stop + base == expected
+        keep = max(stop - BACKTRACK, 0)
+        if locked:
+            keep = min(keep, last_start - base)
+        pending = tokens[keep:].copy()
+        base += keep
+        start = stop - keep
+    if counts is not None:
+        counts["tokens"] = total
+        counts["leftover"] = max(total - expected, 0)
+        counts["resync_skips"] = skips
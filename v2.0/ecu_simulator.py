@@ -0,0 +1,79 @@
+import os
+import pty
+import select
+import threading
+import time
+import tty
+import numpy as np
+import ecu_frame
+import flight_cache
+
+# Recorded flight the simulator replays by default
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "decrypted_data.csv")
+
+
+class EcuSimulator:
+    """Fake ECU on a pseudo terminal for testing serial capture without hardware.
+
+    Every 'a' received is answered with the next 82 byte frame of a recorded
+    flight after response_delay seconds, a fraction short_rate of the
+    responses is cut short like a line glitch. Connect to self.port like
+    to a real serial port.
+    """
+
+    def __init__(self, csv_path=SAMPLE_CSV, response_delay=0.0, short_rate=0.0, seed=0):
+        df = flight_cache.load_dataframe(csv_path)
+        columns = {name: df[name].to_numpy() for name in ecu_frame.CSV_HEADERS}
+        # Bytes past the decoded ones are random like on the real ECU
+        fill = np.random.default_rng(seed).integers(0, 256, (len(df), ecu_frame.FRAME_SIZE), dtype=np.uint8)
+        self.frames = ecu_frame.encode_frames(columns, fill)
+        self.response_delay = response_delay
+        self.short_rate = short_rate
+        self._rng = np.random.default_rng(seed)
+        self.requests = 0
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def frame(self, i):
+        # The recorded flight is looped, Seconds keeps counting
+        frame = self.frames[i % len(self.frames)].copy()
+        seconds = int(frame[0]) + int(frame[1]) * 256 + i // len(self.frames) * len(self.frames)
+        frame[0], frame[1] = seconds & 0xff, seconds >> 8 & 0xff
+        return frame.tobytes()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            for _ in range(data.count(b"a")):
+                if self.response_delay:
+                    time.sleep(self.response_delay)
+                frame = self.frame(self.requests)
+                if self.short_rate and self._rng.random() < self.short_rate:
+                    frame = frame[:self._rng.integers(1, ecu_frame.FRAME_SIZE)]
+                os.write(self._master, frame)
+                self.requests += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,281 @@
+import csv
+import numpy as np
+import ecu_frame
+
+# Plausible values per raw field in CSV units: (low, high). They only reject
+# corrupted frames and sit well outside the flight_events rule thresholds, so
+# out of range readings still reach the event rules (flight_events.check_thresholds).
+# The ecu_resync lock check is derived from them, this is the one range table
+RANGES = {
+    "pw1": (0, 25000),             # us
+    "pw2": (0, 25000),
+    "rpm": (0, 12000),
+    "adv_deg": (0, 60),            # deg
+    "afrtgt1": (100, 200),         # AFR x10
+    "afrtgt2": (100, 200),
+    "wbo2_en1": (0, 1),
+    "wbo2_en2": (0, 1),
+    "baro": (20, 150),             # kPa
+    "map": (0, 300),               # kPa
+    "mat": (-40, 120),             # deg C
+    "clt": (-40, 300),             # deg C
+    "tps": (-5, 105),              # %
+    "batt": (2, 25),               # V
+}
+
+# Largest change between consecutive frames in CSV units, a frame that jumps
+# away from both neighbours by more is a spike
+STEPS = {
+    "rpm": 3000,
+    "baro": 5,
+    "mat": 10,
+    "clt": 25,
+    "batt": 3,
+}
+
+# Largest Seconds increase between consecutive frames, larger or backwards
+# steps to both neighbours make a frame a spike (a single reset is allowed)
+MAX_SECONDS_STEP = 5
+
+# Consistency: largest PW1/PW2 difference (us) and MAP over BARO (kPa), the
+# latter loose enough for the "MAP out of range" event to see high MAP
+MAX_PW_DIFFERENCE = 1000
+MAX_MAP_OVER_BARO = 100
+
+# Reason codes, one bit each in the reason mask of a frame
+CODES = (["parse"] + [f"range.{field}" for field in RANGES] + ["pw1_pw2", "map_baro", "seconds"]
+         + [f"step.{field}" for field in STEPS])
+BITS = {code: np.uint64(1 << i) for i, code in enumerate(CODES)}
+
+# Rejected frames with their reasons, written next to the CSV
+QUARANTINE_FILE = "quarantine.csv"
+
+_FIELD_INFO = {field: (scale, convert) for _, field, scale, convert, bit in ecu_frame.FIELDS if bit is None}
+
+
+def to_raw(field, value):
+    # CSV units -> raw field units
+    scale, convert = _FIELD_INFO[field]
+    if convert is not None:
+        value = ecu_frame.INVERSE_CONVERSIONS[convert](value)
+    return value * scale if scale else value
+
+
+# RANGES in raw field units, also the base of the ecu_resync lock check
+RAW_RANGES = {field: (to_raw(field, low), to_raw(field, high)) for field, (low, high) in RANGES.items()}
+_RAW_STEPS = {field: to_raw(field, step) - to_raw(field, 0) for field, step in STEPS.items()}
+
+
+def records(frames):
+    """RAW_DTYPE view (uint8 frames) or copy (token frames) of (n, 82) frames, and their invalid token mask."""
+    frames = np.asarray(frames)
+    if frames.dtype == np.uint8:
+        return np.ascontiguousarray(frames).view(ecu_frame.RAW_DTYPE)[:, 0], np.zeros(len(frames), dtype=bool)
+    invalid = (frames[:, :ecu_frame.DECODED_BYTES] < 0).any(axis=1)
+    return np.ascontiguousarray(frames & 0xff, dtype=np.uint8).view(ecu_frame.RAW_DTYPE)[:, 0], invalid
+
+
+def frame_reasons(raw, invalid=None):
+    """Reason mask of the checks that need no neighbours: parse, ranges and consistency."""
+    reasons = np.zeros(len(raw), dtype=np.uint64)
+    if invalid is not None:
+        reasons[invalid] |= BITS["parse"]
+    for field, (low, high) in RAW_RANGES.items():
+        values = raw[field]
+        reasons[(values < low) | (values > high)] |= BITS[f"range.{field}"]
+    pw1 = raw["pw1"].astype(np.int32)
+    reasons[np.abs(pw1 - raw["pw2"]) > MAX_PW_DIFFERENCE] |= BITS["pw1_pw2"]
+    reasons[raw["map"].astype(np.int32) - raw["baro"] > to_raw("map", MAX_MAP_OVER_BARO)] |= BITS["map_baro"]
+    return reasons
+
+
+def _step_checks(raw):
+    # (code, step between consecutive records too large) of every step check
+    yield "seconds", (raw["seconds"][1:].astype(np.int32) - raw["seconds"][:-1]) % 0x10000 > MAX_SECONDS_STEP
+    for field, step in _RAW_STEPS.items():
+        yield f"step.{field}", np.abs(np.diff(raw[field].astype(np.int32))) > step
+
+
+def jump_mask(raw):
+    """Records of a run that passed frame_reasons that jump away from at least one neighbour.
+
+    Every spike is one, so only these (and the ends of the run, whose
+    neighbours lie outside it) can be rejected by spike_reasons.
+    """
+    jumps = np.zeros(len(raw), dtype=bool)
+    for _, jump in _step_checks(raw):
+        jumps[1:] |= jump
+        jumps[:-1] |= jump
+    return jumps
+
+
+def spike_reasons(raw, has_previous=False, has_next=False):
+    """Reason mask of the step checks over a run of frames that passed frame_reasons.
+
+    A frame is a spike if it jumps away from both neighbours, so a level
+    change (or an ECU reset) is kept. With has_previous/has_next the first
+    and last record are only context and get no reasons themselves.
+    """
+    n = len(raw)
+    reasons = np.zeros(n, dtype=np.uint64)
+    if n < 2:
+        return reasons
+    for code, jump in _step_checks(raw):
+        # Jump to the previous and to the next frame, the ends have only one neighbour
+        before = np.concatenate([[False], jump])
+        after = np.concatenate([jump, [False]])
+        reasons[before & after] |= BITS[code]
+    if has_previous:
+        reasons[0] = 0
+    if has_next:
+        reasons[-1] = 0
+    return reasons
+
+
+def reason_names(mask):
+    """Reason codes of one reason mask, separated by ';'."""
+    mask = int(mask)
+    return ";".join(code for i, code in enumerate(CODES) if mask >> i & 1)
+
+
+def first_reasons(reasons):
+    """{code: number of frames} counting every rejected frame once, under its first reason."""
+    reasons = reasons[reasons != 0]
+    first = np.zeros(len(reasons), dtype=np.int64)
+    remaining = np.ones(len(reasons), dtype=bool)
+    for i in range(len(CODES)):
+        hit = remaining & ((reasons >> np.uint64(i)) & np.uint64(1) == 1)
+        first[hit] = i
+        remaining &= ~hit
+    counts = np.bincount(first, minlength=len(CODES))
+    return {code: int(n) for code, n in zip(CODES, counts) if n}
+
+
+def validate(frames):
+    """Reason mask of every frame of a whole array (0 = valid)."""
+    raw, invalid = records(frames)
+    reasons = frame_reasons(raw, invalid)
+    passed = np.flatnonzero(reasons == 0)
+    reasons[passed] = spike_reasons(raw[passed])
+    return reasons
+
+
+def valid_mask(frames):
+    """Frames that pass every check, replaces the old 00/f0 and zero third byte filter."""
+    return validate(frames) == 0
+
+
+class FrameValidator:
+    """Validate a stream of frame blocks, same result as validate() on all of them at once.
+
+    The last frame that passed the per frame checks waits for its
+    successor (the spike checks look at both neighbours), so push() returns
+    the verdicts of the other frames and finish() that of the last one.
+    Both return (frames, reasons, positions), positions counting frames from
+    the start of the stream. Valid frames come out in stream order, a held
+    back frame rejected as a spike may follow later rejected frames.
+    """
+
+    def __init__(self):
+        self.position = 0
+        self._previous = None
+        self._pending = None
+
+    def state(self):
+        """JSON compatible context (previous and held back frame) for restore(), e.g. between sync calls."""
+        pending = None
+        if self._pending is not None:
+            pending = [self._pending[0][0].tolist(), int(self._pending[2])]
+        previous = None
+        if self._previous is not None:
+            previous = {field: int(self._previous[field][0]) for field in ecu_frame.RAW_DTYPE.names}
+        return {"position": int(self.position), "previous": previous, "pending": pending}
+
+    @classmethod
+    def restore(cls, state):
+        """Validator continuing from a state() (None: a new stream)."""
+        validator = cls()
+        if state:
+            validator.position = state["position"]
+            if state["previous"] is not None:
+                validator._previous = np.zeros(1, dtype=ecu_frame.RAW_DTYPE)
+                for field, value in state["previous"].items():
+                    validator._previous[field] = value
+            if state["pending"] is not None:
+                tokens, position = state["pending"]
+                frame = np.array([tokens], dtype=np.int16)
+                validator._pending = (frame, records(frame)[0].copy(), position)
+        return validator
+
+    def push(self, frames):
+        return self._judge(np.asarray(frames), False)
+
+    def finish(self):
+        empty = np.empty((0, ecu_frame.FRAME_SIZE), dtype=np.int16 if self._pending is None else self._pending[0].dtype)
+        return self._judge(empty, True)
+
+    def _judge(self, frames, last):
+        raw, invalid = records(frames)
+        reasons = frame_reasons(raw, invalid)
+        positions = self.position + np.arange(len(frames))
+        self.position += len(frames)
+        passed = np.flatnonzero(reasons == 0)
+
+        # Run of candidates: last accepted frame (context), pending frame, this block's passed frames
+        run = [raw[passed]]
+        if self._pending is not None:
+            pending_frame, pending_raw, pending_position = self._pending
+            run.insert(0, pending_raw)
+            frames = np.concatenate([pending_frame.astype(frames.dtype, copy=False), frames])
+            reasons = np.concatenate([np.zeros(1, dtype=np.uint64), reasons])
+            positions = np.concatenate([[pending_position], positions])
+            passed = np.concatenate([[0], passed + 1])
+        if self._previous is not None:
+            run.insert(0, self._previous)
+        run = np.concatenate(run)
+        spikes = spike_reasons(run, self._previous is not None, not last)
+        if self._previous is not None:
+            spikes = spikes[1:]
+        reasons[passed] = spikes
+
+        self._pending = None
+        if not last and len(passed):
+            # Hold back the last candidate until the next block shows its successor
+            hold = passed[-1]
+            self._pending = (frames[hold:hold + 1].copy(), run[-1:].copy(), positions[hold])
+            if len(run) > 1:
+                self._previous = run[-2:-1].copy()
+            keep = np.ones(len(frames), dtype=bool)
+            keep[hold] = False
+            frames, reasons, positions = frames[keep], reasons[keep], positions[keep]
+        # The held back frame goes before the frames of this block
+        order = np.argsort(positions, kind="stable")
+        return frames[order], reasons[order], positions[order]
+
+
+def iter_valid(blocks):
+    """Valid frames of a stream of frame blocks, block by block (see FrameValidator)."""
+    validator = FrameValidator()
+    for frames in blocks:
+        frames, reasons, _ = validator.push(frames)
+        yield frames[reasons == 0]
+    frames, reasons, _ = validator.finish()
+    yield frames[reasons == 0]
+
+
+def write_quarantine(writer, frames, reasons, positions):
+    """Write rejected frames (reasons != 0) as CSV rows: frame position, reason codes, hex bytes."""
+    rejected = np.flatnonzero(reasons)
+    if not len(rejected):
+        return 0
+    lines = ecu_frame.format_frames(np.asarray(frames)[rejected].astype(np.int16)).decode().splitlines()
+    writer.writerows((int(positions[i]), reason_names(reasons[i]), line) for i, line in zip(rejected, lines))
+    return len(rejected)
+
+
+def open_quarantine(path):
+    """Open a quarantine CSV for writing, returns (file, csv writer) with the header written."""
+    f = open(path, "w", newline="")
+    writer = csv.writer(f)
+    writer.writerow(["frame", "reasons", "hex"])
+    return f, writer
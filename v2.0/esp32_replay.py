@@ -0,0 +1,247 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import ecu_binlog
+import ecu_frame
+import ecu_resync
+import flight_cache
+
+# Pages served from next to this file, like index.html from the SD card
+STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Firmware request interval (interval in ECU_SDLOG_HTTP.ino), seconds
+INTERVAL = 1.0
+
+DEFAULT_PORT = 8080
+
+# Largest number of bytes one damaged response loses
+MAX_DROPPED_BYTES = 8
+
+
+def load_frames(path, seed=0):
+    """(n, 82) frames of a recorded flight: raw hex log (resynchronised), binary log or decrypted CSV."""
+    if ecu_binlog.is_binlog(path):
+        return np.array(ecu_binlog.BinLog(path).frames)
+    if path.lower().endswith(".csv"):
+        columns = flight_cache.load_flight(path)
+        # Bytes past the decoded ones are random like on the real ECU
+        fill = np.random.default_rng(seed).integers(0, 256, (len(columns["Seconds"]), ecu_frame.FRAME_SIZE), dtype=np.uint8)
+        return ecu_frame.encode_frames(columns, fill)
+    with open(path, "rb") as f:
+        parts = list(ecu_resync.iter_frames(f))
+    return np.concatenate(parts) if parts else np.empty((0, ecu_frame.FRAME_SIZE), dtype=np.int16)
+
+
+class ReplayServer:
+    """Stand-in for the datalogger: replays a recorded flight over the firmware's HTTP routes.
+
+    Like ECUdata() in ECU_SDLOG_HTTP.ino, every interval/speed seconds the
+    current packet is appended to the SD log and the next ECU response
+    becomes the current packet, after up to jitter seconds. A fraction
+    drop_rate of the responses lose a few bytes and for a fraction
+    duplicate_rate of the requests no response comes, so the same packet
+    is logged (and served on /data) again. The firmware ignores Range
+    requests, ranges=True answers them like a regular HTTP server.
+    """
+
+    def __init__(self, frames, host="127.0.0.1", port=DEFAULT_PORT, interval=INTERVAL, speed=1.0, jitter=0.0,
+                 drop_rate=0.0, duplicate_rate=0.0, loop=False, sd_path=None, ranges=False, seed=0):
+        self.frames = frames
+        self.period = interval / speed
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.duplicate_rate = duplicate_rate
+        self.loop = loop
+        self.ranges = ranges
+        self._rng = np.random.default_rng(seed)
+        self._tmpdir = None
+        if sd_path is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="esp32_replay_")
+            sd_path = os.path.join(self._tmpdir, "hello.txt")
+        self.sd_path = sd_path
+        open(sd_path, "wb").close()
+        self.packet = b""
+        self.ticks = 0
+        self.responses = 0
+        self.duplicates = 0
+        self.dropped_bytes = 0
+        self.finished = threading.Event()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._http = _HTTPServer((host, port), _Handler)
+        self._http.replay = self
+        self._threads = [threading.Thread(target=self._http.serve_forever, daemon=True),
+                         threading.Thread(target=self._clock, daemon=True)]
+
+    @property
+    def url(self):
+        host, port = self._http.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def frame(self, i):
+        """Packet text of ECU response i, a looped flight keeps counting Seconds."""
+        n = len(self.frames)
+        frame = self.frames[i % n].astype(np.int16)
+        if i >= n:
+            seconds = int(frame[0]) + int(frame[1]) * 256 + i // n * n
+            frame[0], frame[1] = seconds & 0xff, seconds >> 8 & 0xff
+        if self.drop_rate and self._rng.random() < self.drop_rate:
+            lost = self._rng.choice(len(frame), int(self._rng.integers(1, MAX_DROPPED_BYTES + 1)), replace=False)
+            frame = np.delete(frame, lost)
+            self.dropped_bytes += len(lost)
+        return ecu_frame.hex_text(frame)
+
+    def _clock(self):
+        started = time.monotonic()
+        i = 0
+        while not self._stop.is_set():
+            if self._stop.wait(max(0.0, started + self.ticks * self.period - time.monotonic())):
+                break
+            # The firmware logs the latest response, then requests the next one
+            with self.lock:
+                if self.packet:
+                    with open(self.sd_path, "ab") as f:
+                        f.write(self.packet)
+            self.ticks += 1
+            if i >= len(self.frames) and not self.loop:
+                self.finished.set()
+                break
+            if self.duplicate_rate and self._rng.random() < self.duplicate_rate:
+                self.duplicates += 1
+                continue
+            if self.jitter and self._stop.wait(self._rng.uniform(0, min(self.jitter, self.period))):
+                break
+            packet = self.frame(i)
+            with self.lock:
+                self.packet = packet
+            self.responses += 1
+            i += 1
+
+    def delete_log(self):
+        with self.lock:
+            if os.path.exists(self.sd_path):
+                os.remove(self.sd_path)
+            open(self.sd_path, "wb").close()
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._http.shutdown()
+        self._http.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # Many load test clients connect at once
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # The routes of ECU_SDLOG_HTTP.ino
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        replay = self.server.replay
+        path = self.path.split("?", 1)[0]
+        if path == "/":
+            with open(os.path.join(STATIC_DIR, "index.html"), "rb") as f:
+                self._send(200, "text/html", f.read())
+        elif path == "/data":
+            with replay.lock:
+                packet = replay.packet
+            self._send(200, "text/plain", packet)
+        elif path in ("/download", "/view-data"):
+            self._send_log(replay, attachment=path == "/download")
+        elif path == "/delete":
+            replay.delete_log()
+            self._send(200, "text/plain", b"data.txt was deleted.")
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def _send(self, status, content_type, body, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_log(self, replay, attachment):
+        with replay.lock:
+            with open(replay.sd_path, "rb") as f:
+                data = f.read()
+        headers = [("Content-Disposition", 'attachment; filename="hello.txt"')] if attachment else []
+        first = _range_start(self.headers.get("Range")) if replay.ranges else None
+        if first is None:
+            self._send(200, "text/plain", data, headers)
+        elif first >= len(data):
+            self._send(416, "text/plain", b"", headers + [("Content-Range", f"bytes */{len(data)}")])
+        else:
+            self._send(206, "text/plain", data[first:], headers + [("Content-Range", f"bytes {first}-{len(data) - 1}/{len(data)}")])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _range_start(header):
+    # First byte of a "bytes=N-" Range header, None if there is none
+    if not header or not header.startswith("bytes="):
+        return None
+    first = header[len("bytes="):].split("-", 1)[0]
+    return int(first) if first.isdigit() else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a recorded flight over the datalogger's HTTP routes.")
+    parser.add_argument("log", help="raw hex log, binary log or decrypted CSV to replay")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between ECU requests (firmware: 1)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than real time")
+    parser.add_argument("--jitter", type=float, default=0.0, help="largest response delay (seconds)")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="fraction of responses that lose bytes")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="fraction of requests without a new response")
+    parser.add_argument("--loop", action="store_true", help="start over at the end of the flight")
+    parser.add_argument("--sd", help="file used as the SD card log (default: a temporary file)")
+    parser.add_argument("--ranges", action="store_true", help="answer Range requests (the firmware does not)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the injected faults")
+    args = parser.parse_args(argv)
+
+    frames = load_frames(args.log, args.seed)
+    server = ReplayServer(frames, args.host, args.port, args.interval, args.speed, args.jitter, args.drop_rate,
+                          args.duplicate_rate, args.loop, args.sd, args.ranges, args.seed)
+    print(f"Replaying {len(frames)} frames at {server.url} ({1 / server.period:g} frames/s)")
+    with server:
+        try:
+            while not server.finished.wait(1):
+                pass
+            print("End of the flight reached")
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    print(f"{server.responses} responses, {server.duplicates} repeated, {server.dropped_bytes} bytes dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import ecu_binlog
+import ecu_frame
+import ecu_resync
+import ecu_validate
+import flight_coverage
+
+# Decoded flights are cached as one .npy file per column under a content hash
+CACHE_DIR = os.environ.get("ECU_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ecu_datalogger"))
+MAX_CACHE_BYTES = int(os.environ.get("ECU_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+_INDEX = "index.json"
+_META = "columns.json"
+_INFO = "info.json"
+
+# Rows copied per step when a CacheWriter finishes its columns
+COPY_ROWS = 1 << 20
+
+# Version of what a cached flight holds, bump it when decoding changes (validation,
+# dropped repeats, column types) so older entries are misses
+CACHE_VERSION = 3
+
+
+def file_key(path, cache_dir=CACHE_DIR):
+    """SHA-256 of a file, remembered per path/size/mtime so unchanged files are not re-hashed."""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, _INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    entry = index.get(path)
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(ecu_frame.BLOCK_SIZE), b""):
+            digest.update(block)
+    key = digest.hexdigest()
+
+    index[path] = [stat.st_size, stat.st_mtime_ns, key]
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return key
+
+
+def _current_entry(path, cache_dir):
+    # (entry directory, column names) of a cached flight of this CACHE_VERSION, a stale entry is removed
+    entry = os.path.join(cache_dir, file_key(path, cache_dir))
+    try:
+        with open(os.path.join(entry, _META)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return entry, None
+    if not isinstance(meta, dict) or meta.get("version") != CACHE_VERSION:
+        shutil.rmtree(entry, ignore_errors=True)
+        return entry, None
+    return entry, meta["columns"]
+
+
+def load(path, cache_dir=CACHE_DIR):
+    """Memory-mapped columns of a cached flight, or None if it is not cached (or cached by an older version)."""
+    entry, names = _current_entry(path, cache_dir)
+    if names is None:
+        return None
+    # Touch the entry so eviction drops the least recently used flights first
+    os.utime(entry)
+    return {name: np.load(os.path.join(entry, f"{i:02d}.npy"), mmap_mode="r") for i, name in enumerate(names)}
+
+
+def load_info(path, cache_dir=CACHE_DIR):
+    """Extra information stored with a cached flight (e.g. decode counts), {} if none."""
+    entry, names = _current_entry(path, cache_dir)
+    if names is None:
+        return {}
+    try:
+        with open(os.path.join(entry, _INFO)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cached_file(path, name, cache_dir=CACHE_DIR):
+    """Path of a file stored with a cached flight (see CacheWriter.close), None if there is none."""
+    entry, names = _current_entry(path, cache_dir)
+    file_path = os.path.join(entry, name)
+    return file_path if names is not None and os.path.isfile(file_path) else None
+
+
+def store(path, columns, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, info=None):
+    """Cache decoded columns (and optional info dict) for a file, evicting old flights over the size limit."""
+    entry = os.path.join(cache_dir, file_key(path, cache_dir))
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    for i, values in enumerate(columns.values()):
+        np.save(os.path.join(tmp, f"{i:02d}.npy"), np.asarray(values))
+    _finish(tmp, entry, list(columns), info, cache_dir, max_bytes)
+
+
+class CacheWriter:
+    """Cache the columns of a flight block by block, so memory does not grow with the log.
+
+    append() takes decoded column blocks (a CacheWriter can be the
+    columns_out of ecu_frame.stream_csv or ecu_parallel.decode_parallel),
+    close() turns them into the cached .npy files, abort() drops them.
+    """
+
+    def __init__(self, path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entry = os.path.join(cache_dir, file_key(path, cache_dir))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self._tmp = tempfile.mkdtemp(dir=cache_dir)
+        # Column name -> (raw data file, dtype)
+        self._files = None
+
+    def append(self, columns):
+        if self._files is None:
+            self._files = {name: (open(os.path.join(self._tmp, f"{i:02d}.bin"), "wb"), np.asarray(values).dtype)
+                           for i, (name, values) in enumerate(columns.items())}
+        for name, values in columns.items():
+            f, dtype = self._files[name]
+            np.ascontiguousarray(values, dtype=dtype).tofile(f)
+        self.rows += len(columns["Seconds"])
+
+    def close(self, info=None, files=()):
+        """Finish the entry with its info dict and copies of files (e.g. the quarantine CSV)."""
+        for file_path in files:
+            shutil.copyfile(file_path, os.path.join(self._tmp, os.path.basename(file_path)))
+        if self._files is None:
+            self.append({name: np.empty(0, dtype=dtype) for name, dtype in ecu_frame.COLUMN_DTYPES.items()})
+        for i, (f, dtype) in enumerate(self._files.values()):
+            f.close()
+            data_path = os.path.join(self._tmp, f"{i:02d}.bin")
+            npy_path = os.path.join(self._tmp, f"{i:02d}.npy")
+            if self.rows:
+                data = np.memmap(data_path, dtype=dtype, mode="r", shape=(self.rows,))
+                out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=(self.rows,))
+                for start in range(0, self.rows, COPY_ROWS):
+                    out[start:start + COPY_ROWS] = data[start:start + COPY_ROWS]
+                out.flush()
+                del data, out
+            else:
+                np.save(npy_path, np.empty(0, dtype=dtype))
+            os.remove(data_path)
+        _finish(self._tmp, self.entry, list(self._files), info, self.cache_dir, self.max_bytes)
+
+    def abort(self):
+        for f, _ in (self._files or {}).values():
+            f.close()
+        shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def _finish(tmp, entry, names, info, cache_dir, max_bytes):
+    # Write the metadata of a filled temporary entry, move it into place and evict
+    if info is not None:
+        with open(os.path.join(tmp, _INFO), "w") as f:
+            json.dump(info, f)
+    with open(os.path.join(tmp, _META), "w") as f:
+        json.dump({"version": CACHE_VERSION, "columns": names}, f)
+    _commit(tmp, entry, info is not None)
+    evict(cache_dir, max_bytes)
+
+
+def _commit(tmp, entry, has_info):
+    # Move a finished entry into place, it replaces an entry without info when it has some
+    try:
+        os.rename(tmp, entry)
+        return
+    except OSError:
+        pass
+    if has_info and not os.path.exists(os.path.join(entry, _INFO)):
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+            return
+        except OSError:
+            pass
+    # Already cached by someone else
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    """Remove least recently used flights until the cache fits in max_bytes, and the index entries of removed flights."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if os.path.isfile(os.path.join(entry, _META)):
+            size = sum(f.stat().st_size for f in os.scandir(entry))
+            entries.append((os.stat(entry).st_mtime, size, entry))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+    _prune_index(cache_dir)
+
+
+def _prune_index(cache_dir):
+    # Drop the remembered hashes of files whose flight is no longer cached
+    index_path = os.path.join(cache_dir, _INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return
+    kept = {path: entry for path, entry in index.items() if os.path.isdir(os.path.join(cache_dir, entry[2]))}
+    if len(kept) == len(index):
+        return
+    fd, tmp = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(kept, f)
+    os.replace(tmp, index_path)
+
+
+def iter_decoded(path):
+    """Decoded column blocks of a raw hex or binary log (resync, validation, decode, repeated rows dropped)."""
+    frame_source = ecu_binlog.iter_frames if ecu_binlog.is_binlog(path) else ecu_resync.iter_frames
+    with open(path, "rb") as f:
+        blocks = (ecu_frame.decode_frames(frames)[0] for frames in ecu_validate.iter_valid(frame_source(f)))
+        yield from flight_coverage.iter_unique(blocks)
+
+
+def decode_log(path):
+    """Decode a raw hex log into columns, see iter_decoded."""
+    return ecu_frame.concat_columns(list(iter_decoded(path)))
+
+
+def read_csv(path):
+    """Read a decrypted CSV into columns."""
+    df = pd.read_csv(path, names=ecu_frame.CSV_HEADERS, header=0, dtype=ecu_frame.COLUMN_DTYPES)
+    return {name: df[name].to_numpy() for name in ecu_frame.CSV_HEADERS}
+
+
+def load_flight(path, cache_dir=CACHE_DIR):
+    """Columns of a flight from the cache, decoding the CSV or raw log on a miss."""
+    columns = load(path, cache_dir)
+    if columns is not None:
+        return columns
+    if path.lower().endswith(".csv"):
+        columns = read_csv(path)
+        store(path, columns, cache_dir)
+        return columns
+    # Raw logs go to the cache block by block and are read back memory-mapped
+    writer = CacheWriter(path, cache_dir)
+    try:
+        for columns in iter_decoded(path):
+            writer.append(columns)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return load(path, cache_dir)
+
+
+def load_dataframe(path, cache_dir=CACHE_DIR):
+    """DataFrame of a flight, see load_flight."""
+    return pd.DataFrame(load_flight(path, cache_dir))
@@ -0,0 +1,317 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+import numpy as np
+import ecu_frame
+import flight_cache
+import flight_events
+import flight_stats
+from time_index import TimeIndex, format_hms
+
+# Catalog of every processed flight, kept outside the flight cache so eviction does not touch it
+CATALOG_PATH = os.environ.get("ECU_CATALOG", os.path.join(os.path.expanduser("~"), ".ecu_datalogger", "catalog.sqlite"))
+
+# Length of the pre-aggregated segments (seconds of flight time)
+SEGMENT_SECONDS = 60
+
+# Per segment aggregates of every statistics channel, named after the raw field (e.g. clt_max)
+AGGREGATES = ["min", "max", "mean"]
+SEGMENT_COLUMNS = [f"{field}_{aggregate}" for _, field, _, _ in flight_stats.STAT_FIELDS for aggregate in AGGREGATES]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS flights (
+    id INTEGER PRIMARY KEY,
+    source_hash TEXT UNIQUE NOT NULL,
+    source_path TEXT NOT NULL,
+    csv_path TEXT,
+    output_dir TEXT,
+    ingested TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    start_time INTEGER,
+    end_time INTEGER,
+    duration INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_stats (
+    flight_id INTEGER NOT NULL REFERENCES flights(id) ON DELETE CASCADE,
+    channel TEXT NOT NULL,
+    min REAL, max REAL, mean REAL, std REAL,
+    PRIMARY KEY (flight_id, channel)
+);
+CREATE TABLE IF NOT EXISTS segments (
+    flight_id INTEGER NOT NULL REFERENCES flights(id) ON DELETE CASCADE,
+    segment INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    {", ".join(f"{column} REAL" for column in SEGMENT_COLUMNS)},
+    PRIMARY KEY (flight_id, segment)
+);
+CREATE TABLE IF NOT EXISTS events (
+    flight_id INTEGER NOT NULL REFERENCES flights(id) ON DELETE CASCADE,
+    rule TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    min REAL, max REAL
+);
+CREATE INDEX IF NOT EXISTS events_flight ON events (flight_id);
+"""
+
+# A query condition: segment column, operator, number (e.g. "clt_max>200")
+_CONDITION = re.compile(r"^\s*(\w+)\s*(<=|>=|<|>|=)\s*(-?\d+(?:\.\d*)?)\s*$")
+
+
+def segment_aggregates(columns, time, seconds=SEGMENT_SECONDS):
+    """Per segment rows (segment, start, end, samples, aggregates...) of a flight.
+
+    Segments are fixed slices of flight time, time never goes backwards so
+    the samples of a segment are contiguous and reduceat aggregates them.
+    """
+    time = np.asarray(time)
+    if not len(time):
+        return []
+    segment = time // seconds
+    starts = np.flatnonzero(np.diff(segment, prepend=segment[0] - 1))
+    counts = np.diff(np.append(starts, len(time)))
+    values = [segment[starts], time[starts], time[np.append(starts[1:], len(time)) - 1], counts]
+    for header, _, _, _ in flight_stats.STAT_FIELDS:
+        channel = np.asarray(columns[header], dtype=np.float64)
+        values += [np.minimum.reduceat(channel, starts), np.maximum.reduceat(channel, starts),
+                   np.add.reduceat(channel, starts) / counts]
+    return list(zip(*(column.tolist() for column in values)))
+
+
+def parse_condition(text):
+    """(column, operator, value) of a condition such as "clt_max>200"."""
+    match = _CONDITION.match(text)
+    if not match or match.group(1) not in SEGMENT_COLUMNS:
+        raise ValueError(f"Bad condition {text!r}, expected <column><op><number> with a column of: {', '.join(SEGMENT_COLUMNS)}")
+    return match.group(1), match.group(2), float(match.group(3))
+
+
+class Catalog:
+    """SQLite catalog of processed flights.
+
+    Every flight is stored once per source hash with its per channel
+    statistics, per segment aggregates and detected events, so cross flight
+    questions are answered from the aggregates alone. Only samples() reads
+    the decoded flight (CSV, flight cache or raw log).
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Batch workers ingest concurrently, wait for the write lock instead of failing
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def flight_id(self, source_hash):
+        row = self.db.execute("SELECT id FROM flights WHERE source_hash = ?", (source_hash,)).fetchone()
+        return row["id"] if row else None
+
+    def flight_of_csv(self, csv_path):
+        """Id of the flight whose decoded CSV is csv_path, None if there is none."""
+        row = self.db.execute("SELECT id FROM flights WHERE csv_path = ?", (os.path.abspath(csv_path),)).fetchone()
+        return row["id"] if row else None
+
+    def ingest(self, source, csv_path=None, output_dir=None, force=False, columns=None):
+        """Add a flight decoded from source (a raw or binary log, or a CSV), returns its id.
+
+        Flights already in the catalog are skipped (re-ingested with force).
+        The decoded columns are the given ones, else read from csv_path if
+        given, statistics and events from flight_stats.json and events.csv
+        in output_dir if they exist.
+        """
+        source_hash = flight_cache.file_key(source)
+        existing = self.flight_id(source_hash)
+        if existing is not None and not force:
+            return existing
+
+        if columns is None:
+            columns = flight_cache.load_flight(csv_path or source)
+        time_index = TimeIndex(columns["Seconds"])
+        stats_path = os.path.join(output_dir, flight_stats.SUMMARY_FILE) if output_dir else None
+        if stats_path and os.path.exists(stats_path):
+            stats = flight_stats.read_stats(stats_path)
+        else:
+            stats = flight_stats.FlightStats()
+            stats.update(columns)
+        events_path = os.path.join(output_dir, flight_events.EVENTS_FILE) if output_dir else None
+        if events_path and os.path.exists(events_path):
+            events = flight_events.read_timeline(events_path)
+        else:
+            events = flight_events.detect(columns)
+        summary = stats.summary()
+        flight_time = time_index.time
+
+        with self.db:
+            if existing is not None:
+                self.db.execute("DELETE FROM flights WHERE id = ?", (existing,))
+            cursor = self.db.execute(
+                "INSERT INTO flights (source_hash, source_path, csv_path, output_dir, ingested, records, start_time, end_time, duration)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source_hash, os.path.abspath(source), csv_path and os.path.abspath(csv_path), output_dir and os.path.abspath(output_dir),
+                 time.strftime("%Y-%m-%dT%H:%M:%S"), len(flight_time),
+                 int(flight_time[0]) if len(flight_time) else None, int(flight_time[-1]) if len(flight_time) else None,
+                 summary["duration"]))
+            flight_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO channel_stats VALUES (?, ?, ?, ?, ?, ?)",
+                [(flight_id, header, s["min"], s["max"], s["mean"], s["std"]) for header, s in summary["channels"].items()])
+            self.db.executemany(
+                f"INSERT INTO segments VALUES ({', '.join('?' * (len(SEGMENT_COLUMNS) + 5))})",
+                [(flight_id,) + row for row in segment_aggregates(columns, flight_time)])
+            self.db.executemany(
+                "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(flight_id, e.rule, e.channel, e.start, e.end, e.min, e.max) for e in events])
+        return flight_id
+
+    def flights(self):
+        """Every flight, oldest first."""
+        return [dict(row) for row in self.db.execute("SELECT * FROM flights ORDER BY id")]
+
+    def flight(self, flight_id):
+        row = self.db.execute("SELECT * FROM flights WHERE id = ?", (flight_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No flight {flight_id} in the catalog")
+        return dict(row)
+
+    def channel_stats(self, flight_id):
+        """Per channel min/max/mean/std of a flight."""
+        return {row["channel"]: dict(row) for row in self.db.execute(
+            "SELECT channel, min, max, mean, std FROM channel_stats WHERE flight_id = ?", (flight_id,))}
+
+    def events(self, flight_id=None, rule=None):
+        """Detected events, of one flight and/or one rule."""
+        sql = "SELECT * FROM events WHERE (? IS NULL OR flight_id = ?) AND (? IS NULL OR rule = ?) ORDER BY flight_id, start_time"
+        return [dict(row) for row in self.db.execute(sql, (flight_id, flight_id, rule, rule))]
+
+    def find_segments(self, conditions, flight_ids=None):
+        """Segments meeting every condition ("clt_max>200" or (column, op, value)), from the aggregates only."""
+        conditions = [parse_condition(c) if isinstance(c, str) else c for c in conditions]
+        for column, op, _ in conditions:
+            if column not in SEGMENT_COLUMNS or op not in ("<", "<=", ">", ">=", "="):
+                raise ValueError(f"Bad condition {column}{op}")
+        where = [f"{column} {op} ?" for column, op, _ in conditions]
+        params = [value for _, _, value in conditions]
+        if flight_ids is not None:
+            where.append(f"flight_id IN ({', '.join('?' * len(flight_ids))})")
+            params += list(flight_ids)
+        columns = list(dict.fromkeys(column for column, _, _ in conditions))
+        sql = (f"SELECT flight_id, segment, start_time, end_time, samples{''.join(', ' + c for c in columns)} FROM segments"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY flight_id, segment")
+        return [dict(row) for row in self.db.execute(sql, params)]
+
+    def find_flights(self, conditions):
+        """Flights with at least one segment meeting every condition: flight row plus matching segment count and time."""
+        matches = {}
+        for segment in self.find_segments(conditions):
+            entry = matches.setdefault(segment["flight_id"], dict(self.flight(segment["flight_id"]), segments=0, seconds=0))
+            entry["segments"] += 1
+            entry["seconds"] += segment["end_time"] - segment["start_time"] + 1
+        return list(matches.values())
+
+    def samples(self, flight_id, t0=None, t1=None, channels=None):
+        """Full resolution columns of a flight between flight times t0 and t1, read from its CSV or source log."""
+        flight = self.flight(flight_id)
+        path = flight["csv_path"] if flight["csv_path"] and os.path.exists(flight["csv_path"]) else flight["source_path"]
+        columns = flight_cache.load_flight(path)
+        names = ["Seconds"] + [name for name in channels or ecu_frame.CSV_HEADERS if name != "Seconds"]
+        return TimeIndex(columns["Seconds"]).select(columns, names, t0, t1)
+
+
+def ingest_paths(catalog, paths, force=False):
+    """Ingest logs, CSVs or batch output folders (<log>_out with decrypted_data.csv), returns the new flight ids."""
+    added = []
+    for path in paths:
+        csv_path = output_dir = None
+        if os.path.isdir(path):
+            csv_path = os.path.join(path, "decrypted_data.csv")
+            if not os.path.exists(csv_path):
+                print(f"Skipping {path}: no decrypted_data.csv")
+                continue
+            output_dir, source = path, csv_path
+        else:
+            source = path
+        # A batch output folder of a log that was ingested with its output is known too
+        known = catalog.flight_id(flight_cache.file_key(source)) is not None or (csv_path and catalog.flight_of_csv(csv_path))
+        if known and not force:
+            continue
+        added.append(catalog.ingest(source, csv_path, output_dir, force))
+        print(f"Ingested {path}")
+    return added
+
+
+def print_flights(flights):
+    print(f"{'Id':>4} {'Records':>9} {'Duration':>9} {'Segments':>8}  Source")
+    for flight in flights:
+        segments = f"{flight['segments']:>8}" if "segments" in flight else f"{'':>8}"
+        print(f"{flight['id']:>4} {flight['records']:>9} {format_hms(flight['duration']):>9} {segments}  {flight['source_path']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalog of processed flights, queried from per segment aggregates.")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="catalog database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="add logs, CSVs or batch output folders (known flights are skipped)")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--force", action="store_true", help="re-ingest flights already in the catalog")
+    commands.add_parser("flights", help="list the flights")
+    query = commands.add_parser("query", help="flights with a segment meeting every condition, e.g. clt_max>200 rpm_max>6000")
+    query.add_argument("conditions", nargs="+", help=f"<column><op><number>, columns: {', '.join(SEGMENT_COLUMNS)}")
+    query.add_argument("--segments", action="store_true", help="list the matching segments")
+    events = commands.add_parser("events", help="list detected events")
+    events.add_argument("--flight", type=int)
+    events.add_argument("--rule")
+    samples = commands.add_parser("samples", help="write the full resolution samples of a flight time window to a CSV")
+    samples.add_argument("flight", type=int)
+    samples.add_argument("--start", type=float, help="flight time (s)")
+    samples.add_argument("--end", type=float, help="flight time (s)")
+    samples.add_argument("-o", "--output", required=True, help="CSV to write")
+    args = parser.parse_args(argv)
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == "ingest":
+            added = ingest_paths(catalog, args.paths, args.force)
+            print(f"{len(added)} flights added, {len(catalog.flights())} in the catalog")
+        elif args.command == "flights":
+            print_flights(catalog.flights())
+        elif args.command == "query":
+            try:
+                if args.segments:
+                    for segment in catalog.find_segments(args.conditions):
+                        values = "  ".join(f"{key} {value:g}" for key, value in segment.items() if key in SEGMENT_COLUMNS)
+                        print(f"flight {segment['flight_id']:>4}  {format_hms(segment['start_time'])}-{format_hms(segment['end_time'])}  {values}")
+                else:
+                    print_flights(catalog.find_flights(args.conditions))
+            except ValueError as e:
+                print(e)
+                return 1
+        elif args.command == "events":
+            for event in catalog.events(args.flight, args.rule):
+                print(f"flight {event['flight_id']:>4}  {format_hms(event['start_time'])}-{format_hms(event['end_time'])}  "
+                      f"{event['rule']}: {event['channel']} {event['min']:g}..{event['max']:g}")
+        elif args.command == "samples":
+            columns = catalog.samples(args.flight, args.start, args.end)
+            ecu_frame.write_csv(args.output, columns)
+            print(f"Wrote {len(columns['Seconds'])} samples to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import json
+import os
+import numpy as np
+import ecu_frame
+from time_index import GAP_SECONDS, unwrap_steps
+
+# Coverage report written next to the CSV
+COVERAGE_FILE = "coverage.json"
+
+# Raw fields compared by record_columns and the engine bits that are decoded
+_RAW_FIELDS = list(dict.fromkeys(field for _, field, _, _, bit in ecu_frame.FIELDS if bit is None))
+_ENGINE_BITS = sum(1 << bit for _, field, _, _, bit in ecu_frame.FIELDS if bit is not None)
+
+
+def record_columns(raw):
+    """Columns of RAW_DTYPE records that are equal exactly when their decoded rows are, without decoding."""
+    columns = {"Seconds": raw["seconds"]}
+    columns.update((field, raw[field]) for field in _RAW_FIELDS if field != "seconds")
+    columns["engine"] = raw["engine"] & _ENGINE_BITS
+    return columns
+
+
+def duplicate_mask(columns, previous=None):
+    """Rows equal in every column to the row before them.
+
+    previous is the row before the first one (a dict of one element
+    arrays, e.g. the last row of the previous block) or None.
+    """
+    n = len(columns["Seconds"])
+    same = np.ones(n, dtype=bool)
+    for name, values in columns.items():
+        values = np.asarray(values)
+        before = values[:1] if previous is None else np.asarray(previous[name])
+        same &= values == np.concatenate([before, values[:-1]])
+    if previous is None and n:
+        same[0] = False
+    return same
+
+
+class Deduplicator:
+    """Drop repeated rows of a stream of column blocks and measure what the rest covers.
+
+    The firmware logs the current packet every second, also when no new ECU
+    response came, so a stall leaves runs of identical rows and a missed
+    response a gap in Seconds. push() returns the mask of the rows to keep.
+    Seconds steps longer than gap and ECU resets start a new segment.
+    """
+
+    def __init__(self, gap=GAP_SECONDS):
+        self.gap = gap
+        self.samples = 0
+        self.duplicates = 0
+        self.missing = 0
+        self.gaps = 0
+        self.longest_gap = 0
+        self.resets = 0
+        # [first sample, start time, end time, samples] of every segment
+        self.segments = []
+        self._previous = None
+        self._seconds = None
+        self._time = None
+
+    @property
+    def last_row(self):
+        """Last row pushed as a JSON compatible dict (None before the first), see restore."""
+        if self._previous is None:
+            return None
+        return {name: values.tolist()[0] for name, values in self._previous.items()}
+
+    @classmethod
+    def restore(cls, last_row, gap=GAP_SECONDS):
+        """Deduplicator continuing after last_row, e.g. between sync calls (the coverage counts restart)."""
+        deduplicator = cls(gap)
+        if last_row is not None:
+            deduplicator._previous = {name: np.array([value]) for name, value in last_row.items()}
+        return deduplicator
+
+    def push(self, columns):
+        keep = ~duplicate_mask(columns, self._previous)
+        if len(keep):
+            self._previous = {name: np.asarray(values)[-1:].copy() for name, values in columns.items()}
+        self.duplicates += int((~keep).sum())
+        self._add(np.asarray(columns["Seconds"], dtype=np.int64)[keep])
+        return keep
+
+    def _add(self, seconds):
+        n = len(seconds)
+        if not n:
+            return
+        first = self._seconds is None
+        before = seconds[:1] if first else [self._seconds]
+        step, reset = unwrap_steps(np.diff(seconds, prepend=before))
+        time = (seconds[0] if first else self._time) + np.cumsum(step)
+        gap = step > self.gap
+        self.missing += int(np.maximum(step - 1, 0).sum())
+        self.gaps += int(gap.sum())
+        self.longest_gap = max(self.longest_gap, int(step.max()) - 1)
+        self.resets += int(reset.sum())
+        starts = np.flatnonzero(reset | gap)
+        if first:
+            starts = np.concatenate([[0], starts])
+        head = int(starts[0]) if len(starts) else n
+        if head:
+            # The segment of the previous block continues
+            self.segments[-1][2] = int(time[head - 1])
+            self.segments[-1][3] += head
+        for start, stop in zip(starts, np.append(starts[1:], n)):
+            self.segments.append([self.samples + int(start), int(time[start]), int(time[stop - 1]), int(stop - start)])
+        self.samples += n
+        self._seconds, self._time = int(seconds[-1]), int(time[-1])
+
+    def report(self):
+        """Coverage statistics as a JSON compatible dict."""
+        span = self.segments[-1][2] - self.segments[0][1] + 1 if self.segments else 0
+        return {
+            "samples": self.samples,
+            "duplicates": self.duplicates,
+            "span": span,
+            "missing": self.missing,
+            "coverage": (span - self.missing) / span if span else 0.0,
+            "gaps": self.gaps,
+            "longest_gap": self.longest_gap,
+            "resets": self.resets,
+            "segments": [dict(zip(["first", "start", "end", "samples"], segment)) for segment in self.segments],
+        }
+
+
+def take(columns, keep):
+    """Rows of columns where keep is set."""
+    return {name: np.asarray(values)[keep] for name, values in columns.items()}
+
+
+def dedup(columns, gap=GAP_SECONDS):
+    """Columns of a whole flight without repeated rows, and the coverage report."""
+    deduplicator = Deduplicator(gap)
+    columns = take(columns, deduplicator.push(columns))
+    return columns, deduplicator.report()
+
+
+def iter_unique(blocks, deduplicator=None):
+    """Blocks of decoded columns without repeated rows, see Deduplicator for the coverage report."""
+    deduplicator = deduplicator or Deduplicator()
+    for columns in blocks:
+        yield take(columns, deduplicator.push(columns))
+
+
+def write_coverage(report, output_dir):
+    """Write a coverage report to coverage.json in output_dir, returns its path."""
+    path = os.path.join(output_dir, COVERAGE_FILE)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def format_coverage(report):
+    """One line summary of a coverage report."""
+    return (f"{report['samples']} samples over {report['span']} s ({report['coverage']:.1%} covered), "
+            f"{report['duplicates']} repeated, {report['gaps']} gaps, {report['resets']} resets, "
+            f"{len(report['segments'])} segments")
@@ -0,0 +1,140 @@
+import argparse
+import numpy as np
+import pandas as pd
+import ecu_frame
+import flight_cache
+
+# Rows parsed per step when reading a decrypted CSV
+CHUNK_ROWS = 1 << 18
+
+# Engineering units of the scaled columns are computed as this type when first used
+SCALED_DTYPE = np.dtype(np.float32)
+
+# Stored type of every raw field (native byte order), the status flags share the engine byte
+FIELD_DTYPES = {field: ecu_frame.RAW_DTYPE[field].newbyteorder("=") for field in ecu_frame.RAW_DTYPE.names}
+
+# Type of every CSV column as a Flight returns it, also used to parse decrypted CSVs
+SCHEMA = {
+    header: np.dtype(bool) if bit is not None
+    else SCALED_DTYPE if scale is not None
+    else FIELD_DTYPES[field]
+    for header, field, scale, convert, bit in ecu_frame.FIELDS
+}
+
+_COLUMNS = {header: (field, scale, convert, bit) for header, field, scale, convert, bit in ecu_frame.FIELDS}
+
+
+class Flight:
+    """Decoded flight kept as its raw ECU fields: 28 bytes per sample.
+
+    flight[header] gives a CSV column: raw integers as they are, scaled
+    columns converted to float32 engineering units on first use (and kept),
+    Engine Status flags read from the one uint8 status byte.
+    """
+
+    def __init__(self, fields):
+        self.fields = {field: np.ascontiguousarray(fields[field], dtype=dtype) for field, dtype in FIELD_DTYPES.items()}
+        self._scaled = {}
+
+    @classmethod
+    def from_raw(cls, raw):
+        """Flight of a RAW_DTYPE array (e.g. ecu_validate.records of the kept frames)."""
+        return cls({field: raw[field] for field in FIELD_DTYPES})
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Flight of decoded CSV columns (a dict or flight_cache columns), encoded in chunks."""
+        n = len(columns["Seconds"])
+        fields = {field: np.empty(n, dtype=dtype) for field, dtype in FIELD_DTYPES.items()}
+        for start in range(0, n, CHUNK_ROWS):
+            raw = ecu_frame.encode_raw({name: values[start:start + CHUNK_ROWS] for name, values in columns.items()})
+            for field, values in fields.items():
+                values[start:start + CHUNK_ROWS] = raw[field]
+        return cls(fields)
+
+    def __len__(self):
+        return len(self.fields["seconds"])
+
+    def __contains__(self, header):
+        return header in _COLUMNS
+
+    def __getitem__(self, header):
+        field, scale, convert, bit = _COLUMNS[header]
+        if bit is not None:
+            return self.flag(header)
+        if scale is None:
+            return self.fields[field]
+        if header not in self._scaled:
+            values = self.fields[field].astype(SCALED_DTYPE) / SCALED_DTYPE.type(scale)
+            self._scaled[header] = (convert(values) if convert is not None else values).astype(SCALED_DTYPE, copy=False)
+        return self._scaled[header]
+
+    @property
+    def names(self):
+        return list(_COLUMNS)
+
+    @property
+    def status(self):
+        """Engine Status bitfield (uint8), bit i is the flag of the i-th status column."""
+        return self.fields["engine"]
+
+    def flag(self, header):
+        """Boolean values of one Engine Status column."""
+        return (self.status >> _COLUMNS[header][3] & 1).astype(bool)
+
+    def raw(self, header):
+        """Raw field values behind a CSV column, before scaling."""
+        return self.fields[_COLUMNS[header][0]]
+
+    def columns(self, names=None):
+        """Dict of CSV columns (all of them by default)."""
+        return {name: self[name] for name in names or self.names}
+
+    def slice(self, window):
+        """Flight of the samples in a slice (views of the fields)."""
+        return Flight({field: values[window] for field, values in self.fields.items()})
+
+    def memory_usage(self):
+        """Bytes held per raw field and by the scaled columns computed so far."""
+        usage = {field: values.nbytes for field, values in self.fields.items()}
+        usage["scaled"] = sum(values.nbytes for values in self._scaled.values())
+        return usage
+
+    @property
+    def nbytes(self):
+        return sum(self.memory_usage().values())
+
+    def memory_report(self):
+        """One line: bytes held against the same flight as float64 columns."""
+        wide = len(self) * len(_COLUMNS) * 8
+        return (f"{len(self)} samples in {self.nbytes / 1e6:.2f} MB "
+                f"({wide / 1e6:.2f} MB as float64 columns, {wide / max(self.nbytes, 1):.1f}x)")
+
+
+def read_csv(path, chunksize=CHUNK_ROWS):
+    """Parse a decrypted CSV straight into a Flight, chunk by chunk with the schema types."""
+    parts = [Flight.from_columns({name: df[name].to_numpy() for name in ecu_frame.CSV_HEADERS}).fields
+             for df in pd.read_csv(path, names=ecu_frame.CSV_HEADERS, header=0, dtype=SCHEMA, chunksize=chunksize)]
+    return Flight({field: np.concatenate([part[field] for part in parts] or [np.empty(0, dtype=dtype)])
+                   for field, dtype in FIELD_DTYPES.items()})
+
+
+def load(path, cache_dir=flight_cache.CACHE_DIR):
+    """Flight of a decrypted CSV, binary or raw hex log, through the flight cache (see flight_cache.load_flight)."""
+    columns = flight_cache.load(path, cache_dir)
+    if columns is None and path.lower().endswith(".csv"):
+        return read_csv(path)
+    return Flight.from_columns(columns if columns is not None else flight_cache.load_flight(path, cache_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the memory a flight takes in the compact representation.")
+    parser.add_argument("input", help="decrypted CSV, binary log or raw hex log")
+    args = parser.parse_args(argv)
+
+    flight = load(args.input)
+    print(flight.memory_report())
+
+
+if __name__ == "__main__":
+    main()
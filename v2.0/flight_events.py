@@ -0,0 +1,342 @@
+import argparse
+import csv
+import json
+import os
+from collections import deque, namedtuple
+import numpy as np
+import pandas as pd
+import ecu_frame
+import ecu_resync
+import ecu_validate
+import flight_cache
+from time_index import format_hms, unwrap_step, unwrap_steps
+
+# Event timeline, written next to the plots
+EVENTS_FILE = "events.csv"
+
+# Rows converted to Python values per step when feeding blocks to an EventDetector
+CHUNK_ROWS = 1 << 16
+
+# One event rule. kind is
+#   "range": channel below low or above high (either may be None) for at least duration seconds
+#   "drop":  channel fell by at least change from its maximum of the last window seconds, while
+#            the hold channel (if any) moved by at most hold_change in the same window
+#   "flat":  channel moved by at most change (0: not at all) for window seconds
+EventRule = namedtuple("EventRule", ["name", "kind", "channel", "low", "high", "duration", "window", "change", "hold", "hold_change"],
+                       defaults=[None, None, 0, None, 0, None, 0])
+
+# Defaults for the DLA-232 on the Mugin-6000, tune them with a rules file (see load_rules)
+RULES = [
+    EventRule("Overheating", "range", "Cylinder Temperature (deg C)", high=150, duration=5),
+    EventRule("Hot intake air", "range", "Manifold Air Temperature (deg C)", high=60, duration=10),
+    EventRule("Battery sag", "range", "Battery Voltage (V)", low=11.0, duration=2),
+    EventRule("MAP out of range", "range", "Manifold Absolute Pressure (kPa)", low=10, high=110, duration=1),
+    EventRule("BARO out of range", "range", "Barometric Pressure (kPa)", low=50, high=110, duration=1),
+    # Ignition failure or misfire: engine speed falls while the throttle is not moved
+    EventRule("RPM drop, throttle held", "drop", "RPM", window=3, change=1000, hold="Throttle Position (%)", hold_change=2),
+    EventRule("CLT sensor flat-lined", "flat", "Cylinder Temperature (deg C)", window=120),
+    EventRule("RPM sensor flat-lined", "flat", "RPM", window=30),
+]
+
+# Raw field behind every scaled or raw CSV column, for the threshold check
+_CHANNEL_FIELDS = {header: field for header, field, _, _, bit in ecu_frame.FIELDS if bit is None}
+
+
+def check_thresholds(rules):
+    """Raise ValueError if a range rule threshold is not strictly inside the validation
+    ranges and the resync lock ranges, readings beyond it would be rejected before the rules run."""
+    for rule in rules:
+        field = _CHANNEL_FIELDS.get(rule.channel)
+        if rule.kind != "range" or field not in ecu_validate.RANGES:
+            continue
+        low, high = ecu_validate.RANGES[field]
+        lock_low, lock_high = ecu_resync.RESYNC_RANGES.get(field, (-np.inf, np.inf))
+        for threshold in (rule.low, rule.high):
+            if threshold is None:
+                continue
+            if not (low < threshold < high and lock_low < ecu_validate.to_raw(field, threshold) < lock_high):
+                raise ValueError(f"{rule.name}: threshold {threshold} of {rule.channel} is outside the "
+                                 f"validation range {low}..{high}, widen ecu_validate.RANGES")
+
+
+check_thresholds(RULES)
+
+# A detected event: flight time (unwrapped Seconds, as on the plots) of its first and
+# last sample, and the lowest and highest channel value in between
+Event = namedtuple("Event", ["rule", "channel", "start", "end", "min", "max"])
+
+
+def _check_kind(rule):
+    if rule.kind not in ("range", "drop", "flat"):
+        raise ValueError(f"{rule.name}: unknown rule kind {rule.kind!r}")
+
+
+def load_rules(path):
+    """Read event rules from a JSON list of objects with the EventRule fields."""
+    with open(path) as f:
+        rules = [EventRule(**rule) for rule in json.load(f)]
+    check_thresholds(rules)
+    return rules
+
+
+class RollingWindow:
+    """Minimum and maximum of the samples of the last window seconds.
+
+    Monotonic deques, every sample is pushed and popped once, so an update
+    is O(1) amortised however many samples the window holds.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.first = None
+        self.last = None
+        self._max = deque()
+        self._min = deque()
+
+    def push(self, t, value):
+        if self.last is None or t - self.last > self.window:
+            # First sample, or after a gap longer than the window
+            self.first = t
+        self.last = t
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((t, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((t, value))
+        while self._max[0][0] < t - self.window:
+            self._max.popleft()
+        while self._min[0][0] < t - self.window:
+            self._min.popleft()
+
+    def max(self):
+        return self._max[0][1]
+
+    def min(self):
+        return self._min[0][1]
+
+    def spread(self):
+        return self._max[0][1] - self._min[0][1]
+
+    def full(self, t):
+        """True once samples cover a whole window without a longer gap."""
+        return self.first is not None and t - self.first >= self.window
+
+
+class _RuleState:
+    # Condition of one rule plus the open event, if any
+
+    def __init__(self, rule):
+        _check_kind(rule)
+        self.rule = rule
+        self.values = RollingWindow(rule.window) if rule.window else None
+        self.hold = RollingWindow(rule.window) if rule.hold else None
+        self.since = None
+        self.open = None
+
+    def condition(self, t, row):
+        # Time the condition started to hold, None if it does not hold now
+        rule = self.rule
+        value = row[rule.channel]
+        if self.values is not None:
+            self.values.push(t, value)
+        if self.hold is not None:
+            self.hold.push(t, row[rule.hold])
+        if rule.kind == "range":
+            active = (rule.low is not None and value < rule.low) or (rule.high is not None and value > rule.high)
+        elif rule.kind == "drop":
+            active = self.values.max() - value >= rule.change and (self.hold is None or self.hold.spread() <= rule.hold_change)
+        else:
+            if self.values.full(t) and self.values.spread() <= rule.change:
+                return t - rule.window if self.since is None else self.since
+            return None
+        if not active:
+            return None
+        return t if self.since is None else self.since
+
+    def update(self, t, row):
+        """Returns the event that was opened or closed by this sample, if any."""
+        since = self.condition(t, row)
+        value = row[self.rule.channel]
+        if since is None:
+            self.since = None
+            event, self.open = self.open, None
+            return event
+        self.since = since
+        if self.open is not None:
+            self.open = self.open._replace(end=t, min=min(self.open.min, value), max=max(self.open.max, value))
+        elif t - since >= self.rule.duration:
+            self.open = Event(self.rule.name, self.rule.channel, since, t, value, value)
+            return self.open
+        return None
+
+
+class EventDetector:
+    """Evaluate event rules sample by sample, in O(1) per sample and rule.
+
+    For incremental input: decoded column blocks (update) or single samples
+    such as the live /data stream (update_sample), detect() does whole
+    flights. on_event(event) is called when an event starts, once its rule
+    held for the rule's duration. Finished events are collected in
+    self.events, finish() closes the open ones.
+    """
+
+    def __init__(self, rules=RULES, on_event=None):
+        self.rules = list(rules)
+        self.on_event = on_event
+        self.events = []
+        self.time = None
+        self._states = [_RuleState(rule) for rule in self.rules]
+        self._seconds = None
+        self.channels = list(dict.fromkeys(name for rule in self.rules for name in (rule.channel, rule.hold) if name))
+
+    def update_sample(self, row):
+        """Add one sample, a mapping with Seconds and the rule channels."""
+        seconds = int(row["Seconds"])
+        if self._seconds is None:
+            self.time = seconds
+        else:
+            self.time += unwrap_step(seconds - self._seconds)
+        self._seconds = seconds
+        for state in self._states:
+            was_open = state.open
+            event = state.update(self.time, row)
+            if event is None:
+                continue
+            if was_open is None:
+                if self.on_event is not None:
+                    self.on_event(event)
+            else:
+                self.events.append(event)
+
+    def update(self, columns):
+        """Add a block of decoded columns."""
+        names = ["Seconds"] + self.channels
+        n = len(columns["Seconds"])
+        for start in range(0, n, CHUNK_ROWS):
+            values = [np.asarray(columns[name][start:start + CHUNK_ROWS]).tolist() for name in names]
+            for sample in zip(*values):
+                self.update_sample(dict(zip(names, sample)))
+
+    def open_events(self):
+        return [state.open for state in self._states if state.open is not None]
+
+    def finish(self):
+        """Close the open events, returns all events ordered by start time."""
+        self.events.extend(self.open_events())
+        for state in self._states:
+            state.open = state.since = None
+        self.events.sort(key=lambda event: event.start)
+        return self.events
+
+
+class _Window(pd.api.indexers.BaseIndexer):
+    # Rolling window of every sample: from start[i] to the sample itself
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        return self.start, np.arange(1, num_values + 1, dtype=np.int64)
+
+
+def _rolling(values, start):
+    # Maximum and minimum of the samples start[i]..i
+    rolling = pd.Series(values).rolling(_Window(start=start), min_periods=1)
+    return rolling.max().to_numpy(), rolling.min().to_numpy()
+
+
+def _condition(rule, columns, time):
+    # Samples where the rule's condition holds, and how long before a run the condition counts from
+    values = np.asarray(columns[rule.channel], dtype=np.float64)
+    if rule.kind == "range":
+        active = np.zeros(len(values), dtype=bool)
+        if rule.low is not None:
+            active |= values < rule.low
+        if rule.high is not None:
+            active |= values > rule.high
+        return active, 0
+    # Window of the last rule.window seconds, as RollingWindow keeps it
+    start = np.searchsorted(time, time - rule.window, side="left")
+    high, low = _rolling(values, start)
+    if rule.kind == "drop":
+        active = high - values >= rule.change
+        if rule.hold:
+            hold_high, hold_low = _rolling(np.asarray(columns[rule.hold], dtype=np.float64), start)
+            active &= hold_high - hold_low <= rule.hold_change
+        return active, 0
+    # Flat: also the samples since the last gap longer than the window must span it
+    reset = np.ones(len(time), dtype=bool)
+    reset[1:] = np.diff(time) > rule.window
+    first = time[np.maximum.accumulate(np.where(reset, np.arange(len(time)), 0))]
+    return (time - first >= rule.window) & (high - low <= rule.change), rule.window
+
+
+def _rule_events(rule, columns, time):
+    # (close sample, event) of one rule: runs of its condition that last its duration
+    active, lead = _condition(rule, columns, time)
+    edges = np.diff(active.astype(np.int8), prepend=0, append=0)
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    since = time[starts] - lead
+    opened = np.maximum(starts, np.searchsorted(time, since + rule.duration, side="left"))
+    values = np.asarray(columns[rule.channel])
+    found = []
+    for run in np.flatnonzero(opened < stops):
+        window = values[opened[run]:stops[run]]
+        start = int(time[starts[run]]) - lead
+        found.append((int(stops[run]), Event(rule.name, rule.channel, start, int(time[stops[run] - 1]),
+                                             window.min().item(), window.max().item())))
+    return found
+
+
+def detect(columns, rules=RULES):
+    """Events of a whole flight, vectorised per rule (the same events as an EventDetector fed the flight)."""
+    for rule in rules:
+        _check_kind(rule)
+    seconds = np.asarray(columns["Seconds"], dtype=np.int64)
+    if not len(seconds):
+        return []
+    time = seconds[0] + np.concatenate([[0], np.cumsum(unwrap_steps(np.diff(seconds))[0])])
+    # EventDetector order: by start, then in the order the events closed (open ones last), then by rule
+    found = [(event.start, close, number, event)
+             for number, rule in enumerate(rules) for close, event in _rule_events(rule, columns, time)]
+    return [event for *_, event in sorted(found, key=lambda item: item[:3])]
+
+
+def write_timeline(events, output_dir):
+    """Write the events to events.csv in output_dir, returns its path."""
+    path = os.path.join(output_dir, EVENTS_FILE)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(Event._fields + ("start_hms", "end_hms", "duration"))
+        for event in events:
+            writer.writerow(event + (format_hms(event.start), format_hms(event.end), event.end - event.start))
+    return path
+
+
+def read_timeline(path):
+    """Events of an events.csv."""
+    with open(path, newline="") as f:
+        return [Event(row["rule"], row["channel"], int(row["start"]), int(row["end"]), float(row["min"]), float(row["max"]))
+                for row in csv.DictReader(f)]
+
+
+def print_event(event):
+    print(f"{format_hms(event.start)}-{format_hms(event.end)}  {event.rule}: {event.channel} {event.min:g}..{event.max:g}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect engine events in a flight and write their timeline.")
+    parser.add_argument("input", help="decrypted CSV, raw or binary log")
+    parser.add_argument("-o", "--output", help="directory for events.csv (default: next to the input)")
+    parser.add_argument("--rules", help="JSON rules file (default: the built-in rules)")
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.rules) if args.rules else RULES
+    events = detect(flight_cache.load_flight(args.input), rules)
+    for event in events:
+        print_event(event)
+    output = args.output or os.path.dirname(os.path.abspath(args.input))
+    os.makedirs(output, exist_ok=True)
+    print(f"{len(events)} events, timeline written to {write_timeline(events, output)}")
+
+
+if __name__ == "__main__":
+    main()
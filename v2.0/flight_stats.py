@@ -0,0 +1,376 @@
+import argparse
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+import ecu_binlog
+import ecu_frame
+import ecu_resync
+import ecu_validate
+import flight_cache
+import flight_coverage
+from time_index import format_hms, unwrap_steps
+
+# Per flight summary, written next to the plots
+SUMMARY_FILE = "flight_stats.json"
+
+# Records handled per step, bounds memory for flights of any length (and keeps the int64 sums exact)
+CHUNK_ROWS = 1 << 20
+
+# Lower edges of the engine speed bands (RPM), the last band is open ended
+RPM_BANDS = [0, 1000, 2000, 3000, 4000, 5000, 6000, 7000]
+
+# Lower edges of the injector duty bands (%)
+DUTY_BANDS = [0, 20, 40, 60, 80, 90, 100]
+
+# Injector duty (%) = pulse width (us) * RPM / DUTY_DIVISOR, one injection per injector every two revolutions
+DUTY_DIVISOR = 1200000
+
+INJECTORS = [("Injector 1", "pw1"), ("Injector 2", "pw2")]
+
+# Channels with min/max/mean/std: (header, raw field, scale divisor, unit conversion)
+STAT_FIELDS = [(header, field, scale, convert) for header, field, scale, convert, bit in ecu_frame.FIELDS
+               if bit is None and field != "seconds"]
+
+# Engine Status flags: (header, bit)
+STATUS_FLAGS = [(header, bit) for header, _, _, _, bit in ecu_frame.FIELDS if bit is not None]
+
+# Engine Status bits kept in the CSV, the others are ignored so every source gives the same result
+STATUS_MASK = sum(1 << bit for _, bit in STATUS_FLAGS)
+
+
+def _sum_squares(values):
+    # Exact sum of squares of int64 values below 2**32 in magnitude, split in 16 bit halves so no product overflows
+    values = np.abs(values)
+    high, low = values >> 16, values & 0xffff
+    return (int(np.dot(high, high)) << 32) + (int(np.dot(high, low)) << 17) + int(np.dot(low, low))
+
+
+def _linear(scale, convert):
+    # (a, b) so that the physical value is a * raw + b
+    a = 1 / scale if scale else 1.0
+    if convert is None:
+        return a, 0.0
+    b = convert(0.0)
+    return convert(a) - b, b
+
+
+def _state_name(value):
+    names = [header.replace("Engine Status ", "") for header, bit in STATUS_FLAGS if value >> bit & 1]
+    return "+".join(names) or "none"
+
+
+class Moments:
+    """Count, sum, sum of squares, min and max of integer samples.
+
+    The sums are Python integers, so merged partial results are exactly those of one pass.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.squares = 0
+        self.min = None
+        self.max = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += int(values.sum())
+        self.squares += _sum_squares(values)
+        self._bounds(int(values.min()), int(values.max()))
+
+    def _bounds(self, low, high):
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other):
+        if other.count:
+            self.count += other.count
+            self.total += other.total
+            self.squares += other.squares
+            self._bounds(other.min, other.max)
+
+    def summary(self, a=1.0, b=0.0):
+        """min/max/mean/std of a * value + b."""
+        if not self.count:
+            return {"count": 0, "min": None, "max": None, "mean": None, "std": None}
+        low, high = sorted((a * self.min + b, a * self.max + b))
+        variance = (self.squares * self.count - self.total ** 2) / self.count ** 2
+        return {"count": self.count, "min": low, "max": high, "mean": a * self.total / self.count + b,
+                "std": abs(a) * math.sqrt(variance)}
+
+    def state(self):
+        return [self.count, self.total, self.squares, self.min, self.max]
+
+    @classmethod
+    def from_state(cls, state):
+        moments = cls()
+        moments.count, moments.total, moments.squares, moments.min, moments.max = state
+        return moments
+
+
+class TimeHistogram:
+    """Seconds spent with an integer value in each bin, edges are the lower bin edges."""
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.seconds = np.zeros(len(self.edges), dtype=np.int64)
+
+    def update(self, values, steps):
+        bins = np.searchsorted(self.edges, values, side="right") - 1
+        inside = bins >= 0
+        # Float weights are exact, the sums stay far below 2**53
+        self.seconds += np.bincount(bins[inside], weights=steps[inside], minlength=len(self.edges)).astype(np.int64)
+
+    def merge(self, other):
+        self.seconds += other.seconds
+
+
+def _record_state(record):
+    # Field values of a one record array, bytes between the fields are not kept
+    return None if record is None else {name: int(record[name][0]) for name in record.dtype.names}
+
+
+def _duty(records):
+    # Pulse width * RPM of every injector, DUTY_DIVISOR is 100 % duty
+    rpm = records["rpm"].astype(np.int64)
+    return {name: records[field].astype(np.int64) * rpm for name, field in INJECTORS}
+
+
+class FlightStats:
+    """Single pass flight statistics in constant memory.
+
+    Feed decoded columns (update) or raw records (update_records) in time
+    order. Every sample counts for the time since the previous one
+    (unwrapped Seconds, see TimeIndex). Results of consecutive chunks or of
+    several flights are combined with merge and equal one pass over all the
+    data, and state()/from_state() carry them between processes or files.
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.duration = 0
+        self.flights = 0
+        self.channels = {header: Moments() for header, *_ in STAT_FIELDS}
+        self.duty = {name: Moments() for name, _ in INJECTORS}
+        self.rpm_time = TimeHistogram(RPM_BANDS)
+        self.duty_time = {name: TimeHistogram(np.multiply(DUTY_BANDS, DUTY_DIVISOR)) for name, _ in INJECTORS}
+        # Time per Engine Status byte, the flag times are sums over it
+        self.state_time = TimeHistogram(np.arange(256))
+        # First and last record, joins the chunks before and after
+        self.first = None
+        self.last = None
+
+    def update(self, columns):
+        """Add decoded CSV columns."""
+        self.update_records(ecu_frame.encode_raw(columns))
+
+    def update_records(self, records):
+        """Add raw records (a RAW_DTYPE array)."""
+        for start in range(0, len(records), CHUNK_ROWS):
+            self._update(records[start:start + CHUNK_ROWS])
+
+    def _update(self, records):
+        if not len(records):
+            return
+        seconds = records["seconds"].astype(np.int64)
+        if self.last is None:
+            self.flights += 1
+            self.first = records[:1].copy()
+            previous = seconds[:1]
+        else:
+            previous = self.last["seconds"].astype(np.int64)
+        steps, _ = unwrap_steps(np.diff(seconds, prepend=previous))
+        self.last = records[-1:].copy()
+        self.samples += len(records)
+        self.duration += int(steps.sum())
+        for header, field, _, _ in STAT_FIELDS:
+            self.channels[header].update(records[field])
+        duty = _duty(records)
+        for name, values in duty.items():
+            self.duty[name].update(values)
+        self._add_time(records, steps, duty)
+
+    def _add_time(self, records, steps, duty):
+        self.rpm_time.update(records["rpm"], steps)
+        self.state_time.update(records["engine"] & STATUS_MASK, steps)
+        for name, values in duty.items():
+            self.duty_time[name].update(values, steps)
+
+    def merge(self, other, continuation=True):
+        """Add the results of other, the next part of this flight (continuation) or another flight."""
+        if other.first is None:
+            return self
+        if continuation and self.last is not None:
+            # The first sample of other counts for the time since our last one
+            steps, _ = unwrap_steps(other.first["seconds"].astype(np.int64) - self.last["seconds"].astype(np.int64))
+            self._add_time(other.first, steps, _duty(other.first))
+            self.duration += int(steps.sum())
+            self.flights -= 1
+        self.samples += other.samples
+        self.duration += other.duration
+        self.flights += other.flights
+        for name, moments in self.channels.items():
+            moments.merge(other.channels[name])
+        for name in self.duty:
+            self.duty[name].merge(other.duty[name])
+            self.duty_time[name].merge(other.duty_time[name])
+        self.rpm_time.merge(other.rpm_time)
+        self.state_time.merge(other.state_time)
+        if self.first is None:
+            self.first = other.first
+        self.last = other.last
+        return self
+
+    def summary(self):
+        """Statistics in physical units, JSON-ready."""
+        flags = np.arange(256)
+        rpm_edges = RPM_BANDS + [None]
+        duty_edges = DUTY_BANDS + [None]
+        return {
+            "samples": self.samples,
+            "flights": self.flights,
+            "duration": self.duration,
+            "duration_hms": format_hms(self.duration),
+            "channels": {header: self.channels[header].summary(*_linear(scale, convert))
+                         for header, _, scale, convert in STAT_FIELDS},
+            "rpm_bands": [{"from": rpm_edges[i], "to": rpm_edges[i + 1], "seconds": int(seconds)}
+                          for i, seconds in enumerate(self.rpm_time.seconds)],
+            "engine_status": {header: int(self.state_time.seconds[(flags >> bit & 1) == 1].sum())
+                              for header, bit in STATUS_FLAGS},
+            "engine_states": {_state_name(value): int(seconds)
+                              for value, seconds in enumerate(self.state_time.seconds) if seconds},
+            "injector_duty": {
+                name: dict(self.duty[name].summary(1 / DUTY_DIVISOR),
+                           bands=[{"from": duty_edges[i], "to": duty_edges[i + 1], "seconds": int(seconds)}
+                                  for i, seconds in enumerate(self.duty_time[name].seconds)])
+                for name, _ in INJECTORS
+            },
+        }
+
+    def state(self):
+        """Accumulator state, JSON-ready."""
+        return {
+            "samples": self.samples,
+            "duration": self.duration,
+            "flights": self.flights,
+            "channels": {name: moments.state() for name, moments in self.channels.items()},
+            "duty": {name: moments.state() for name, moments in self.duty.items()},
+            "rpm_time": self.rpm_time.seconds.tolist(),
+            "duty_time": {name: histogram.seconds.tolist() for name, histogram in self.duty_time.items()},
+            "state_time": self.state_time.seconds.tolist(),
+            "first": _record_state(self.first),
+            "last": _record_state(self.last),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls()
+        stats.samples, stats.duration, stats.flights = state["samples"], state["duration"], state["flights"]
+        stats.channels = {name: Moments.from_state(s) for name, s in state["channels"].items()}
+        stats.duty = {name: Moments.from_state(s) for name, s in state["duty"].items()}
+        stats.rpm_time.seconds[:] = state["rpm_time"]
+        for name, seconds in state["duty_time"].items():
+            stats.duty_time[name].seconds[:] = seconds
+        stats.state_time.seconds[:] = state["state_time"]
+        for key in ("first", "last"):
+            if state[key] is not None:
+                record = np.zeros(1, dtype=ecu_frame.RAW_DTYPE)
+                for name, value in state[key].items():
+                    record[name] = value
+                setattr(stats, key, record)
+        return stats
+
+
+def iter_column_records(columns):
+    """Raw records of decoded columns (e.g. a flight cache entry) in chunks of at most CHUNK_ROWS."""
+    for start in range(0, len(columns["Seconds"]), CHUNK_ROWS):
+        yield ecu_frame.encode_raw({name: values[start:start + CHUNK_ROWS] for name, values in columns.items()})
+
+
+def iter_records(path):
+    """Raw records of a flight in chunks of at most CHUNK_ROWS, from the flight cache,
+    a decrypted CSV, a binary log or a raw hex log (invalid and repeated frames dropped)."""
+    if ecu_binlog.is_binlog(path):
+        log = ecu_binlog.BinLog(path)
+        chunks = (log.frames[start:start + CHUNK_ROWS] for start in range(0, len(log), CHUNK_ROWS))
+        deduplicator = flight_coverage.Deduplicator()
+        for frames in ecu_validate.iter_valid(chunks):
+            yield frames[deduplicator.push(flight_coverage.record_columns(ecu_validate.records(frames)[0]))]
+        return
+    columns = flight_cache.load(path)
+    if columns is not None:
+        yield from iter_column_records(columns)
+    elif path.lower().endswith(".csv"):
+        for df in pd.read_csv(path, names=ecu_frame.CSV_HEADERS, header=0, dtype=ecu_frame.COLUMN_DTYPES, chunksize=CHUNK_ROWS):
+            yield ecu_frame.encode_raw({name: df[name].to_numpy() for name in ecu_frame.CSV_HEADERS})
+    else:
+        with open(path, "rb") as f:
+            blocks = (ecu_frame.decode_frames(frames)[0] for frames in ecu_validate.iter_valid(ecu_resync.iter_frames(f)))
+            for columns in flight_coverage.iter_unique(blocks):
+                yield ecu_frame.encode_raw(columns)
+
+
+def flight_stats(path):
+    """FlightStats of one flight file (see iter_records) or of decoded columns."""
+    stats = FlightStats()
+    for records in iter_records(path) if isinstance(path, (str, os.PathLike)) else iter_column_records(path):
+        stats.update_records(records)
+    return stats
+
+
+def write_summary(stats, output_dir):
+    """Write the summary and accumulator state to flight_stats.json in output_dir, returns its path."""
+    path = os.path.join(output_dir, SUMMARY_FILE)
+    with open(path, "w") as f:
+        json.dump(dict(stats.summary(), state=stats.state()), f, indent=2)
+    return path
+
+
+def read_stats(path):
+    """FlightStats saved in a flight_stats.json."""
+    with open(path) as f:
+        return FlightStats.from_state(json.load(f)["state"])
+
+
+def print_summary(summary):
+    channels = summary["channels"]
+    print(f"{summary['flights']} flight(s), {summary['samples']} samples, {summary['duration_hms']}")
+    for header, key in [("Cylinder Temperature (deg C)", "max"), ("Manifold Air Temperature (deg C)", "max"),
+                        ("Battery Voltage (V)", "min"), ("RPM", "max")]:
+        value = channels[header][key]
+        print(f"  {key} {header}: {'-' if value is None else f'{value:.1f}'}")
+    print("  Time in RPM bands:")
+    for band in summary["rpm_bands"]:
+        upper = band["to"] if band["to"] is not None else ""
+        print(f"    {band['from']:>5}-{upper:<5} {format_hms(band['seconds'])}")
+    print("  Time in Engine Status:")
+    for header, seconds in summary["engine_status"].items():
+        print(f"    {header:28} {format_hms(seconds)}")
+    for name, duty in summary["injector_duty"].items():
+        if duty["count"]:
+            print(f"  {name} duty: mean {duty['mean']:.1f} %, max {duty['max']:.1f} %")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flight statistics of logs, CSVs or saved flight_stats.json files.")
+    parser.add_argument("inputs", nargs="+", help="raw or binary logs, decrypted CSVs or flight_stats.json files (combined as separate flights)")
+    parser.add_argument("-o", "--output", help="directory to write the combined flight_stats.json to")
+    args = parser.parse_args(argv)
+
+    stats = FlightStats()
+    for path in args.inputs:
+        part = read_stats(path) if path.lower().endswith(".json") else flight_stats(path)
+        stats.merge(part, continuation=False)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        print(f"Wrote {write_summary(stats, args.output)}")
+    print_summary(stats.summary())
+
+
+if __name__ == "__main__":
+    main()
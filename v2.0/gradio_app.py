@@ -1,6 +1,12 @@
-import pandas as pd
+import functools
 import plotly.graph_objects as go
 import gradio as gr
+import flight_cache
+import flight_data
+import flight_events
+import jobs
+import plot_pyramid
+from time_index import GAP_SECONDS, TimeIndex, break_lines
 
 # Define column names explicitly
 column_names = [
@@ -11,42 +17,91 @@ column_names = [
     "Manifold Air Temperature (deg C)", "Cylinder Temperature (deg C)", "Throttle Position (%)", "Battery Voltage (V)"
 ]
 
-# Function to read CSV file and process data
-def process_csv(file):
-    # Read the uploaded CSV file
-    df = pd.read_csv(file.name, names=column_names, header=0)
-    return df
+# Plot width in pixels, used to pick the pyramid level
+PLOT_WIDTH = 1400
+
+# Compact flight per file, its scaled columns are computed as float32 when first plotted
+@functools.lru_cache(maxsize=8)
+def get_flight(key, path):
+    return flight_data.load(path)
+
+# Min/max pyramids per flight and column, built once and reused on every toggle/zoom
+@functools.lru_cache(maxsize=64)
+def get_pyramid(key, path, param):
+    return plot_pyramid.MinMaxPyramid(get_flight(key, path)[param])
+
+# Numeric time index per flight, lines break at gaps and ECU resets
+@functools.lru_cache(maxsize=8)
+def get_time_index(key, path):
+    return TimeIndex(get_flight(key, path)['Seconds'], gap=GAP_SECONDS)
+
+# Detected engine events per flight, on the columns of the compact flight (no second parse)
+@functools.lru_cache(maxsize=8)
+def get_events(key, path):
+    return flight_events.detect(get_flight(key, path))
 
 # Function to generate an interactive Plotly graph
-def plot_data(df, selected_parameters):
+def plot_data(flight, selected_parameters, start=None, end=None, pyramids=None, time_index=None, events=None):
     fig = go.Figure()
     
+    # Visible sample range from the zoom inputs (flight time in seconds)
+    if time_index is None:
+        time_index = TimeIndex(flight['Seconds'], gap=GAP_SECONDS)
+    window = time_index.slice(start, end)
+    
     for param in selected_parameters:
-        if param in df.columns:
+        if param in flight:
+            pyramid = pyramids[param] if pyramids else plot_pyramid.MinMaxPyramid(flight[param])
+            index, values = pyramid.query(window.start, window.stop, PLOT_WIDTH)
+            time, values = break_lines(time_index.time, time_index.segments, index, values)
             fig.add_trace(go.Scatter(
-                # Convert 'Seconds' to 'Time' in HH:MM:SS format
-                x = pd.to_timedelta(df['Seconds'], unit='s').astype(str).str.slice(start=7),  # Keep HH:MM:SS format
-                # x=df['Seconds'],  # Assuming 'Seconds' is the time axis
-                y=df[param], 
+                # Numeric flight time on a date axis (milliseconds) shown as HH:MM:SS
+                x=time * 1000,
+                y=values, 
                 mode='lines', 
                 name=param
             ))
     
+    # Shade the events of the selected parameters inside the window
+    for event in events or []:
+        if event.channel in selected_parameters and event.end >= (start or event.end) and event.start <= (end or event.start):
+            fig.add_vrect(x0=event.start * 1000, x1=max(event.end, event.start + 1) * 1000, fillcolor="orange", opacity=0.25,
+                          line_width=0, annotation_text=event.rule, annotation_position="top left")
+    
     # Update layout for fullscreen & better visibility
     fig.update_layout(
         title="Selected Parameters Over Time",
-        xaxis_title="Time (Seconds)",
+        xaxis_title="Time",
         yaxis_title="Values",
-        xaxis=dict(tickangle=-90, showgrid=True),
+        xaxis=dict(type='date', tickformat='%H:%M:%S', tickangle=-90, showgrid=True),
         yaxis=dict(showgrid=True),
         legend=dict(x=0, y=1),
-        width=1400,  # Increase width
+        width=PLOT_WIDTH,  # Increase width
         height=1000,  # Increase height
         margin=dict(l=20, r=20, t=50, b=100)  # Adjust margins for better display
     )
     
     return fig
 
+# Plot requests run on one worker thread. A new request supersedes the ones still
+# waiting (and stops a running one between parameters), so fast toggles only
+# render the latest selection. Requests wait PLOT_DEBOUNCE seconds first.
+PLOT_DEBOUNCE = 0.15
+plot_jobs = jobs.JobRunner("plots")
+
+def render_plot(job, path, selected_params, start, end):
+    # Worker: load (decoding a raw log on a cache miss) and plot one selection
+    job.progress("Loading flight")
+    key = flight_cache.file_key(path)
+    flight = get_flight(key, path)
+    pyramids = {}
+    for param in selected_params:
+        job.check()
+        if param in flight:
+            pyramids[param] = get_pyramid(key, path, param)
+    job.check()
+    return plot_data(flight, selected_params, start, end, pyramids, get_time_index(key, path), get_events(key, path))
+
 # Gradio UI
 param_list = column_names[1:]  # Exclude 'Seconds' for plotting
 
@@ -60,6 +115,14 @@ with gr.Blocks(css="body { overflow-x: auto; }") as demo:
     # Checkbox group for selecting parameters to plot
     selected_params = gr.CheckboxGroup(param_list, label="Select parameters to plot")
     
+    # Zoom to a time range (seconds), empty shows the whole flight
+    with gr.Row():
+        start_input = gr.Number(label="Start (s)", value=None)
+        end_input = gr.Number(label="End (s)", value=None)
+    
+    # Memory the loaded flight takes in its compact form
+    memory_output = gr.Markdown()
+    
     # Plot output
     plot_output = gr.Plot()
     
@@ -67,13 +130,28 @@ with gr.Blocks(css="body { overflow-x: auto; }") as demo:
     clear_button = gr.Button("Clear")
     
     # Actions for file upload and parameter selection
-    def update_plot(file, selected_params):
+    def update_plot(file, selected_params, start, end):
         if file:
-            df = process_csv(file)
-            return plot_data(df, selected_params)
+            job = plot_jobs.submit(render_plot, file.name, list(selected_params), start, end, key="plot", delay=PLOT_DEBOUNCE)
+            try:
+                return job.wait()
+            except jobs.Cancelled:
+                # Superseded by a newer selection, keep the current plot until that one is ready
+                return gr.update()
+    
+    def show_memory(file):
+        return get_flight(flight_cache.file_key(file.name), file.name).memory_report() if file else ""
     
-    file_input.change(fn=update_plot, inputs=[file_input, selected_params], outputs=plot_output)
-    selected_params.change(fn=update_plot, inputs=[file_input, selected_params], outputs=plot_output)
+    plot_inputs = [file_input, selected_params, start_input, end_input]
+    # Plot listeners run concurrently (the job runner bounds the work) so a newer
+    # selection reaches plot_jobs.submit and supersedes the one still waiting
+    plot_listener = dict(fn=update_plot, inputs=plot_inputs, outputs=plot_output,
+                         trigger_mode="always_last", concurrency_limit=None)
+    file_input.change(**plot_listener)
+    file_input.change(fn=show_memory, inputs=file_input, outputs=memory_output)
+    selected_params.change(**plot_listener)
+    start_input.change(**plot_listener)
+    end_input.change(**plot_listener)
     clear_button.click(fn=lambda: None, inputs=[], outputs=[plot_output])
 
 # Launch with `share=True` for public access
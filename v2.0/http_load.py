@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import time
+from urllib.parse import urlsplit
+import numpy as np
+import ecu_frame
+import live_ingest
+
+# Seconds a request may take before it counts as an error
+TIMEOUT = 10
+
+# Reported latency percentiles
+PERCENTILES = [50, 90, 99]
+
+
+async def get(host, port, path, timeout=TIMEOUT):
+    """One HTTP/1.1 GET on a new connection, returns (status, body)."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1]) if head.startswith(b"HTTP/") else 0
+    return status, body
+
+
+class ClientStats:
+    """Latencies and counts of the requests of one load run.
+
+    frames adds up the new frames every client saw, so it grows with the
+    number of clients; payloads holds the distinct /data frames across them.
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.frames = 0
+        self.payloads = set()
+        self.bytes = 0
+
+    def report(self, elapsed, clients=1):
+        latencies = np.array(self.latencies) * 1000
+        report = {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "elapsed": elapsed,
+            "requests_per_s": len(self.latencies) / elapsed if elapsed else 0.0,
+            "frames": self.frames,
+            "frames_per_client_s": self.frames / clients / elapsed if elapsed and clients else 0.0,
+            "distinct_frames": len(self.payloads),
+            "distinct_frames_per_s": len(self.payloads) / elapsed if elapsed else 0.0,
+            "mb_per_s": self.bytes / elapsed / 1e6 if elapsed else 0.0,
+        }
+        for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES) if len(latencies) else [0.0] * len(PERCENTILES)):
+            report[f"p{p}_ms"] = float(value)
+        report["max_ms"] = float(latencies.max()) if len(latencies) else 0.0
+        return report
+
+
+async def _client(host, port, path, stats, end, interval):
+    # Request path until end, /data polls count the new frames they decode like live_ingest
+    last_payload = None
+    next_request = time.monotonic()
+    while time.monotonic() < end:
+        started = time.monotonic()
+        try:
+            status, body = await get(host, port, path)
+        except (OSError, asyncio.TimeoutError):
+            stats.errors += 1
+            status, body = 0, b""
+        if status:
+            stats.latencies.append(time.monotonic() - started)
+            if status >= 400:
+                stats.errors += 1
+            stats.bytes += len(body)
+            if path == "/data":
+                body = body.strip()
+                if body != last_payload and live_ingest.decode_packet(body) is not None:
+                    stats.frames += 1
+                    stats.payloads.add(body)
+                last_payload = body
+            else:
+                stats.frames += len(ecu_frame.hex_tokens(body)) // ecu_frame.FRAME_SIZE
+        next_request = max(next_request + interval, time.monotonic())
+        await asyncio.sleep(next_request - time.monotonic())
+
+
+async def run_load(url, clients=10, duration=10.0, path="/data", rate=0.0):
+    """Run clients concurrent clients requesting path for duration seconds, returns the report dict.
+
+    Every client sends rate requests per second (0: one after the other
+    as fast as the server answers). frames counts the new valid frames
+    seen on /data by every client (or the frames in downloaded logs),
+    distinct_frames the different /data frames seen by any of them.
+    """
+    parts = urlsplit(url)
+    stats = ClientStats()
+    started = time.monotonic()
+    end = started + duration
+    interval = 1 / rate if rate else 0.0
+    await asyncio.gather(*(_client(parts.hostname, parts.port or 80, path, stats, end, interval) for _ in range(clients)))
+    return dict(stats.report(time.monotonic() - started, clients), clients=clients, path=path)
+
+
+def print_report(report):
+    print(f"{report['clients']} clients on {report['path']}: {report['requests']} requests in {report['elapsed']:.1f} s "
+          f"({report['requests_per_s']:.1f}/s), {report['errors']} errors")
+    print("latency " + "  ".join(f"p{p} {report[f'p{p}_ms']:.1f} ms" for p in PERCENTILES) + f"  max {report['max_ms']:.1f} ms")
+    print(f"{report['frames']} frames ({report['frames_per_client_s']:.1f} frames/s per client), {report['mb_per_s']:.2f} MB/s")
+    if report["path"] == "/data":
+        print(f"{report['distinct_frames']} distinct frames ({report['distinct_frames_per_s']:.1f} frames/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the datalogger's HTTP routes (or esp32_replay.py).")
+    parser.add_argument("--url", default="http://192.168.4.1", help="datalogger address")
+    parser.add_argument("--path", default="/data", help="route to request, e.g. /data or /download")
+    parser.add_argument("-c", "--clients", type=int, default=10, help="concurrent clients")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--rate", type=float, default=0.0, help="requests per second per client (0: as fast as possible)")
+    args = parser.parse_args(argv)
+
+    print_report(asyncio.run(run_load(args.url, args.clients, args.duration, args.path, args.rate)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import csv
+import math
+import time
+import numpy as np
+import pandas as pd
+import ecu_frame
+import live_ingest
+from time_index import unwrap_steps
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# IMU/GPS board websocket, the "parse websocket" node of flows.json reads the same stream
+DEFAULT_URL = "ws://192.168.1.1/ws"
+
+# Comma separated values of one message, in this order (see flows.json)
+IMU_FIELDS = ["Time", "Lat", "Lng", "Alt", "Sat", "gpsDateTime",
+              "AccX", "AccY", "AccZ", "GyrX", "GyrY", "GyrZ",
+              "MagX", "MagY", "MagZ", "Yaw", "Pitch", "Roll",
+              "Heading", "TempIMU", "Pressure", "Altitude", "TempBMP"]
+
+# Channels that can be joined, gpsDateTime is text
+NUMERIC_FIELDS = [field for field in IMU_FIELDS if field != "gpsDateTime"]
+
+# Host receive time of every message, as live_ingest stores it for the ECU samples
+TIME_CHANNEL = live_ingest.TIME_CHANNEL
+
+# Default join tolerance (seconds): IMU samples further from an ECU sample are not used
+TOLERANCE = 0.1
+
+# Rows read per step when joining files
+CHUNK_ROWS = 1 << 16
+
+
+def parse_message(text):
+    """Values of one websocket message, missing or malformed numbers are NaN."""
+    values = text.strip().split(",")
+    row = {}
+    for i, field in enumerate(IMU_FIELDS):
+        value = values[i].strip() if i < len(values) else ""
+        if field == "gpsDateTime":
+            row[field] = value
+            continue
+        try:
+            row[field] = float(value)
+        except ValueError:
+            row[field] = math.nan
+    return row
+
+
+def asof_join(left_time, right_time, right_columns, tolerance=TOLERANCE, interpolate=False):
+    """Values of right_columns at the sorted left_time, from samples at the sorted right_time.
+
+    Each left time takes the last right sample at or before it or, with
+    interpolate, the linear interpolation between the samples around it.
+    Samples further than tolerance seconds away (None: any distance) are
+    not used and give NaN. Binary search, O((n + m) log m).
+    """
+    left_time = np.asarray(left_time, dtype=np.float64)
+    right_time = np.asarray(right_time, dtype=np.float64)
+    n = len(right_time)
+    if n == 0:
+        return {name: np.full(len(left_time), np.nan) for name in right_columns}
+    after = np.searchsorted(right_time, left_time, side="right")
+    before = np.maximum(after - 1, 0)
+    found = after > 0
+    if tolerance is not None:
+        found &= left_time - right_time[before] <= tolerance
+    if interpolate:
+        after = np.minimum(after, n - 1)
+        exact = found & (right_time[before] == left_time)
+        found &= right_time[after] >= left_time
+        if tolerance is not None:
+            found &= right_time[after] - left_time <= tolerance
+        span = right_time[after] - right_time[before]
+        weight = np.where(found & (span > 0), (left_time - right_time[before]) / np.where(span > 0, span, 1), 0.0)
+        found |= exact
+    joined = {}
+    for name, values in right_columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        if interpolate:
+            values = values[before] + weight * (values[after] - values[before])
+        else:
+            values = values[before]
+        joined[name] = np.where(found, values, np.nan)
+    return joined
+
+
+class AsofJoiner:
+    """Streaming as-of join of ECU samples (left) onto IMU samples (right).
+
+    Both sides are added in time order, in blocks of any size. An ECU
+    sample is joined as soon as the IMU stream has reached its time (or,
+    live, once pop(now) shows no IMU sample within tolerance can still
+    come), so only the IMU samples around the pending ECU samples are kept.
+    """
+
+    def __init__(self, channels=NUMERIC_FIELDS, tolerance=TOLERANCE, interpolate=False):
+        self.channels = list(channels)
+        self.tolerance = tolerance
+        self.interpolate = interpolate
+        self._right_time = np.empty(0)
+        self._right = {name: np.empty(0) for name in self.channels}
+        self._left_time = np.empty(0)
+        self._left = []
+
+    @property
+    def right_end(self):
+        """Time of the latest IMU sample, -inf before the first."""
+        return self._right_time[-1] if len(self._right_time) else -np.inf
+
+    def add_right(self, times, columns):
+        """Add IMU samples: their times and a column per channel."""
+        self._right_time = np.concatenate([self._right_time, np.asarray(times, dtype=np.float64)])
+        for name in self.channels:
+            self._right[name] = np.concatenate([self._right[name], np.asarray(columns[name], dtype=np.float64)])
+
+    def add_left(self, times, columns):
+        """Add ECU samples: their times and the columns to pass through."""
+        self._left_time = np.concatenate([self._left_time, np.asarray(times, dtype=np.float64)])
+        self._left.append({name: np.asarray(values) for name, values in columns.items()})
+
+    def pop(self, now=None, final=False):
+        """Joined columns (ECU columns, then the IMU channels) of the ECU samples that can be joined."""
+        limit = self.right_end
+        if now is not None and self.tolerance is not None:
+            limit = max(limit, now - self.tolerance)
+        ready = len(self._left_time) if final else int(np.searchsorted(self._left_time, limit, side="right"))
+        left = {name: np.concatenate([part[name] for part in self._left]) for name in self._left[0]} if self._left else {}
+        joined = {name: values[:ready] for name, values in left.items()}
+        joined.update(asof_join(self._left_time[:ready], self._right_time, self._right, self.tolerance, self.interpolate))
+        self._left = [{name: values[ready:] for name, values in left.items()}] if left else []
+        watermark = self._left_time[ready - 1] if ready else None
+        self._left_time = self._left_time[ready:]
+        if len(self._left_time):
+            watermark = self._left_time[0]
+        if watermark is not None:
+            # Drop the IMU samples no pending or later ECU sample can use, keep the one before
+            cut = max(int(np.searchsorted(self._right_time, watermark, side="right")) - 1, 0)
+            self._right_time = self._right_time[cut:]
+            self._right = {name: values[cut:] for name, values in self._right.items()}
+        return joined
+
+
+class ImuRecorder:
+    """Receive the IMU/GPS websocket stream, stamp every message with the host time.
+
+    Messages are appended to a CSV (TIME_CHANNEL, then IMU_FIELDS) if a
+    path is given, subscribers are called with every parsed row.
+    """
+
+    def __init__(self, url=DEFAULT_URL, path=None):
+        self.url = url
+        self.path = path
+        self.subscribers = []
+        self.messages = 0
+        self.errors = 0
+        self._stop = asyncio.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+
+    def receive(self, text, writer=None, received=None):
+        """Parse one message, returns its row (None if it has no valid time)."""
+        row = parse_message(text)
+        if len(text.split(",")) < len(IMU_FIELDS) or math.isnan(row["Time"]):
+            self.errors += 1
+            return None
+        row[TIME_CHANNEL] = time.time() if received is None else received
+        self.messages += 1
+        if writer is not None:
+            writer.writerow([row[TIME_CHANNEL]] + [row[field] for field in IMU_FIELDS])
+        for callback in list(self.subscribers):
+            callback(row)
+        return row
+
+    async def run(self, duration=None):
+        """Receive until stop() is called or duration seconds have passed."""
+        if websockets is None:
+            raise RuntimeError("websockets is not installed")
+        f = open(self.path, "w", newline="") if self.path else None
+        writer = csv.writer(f) if f else None
+        if writer:
+            writer.writerow([TIME_CHANNEL] + IMU_FIELDS)
+        self._stop.clear()
+        try:
+            async with websockets.connect(self.url) as ws:
+                loop = asyncio.get_running_loop()
+                end = None if duration is None else loop.time() + duration
+                while not self._stop.is_set():
+                    timeout = None if end is None else end - loop.time()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    try:
+                        message = await asyncio.wait_for(ws.recv(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    self.receive(message if isinstance(message, str) else message.decode(errors="replace"), writer)
+        finally:
+            if f:
+                f.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+def read_imu(path, chunksize=CHUNK_ROWS):
+    """Yield column dicts of a recorded IMU CSV in chunks."""
+    for df in pd.read_csv(path, chunksize=chunksize):
+        yield {name: df[name].to_numpy() for name in df.columns}
+
+
+class _FlightClock:
+    # Unwrapped ECU Seconds across chunks, as TimeIndex does for a whole flight
+
+    def __init__(self):
+        self.seconds = None
+        self.time = None
+
+    def __call__(self, seconds):
+        seconds = np.asarray(seconds, dtype=np.int64)
+        if not len(seconds):
+            return np.empty(0)
+        if self.seconds is None:
+            self.seconds = self.time = int(seconds[0])
+        step, _ = unwrap_steps(np.diff(np.concatenate([[self.seconds], seconds])))
+        time = self.time + np.cumsum(step)
+        self.seconds, self.time = int(seconds[-1]), int(time[-1])
+        return time.astype(np.float64)
+
+
+def _write_joined(writer, joined, header=False):
+    # Write joined columns, returns the number of rows
+    if header:
+        writer.writerow(list(joined))
+    writer.writerows(ecu_frame.iter_rows(joined))
+    return len(next(iter(joined.values())))
+
+
+def join_files(ecu_csv, imu_csv, output_csv, tolerance=TOLERANCE, interpolate=False, imu_time="Time", imu_scale=1.0,
+               offset=0.0, channels=NUMERIC_FIELDS):
+    """Join a recorded IMU CSV onto a decrypted ECU CSV, streaming both, returns the joined row count.
+
+    ECU samples are timed by their TIME_CHANNEL column when the CSV has one
+    (live capture) and by the unwrapped Seconds otherwise. IMU samples are
+    timed by imu_time * imu_scale + offset, so the two clocks line up.
+    """
+    ecu_chunks = pd.read_csv(ecu_csv, chunksize=CHUNK_ROWS)
+    imu_chunks = read_imu(imu_csv)
+    joiner = AsofJoiner(channels, tolerance, interpolate)
+    clock = _FlightClock()
+    imu_done = False
+    rows = 0
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        header = None
+        for df in ecu_chunks:
+            times = df[TIME_CHANNEL].to_numpy(dtype=np.float64) if TIME_CHANNEL in df else clock(df["Seconds"])
+            joiner.add_left(times, {name: df[name].to_numpy() for name in df.columns})
+            # Read the IMU log up to the end of this ECU chunk (plus tolerance for interpolation)
+            until = times[-1] + (tolerance or 0) if len(times) else -np.inf
+            while not imu_done and joiner.right_end < until:
+                imu = next(imu_chunks, None)
+                if imu is None:
+                    imu_done = True
+                    break
+                joiner.add_right(imu[imu_time] * imu_scale + offset, imu)
+            rows += _write_joined(writer, joiner.pop(), header is None)
+            header = True
+        rows += _write_joined(writer, joiner.pop(final=True), header is None)
+    return rows
+
+
+async def join_live(ecu_url, imu_url, output_csv, tolerance=TOLERANCE, interpolate=False, duration=None,
+                    channels=NUMERIC_FIELDS, imu_csv=None):
+    """Poll the ECU and receive the IMU stream at the same time, joining them on the host receive time.
+
+    Joined rows are appended to output_csv as soon as they are final.
+    Returns (ECU ingester, IMU recorder).
+    """
+    ingester = live_ingest.LiveIngester(ecu_url)
+    recorder = ImuRecorder(imu_url, imu_csv)
+    joiner = AsofJoiner(channels, tolerance, interpolate)
+    recorder.subscribe(lambda row: joiner.add_right([row[TIME_CHANNEL]], {name: [row[name]] for name in channels}))
+
+    def add_sample(ingester):
+        latest = ingester.buffers.latest()
+        joiner.add_left([latest[TIME_CHANNEL]], {name: [value] for name, value in latest.items()})
+
+    ingester.subscribe(add_sample)
+    with open(output_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(ecu_frame.COLUMN_DTYPES) + [TIME_CHANNEL] + channels)
+
+        async def flush():
+            while True:
+                await asyncio.sleep(tolerance or 1)
+                writer.writerows(ecu_frame.iter_rows(joiner.pop(time.time())))
+
+        flusher = asyncio.create_task(flush())
+        try:
+            await asyncio.gather(ingester.run(duration), recorder.run(duration))
+        finally:
+            flusher.cancel()
+            writer.writerows(ecu_frame.iter_rows(joiner.pop(final=True)))
+    return ingester, recorder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record the IMU/GPS websocket stream and join it onto ECU data.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="record the IMU stream to a CSV")
+    record.add_argument("-o", "--output", default="imu.csv", help="IMU CSV")
+    record.add_argument("--url", default=DEFAULT_URL, help="IMU websocket URL")
+    record.add_argument("--duration", type=float, help="stop after N seconds")
+
+    join = sub.add_parser("join", help="join a recorded IMU CSV onto a decrypted ECU CSV")
+    join.add_argument("ecu", help="decrypted ECU CSV")
+    join.add_argument("imu", help="IMU CSV from record")
+    join.add_argument("-o", "--output", default="joined.csv", help="joined CSV")
+    join.add_argument("--imu-time", default="Time", help=f"IMU time column, {TIME_CHANNEL} for host receive time")
+    join.add_argument("--imu-scale", type=float, default=1.0, help="IMU time unit in seconds (0.001 for ms)")
+    join.add_argument("--offset", type=float, default=0.0, help="seconds added to the IMU time to reach ECU time")
+
+    live = sub.add_parser("live", help="join the live ECU and IMU streams")
+    live.add_argument("-o", "--output", default="joined.csv", help="joined CSV")
+    live.add_argument("--ecu-url", default=live_ingest.DEFAULT_URL, help="ECU live data URL")
+    live.add_argument("--url", default=DEFAULT_URL, help="IMU websocket URL")
+    live.add_argument("--imu-output", help="also record the raw IMU stream to this CSV")
+    live.add_argument("--duration", type=float, help="stop after N seconds")
+
+    for command in (join, live):
+        command.add_argument("--tolerance", type=float, default=TOLERANCE, help="largest ECU/IMU time distance (seconds)")
+        command.add_argument("--interpolate", action="store_true", help="interpolate between the IMU samples around each ECU sample")
+        command.add_argument("--channels", nargs="+", default=NUMERIC_FIELDS, help="IMU channels to join")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "record":
+            recorder = ImuRecorder(args.url, args.output)
+            asyncio.run(recorder.run(args.duration))
+            print(f"{recorder.messages} messages, {recorder.errors} errors, written to {args.output}")
+        elif args.command == "join":
+            rows = join_files(args.ecu, args.imu, args.output, args.tolerance, args.interpolate, args.imu_time,
+                              args.imu_scale, args.offset, args.channels)
+            print(f"{rows} rows written to {args.output}")
+        else:
+            ingester, recorder = asyncio.run(join_live(args.ecu_url, args.url, args.output, args.tolerance, args.interpolate,
+                                                       args.duration, args.channels, args.imu_output))
+            print(f"{ingester.buffers.total} ECU samples, {recorder.messages} IMU messages, written to {args.output}")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import itertools
+import queue
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised inside a job (by Job.check) and by Job.wait when the job was cancelled."""
+
+
+class Job:
+    """One function call run by a JobRunner.
+
+    The function gets the job as its first argument, reports with
+    progress(message, fraction) and calls check() at safe points so a
+    cancel() takes effect. Front ends read state/message/fraction or wait().
+    """
+
+    def __init__(self, fn, args, kwargs, key=None, delay=0.0):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.not_before = time.monotonic() + delay
+        self.state = "queued"
+        self.message = ""
+        self.fraction = None
+        self.result = None
+        self.error = None
+        self.on_update = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """Ask the job to stop, a queued job never starts."""
+        self._cancel.set()
+
+    def check(self):
+        """Raise Cancelled if cancel() was called, call at points where stopping is safe."""
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def progress(self, message, fraction=None):
+        self.message = message
+        self.fraction = fraction
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def wait(self, timeout=None):
+        """Result of the job, re-raises its exception or Cancelled."""
+        if not self._done.wait(timeout):
+            raise TimeoutError("job still running")
+        if self.state == "cancelled":
+            raise Cancelled()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _run(self):
+        if self.cancelled or self._cancel.wait(max(0.0, self.not_before - time.monotonic())):
+            self._finish("cancelled")
+            return
+        self.state = "running"
+        try:
+            self.result = self.fn(self, *self.args, **self.kwargs)
+            self._finish("done")
+        except Cancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            self.error = e
+            self._finish("failed")
+
+    def _finish(self, state):
+        self.state = state
+        self._done.set()
+        if self.on_update is not None:
+            self.on_update(self)
+
+
+class JobRunner:
+    """Runs jobs one after the other on a background thread, so a front end stays responsive.
+
+    Jobs submitted with a key supersede the earlier jobs of that key: those
+    still queued are dropped and a running one is cancelled, so only the
+    latest request (e.g. the latest plot selection) does its work. A delay
+    debounces bursts of requests.
+    """
+
+    def __init__(self, name="jobs", on_update=None):
+        self.on_update = on_update
+        self._queue = queue.Queue()
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, key=None, delay=0.0, **kwargs):
+        """Queue fn(job, *args, **kwargs), returns the Job."""
+        job = Job(fn, args, kwargs, key, delay)
+        job.id = next(self._ids)
+        job.on_update = self.on_update
+        with self._lock:
+            if key is not None:
+                previous = self._latest.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self._latest[key] = job
+        self._queue.put(job)
+        return job
+
+    def cancel(self, key=None):
+        """Cancel the latest job of key (every key with None)."""
+        with self._lock:
+            for job_key, job in self._latest.items():
+                if key is None or job_key == key:
+                    job.cancel()
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            self.cancel()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job._run()
+            with self._lock:
+                if job.key is not None and self._latest.get(job.key) is job:
+                    del self._latest[job.key]
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import time
+import urllib.request
+import numpy as np
+import ecu_frame
+import ecu_validate
+import flight_events
+from ring_buffer import ChannelBuffers
+from time_index import format_hms
+
+# The datalogger soft-AP serves the latest ECU response here
+DEFAULT_URL = "http://192.168.4.1/data"
+
+# Polls per second (the Node-RED flow polled every 2 s) and samples kept per channel
+POLL_RATE = 10
+CAPACITY = 36000
+
+# Host receive time of every sample, next to the decoded CSV columns
+TIME_CHANNEL = "Received"
+
+
+def decode_packet(payload):
+    """Decode the last complete frame of a /data payload, None if there is none or it is invalid."""
+    tokens = ecu_frame.hex_tokens(payload)
+    frames, _ = ecu_frame.chunk_frames(tokens)
+    frames = frames[-1:][ecu_validate.valid_mask(frames[-1:])]
+    if len(frames) == 0:
+        return None
+    columns, skipped = ecu_frame.decode_frames(frames)
+    return None if skipped else columns
+
+
+class LiveIngester:
+    """Poll the /data endpoint and keep the decoded samples in a ring buffer per channel.
+
+    Each packet is decoded once with the shared frame layout, the same ECU
+    response returned by several polls is only stored once. Subscribers
+    are called with the ingester after every new sample and read from
+    self.buffers (snapshot/latest).
+    """
+
+    def __init__(self, url=DEFAULT_URL, rate=POLL_RATE, capacity=CAPACITY, timeout=2):
+        self.url = url
+        self.interval = 1 / rate
+        self.timeout = timeout
+        self.buffers = ChannelBuffers(dict(ecu_frame.COLUMN_DTYPES, **{TIME_CHANNEL: np.float64}), capacity)
+        self.subscribers = []
+        self.polls = 0
+        self.errors = 0
+        self.duplicates = 0
+        self._last_payload = None
+        self._stop = asyncio.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def _fetch(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            return response.read()
+
+    def ingest(self, payload, received=None):
+        """Decode one payload into the buffers, returns True if a new sample was stored."""
+        payload = payload.strip()
+        if payload == self._last_payload:
+            self.duplicates += 1
+            return False
+        self._last_payload = payload
+        columns = decode_packet(payload)
+        if columns is None:
+            self.errors += 1
+            return False
+        columns[TIME_CHANNEL] = time.time() if received is None else received
+        self.buffers.append(columns)
+        for callback in list(self.subscribers):
+            callback(self)
+        return True
+
+    async def poll_once(self):
+        self.polls += 1
+        try:
+            payload = await asyncio.to_thread(self._fetch)
+        except OSError as e:
+            self.errors += 1
+            print(f"Error polling {self.url}: {e}")
+            return False
+        return self.ingest(payload)
+
+    async def run(self, duration=None):
+        """Poll at a fixed rate until stop() is called or duration seconds have passed."""
+        loop = asyncio.get_running_loop()
+        started = next_poll = loop.time()
+        self._stop.clear()
+        while not self._stop.is_set():
+            if duration is not None and loop.time() - started >= duration:
+                break
+            await self.poll_once()
+            # Fixed schedule, a slow poll is not followed by a burst of catch-up polls
+            next_poll = max(next_poll + self.interval, loop.time())
+            try:
+                await asyncio.wait_for(self._stop.wait(), next_poll - loop.time())
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        self._stop.set()
+
+
+def print_latest(ingester):
+    latest = ingester.buffers.latest()
+    print(f"{format_hms(latest['Seconds'])}  RPM {latest['RPM']:>5}  TPS {latest['Throttle Position (%)']:5.1f}  "
+          f"MAP {latest['Manifold Absolute Pressure (kPa)']:6.1f}  CLT {latest['Cylinder Temperature (deg C)']:5.1f}  "
+          f"Batt {latest['Battery Voltage (V)']:4.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Poll the datalogger /data endpoint and print live values.")
+    parser.add_argument("--url", default=DEFAULT_URL, help="live data URL")
+    parser.add_argument("--rate", type=float, default=POLL_RATE, help="polls per second")
+    parser.add_argument("--capacity", type=int, default=CAPACITY, help="samples kept per channel")
+    parser.add_argument("--duration", type=float, help="stop after N seconds")
+    parser.add_argument("--events", action="store_true", help="print engine events as they are detected instead of every sample")
+    parser.add_argument("--rules", help="JSON event rules file (default: the built-in rules)")
+    args = parser.parse_args(argv)
+
+    ingester = LiveIngester(args.url, args.rate, args.capacity)
+    if args.events or args.rules:
+        # Same rules as for finished logs, evaluated on every new sample
+        detector = flight_events.EventDetector(flight_events.load_rules(args.rules) if args.rules else flight_events.RULES,
+                                               on_event=flight_events.print_event)
+        ingester.subscribe(lambda ingester: detector.update_sample(ingester.buffers.latest()))
+    else:
+        ingester.subscribe(print_latest)
+    try:
+        asyncio.run(ingester.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(f"{ingester.polls} polls, {ingester.buffers.total} samples, {ingester.duplicates} repeated, {ingester.errors} errors")
+
+
+if __name__ == "__main__":
+    main()
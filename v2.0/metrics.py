@@ -0,0 +1,157 @@
+import contextlib
+import cProfile
+import json
+import time
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Rejection counters, one per reason a frame or value is dropped
+REJECT_SHORT_CHUNK = "rejected.short_chunk"
+REJECT_PARSE = "rejected.parse_error"
+# Frames failing validation count as REJECT_PREFIX + ecu_validate reason code
+REJECT_PREFIX = "rejected."
+REJECT_RESYNC = "rejected.resync_values"
+# Points where the framer resynchronised (not a rejection, the values lost count as REJECT_RESYNC)
+RESYNCS = "resyncs"
+
+# Listeners are called at most this often (seconds)
+UPDATE_INTERVAL = 0.1
+
+_END = object()
+
+
+def resync_values(counts):
+    """Values skipped while resynchronising, from a counts dict of the resync framer."""
+    return sum(n for _, n in counts.get("resync_skips", []) if n > 0)
+
+
+def count_rejections(metrics, counts):
+    """Add the totals of a finished decode (stream_csv counts) to the counters."""
+    metrics.count("frames", counts.get("frames", 0))
+    metrics.count("records", counts.get("records", 0))
+    metrics.count("duplicates", counts.get("duplicates", 0))
+    for code, n in counts.get("rejections", {}).items():
+        metrics.count(REJECT_PREFIX + code, n)
+    metrics.count(REJECT_PARSE, counts.get("skipped", 0))
+    metrics.count(REJECT_SHORT_CHUNK, counts.get("leftover", 0))
+    metrics.count(REJECT_RESYNC, resync_values(counts))
+    metrics.count(RESYNCS, len(counts.get("resync_skips", [])))
+
+
+class Metrics:
+    """Stage timers and counters of one processing run.
+
+    on_update(metrics) is called, throttled, whenever a counter changes so a
+    UI can show live progress. report() returns everything as a JSON-ready dict.
+    """
+
+    enabled = True
+
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.current_stage = None
+        self._last_update = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a stage, nested and repeated stages accumulate."""
+        outer, self.current_stage = self.current_stage, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += time.perf_counter() - started
+            entry["calls"] += 1
+            self.current_stage = outer
+
+    def timed(self, name, iterable):
+        """Iterate over iterable, the time spent producing items counts for stage name."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+        if self.on_update is not None:
+            now = time.perf_counter()
+            if now - self._last_update >= UPDATE_INTERVAL:
+                self._last_update = now
+                self.on_update(self)
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def rejected(self):
+        """Total of the rejection counters."""
+        return sum(n for name, n in self.counters.items() if name.startswith("rejected."))
+
+    def report(self, **extra):
+        """Run report: stage times, counters and any extra fields."""
+        return dict(
+            started=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            elapsed=time.time() - self.started,
+            stages=self.stages,
+            counters=self.counters,
+            **extra,
+        )
+
+    def write_report(self, path, **extra):
+        with open(path, "w") as f:
+            json.dump(self.report(**extra), f, indent=2)
+        return path
+
+
+class _Disabled(Metrics):
+    # Shared do-nothing instance used when instrumentation is off
+    enabled = False
+
+    def __init__(self):
+        super().__init__()
+        self._null = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+
+DISABLED = _Disabled()
+
+
+@contextlib.contextmanager
+def profile(path, tool="cprofile"):
+    """Profile the block into path: a .prof cProfile dump or a pyinstrument HTML page."""
+    if tool == "pyinstrument":
+        if pyinstrument is None:
+            raise RuntimeError("pyinstrument is not installed")
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
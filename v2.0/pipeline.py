@@ -0,0 +1,155 @@
+import os
+import shutil
+import time
+import ecu_binlog
+import ecu_frame
+import ecu_parallel
+import ecu_resync
+import ecu_validate
+import flight_cache
+import flight_catalog
+import flight_coverage
+import flight_data
+import flight_events
+import flight_stats
+import metrics as run_metrics
+import plot_render
+from time_index import GAP_SECONDS, TimeIndex
+
+
+def decode_log(input_file, output_dir, keep_processed=False, metrics=None, workers=1):
+    """Decode a raw SD log to decrypted_data.csv in output_dir, returns (csv path, counts, columns).
+
+    Rejected frames go to quarantine.csv with their reason codes, repeated
+    frames are dropped and the coverage of the rest (gaps, resets,
+    segments) goes to coverage.json. Logs decoded before are taken from the
+    flight cache, with the counts and quarantine.csv of their first decode,
+    so the output folder is the same. Binary logs are streamed from their
+    memory map in blocks. Raw hex logs are decoded in workers processes when that is not 1
+    (None: one per core) and no processed_data.txt is kept. Stage times
+    and rejection counters (resyncs, leftover and unparsable values
+    included) go to metrics (a metrics.Metrics). columns are the decoded
+    columns, memory-mapped from the log's cache entry, for the later stages.
+    """
+    metrics = metrics or run_metrics.DISABLED
+    output_csv = os.path.join(output_dir, "decrypted_data.csv")
+    txt_output = os.path.join(output_dir, "processed_data.txt") if keep_processed else None
+    quarantine_csv = os.path.join(output_dir, ecu_validate.QUARANTINE_FILE)
+    binlog = ecu_binlog.is_binlog(input_file)
+
+    with metrics.stage("cache_load"):
+        columns = flight_cache.load(input_file)
+        info = flight_cache.load_info(input_file)
+        cached_quarantine = flight_cache.cached_file(input_file, ecu_validate.QUARANTINE_FILE)
+    # Flights cached without decode counts (e.g. by the Gradio app) are decoded again
+    if columns is not None and txt_output is None and info and cached_quarantine:
+        counts = dict(info, cached=True)
+        with metrics.stage("csv_write"):
+            ecu_frame.write_csv(output_csv, columns)
+            shutil.copyfile(cached_quarantine, quarantine_csv)
+        counts["records"] = len(columns["Seconds"])
+        run_metrics.count_rejections(metrics, counts)
+        flight_coverage.write_coverage(counts["coverage"], output_dir)
+        return output_csv, counts, columns
+
+    # The decoded blocks go straight to the cache, memory stays bounded
+    cache = flight_cache.CacheWriter(input_file)
+    try:
+        if workers != 1 and txt_output is None and not binlog:
+            counts = ecu_parallel.decode_parallel(input_file, output_csv, workers, columns_out=cache, metrics=metrics,
+                                                  quarantine_csv=quarantine_csv)
+        else:
+            frame_source = ecu_binlog.iter_frames if binlog else ecu_resync.iter_frames
+            counts = ecu_frame.stream_csv(input_file, output_csv, txt_output, frame_source=frame_source,
+                                          columns_out=cache, metrics=metrics, quarantine_csv=quarantine_csv)
+    except BaseException:
+        cache.abort()
+        raise
+    with metrics.stage("cache_store"):
+        cache.close(info=counts, files=[quarantine_csv])
+        # Read back once from the CSV only if the entry did not fit in the cache
+        columns = flight_cache.load(input_file)
+        if columns is None:
+            columns = flight_cache.read_csv(output_csv)
+    flight_coverage.write_coverage(counts["coverage"], output_dir)
+    return output_csv, counts, columns
+
+
+def _columns(flight):
+    # Stage input: decoded columns (see decode_log) or the path of a decrypted CSV
+    return flight_cache.load_flight(flight) if isinstance(flight, (str, os.PathLike)) else flight
+
+
+def plot_flight(flight, output_dir, plots=plot_render.PLOTS, workers=None, metrics=None, events=None):
+    """Render the plot set of a flight (decoded columns or a decrypted CSV) into output_dir, events are shaded on the plots."""
+    metrics = metrics or run_metrics.DISABLED
+    with metrics.stage("plot_load"):
+        if isinstance(flight, (str, os.PathLike)):
+            flight = flight_data.load(flight)
+        else:
+            flight = flight_data.Flight.from_columns(flight)
+    time_index = TimeIndex(flight['Seconds'], gap=GAP_SECONDS)
+    columns = flight.columns(list(dict.fromkeys(col for spec in plots for col in spec.columns)))
+    # Pressures are plotted in MPa
+    for name in ('Barometric Pressure (kPa)', 'Manifold Absolute Pressure (kPa)'):
+        if name in columns:
+            columns[name] = columns[name] / 1000
+    metrics.count("flight_bytes", flight.nbytes)
+    os.makedirs(output_dir, exist_ok=True)
+    with metrics.stage("plot"):
+        return plot_render.render_plots(columns, output_dir, time_index.time, plots, workers, events=events,
+                                        segments=time_index.segments)
+
+
+def detect_events(flight, output_dir, rules=flight_events.RULES, metrics=None):
+    """Run the event rules over a flight (decoded columns or a decrypted CSV) and write events.csv to output_dir, returns the events."""
+    metrics = metrics or run_metrics.DISABLED
+    with metrics.stage("events"):
+        events = flight_events.detect(_columns(flight), rules)
+    os.makedirs(output_dir, exist_ok=True)
+    flight_events.write_timeline(events, output_dir)
+    metrics.count("events", len(events))
+    return events
+
+
+def write_flight_stats(flight, output_dir, metrics=None):
+    """Write the statistics of a flight (decoded columns or a decrypted CSV) to flight_stats.json in output_dir, returns its path."""
+    metrics = metrics or run_metrics.DISABLED
+    with metrics.stage("stats"):
+        return flight_stats.write_summary(flight_stats.flight_stats(flight), output_dir)
+
+
+def catalog_flight(input_file, csv_path, output_dir, metrics=None, catalog_path=None, columns=None):
+    """Add a processed flight to the flight catalog (skipped if it is already there), returns its id.
+
+    columns are its decoded columns if at hand (see decode_log), else they are read from csv_path.
+    """
+    metrics = metrics or run_metrics.DISABLED
+    with metrics.stage("catalog"), flight_catalog.Catalog(catalog_path or flight_catalog.CATALOG_PATH) as catalog:
+        return catalog.ingest(input_file, csv_path, output_dir, columns=columns)
+
+
+def process_log(input_file, output_dir, plots=plot_render.PLOTS, keep_processed=False, plot_workers=None, metrics=None,
+                decode_workers=1):
+    """Run decode and plotting for one log into output_dir, returns a summary dict."""
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    # The flight is decoded (or taken from the cache) once, the later stages share its columns
+    csv_path, counts, columns = decode_log(input_file, output_dir, keep_processed, metrics, decode_workers)
+    events = detect_events(columns, output_dir, metrics=metrics)
+    plot_flight(columns, output_dir, plots, plot_workers, metrics, events)
+    write_flight_stats(columns, output_dir, metrics)
+    flight_id = catalog_flight(input_file, csv_path, output_dir, metrics, columns=columns)
+    return {
+        "input": input_file,
+        "output": output_dir,
+        "records": counts["records"],
+        "rejected": counts.get("garbage", 0) + counts.get("skipped", 0),
+        "resyncs": len(counts.get("resync_skips", [])),
+        "duplicates": counts.get("duplicates", 0),
+        "coverage": counts["coverage"]["coverage"],
+        "cached": counts.get("cached", False),
+        "events": len(events),
+        "flight_id": flight_id,
+        "elapsed": time.perf_counter() - started,
+    }
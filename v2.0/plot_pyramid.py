@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class MinMaxPyramid:
+    """Min/max level-of-detail pyramid of one column for plotting.
+
+    Level k keeps the minimum and maximum (and where they occur) of every
+    bucket of 2**k samples, so spikes survive at any resolution.
+    """
+
+    def __init__(self, values):
+        self.values = np.asarray(values)
+        index = np.arange(len(self.values))
+        level = (self.values, self.values, index, index)
+        self.levels = [level]
+        while len(level[0]) > 1:
+            level = self._combine(*level)
+            self.levels.append(level)
+
+    @staticmethod
+    def _combine(mins, maxs, imin, imax):
+        # Merge neighbouring buckets in pairs (the last one is paired with itself)
+        if len(mins) % 2:
+            mins, maxs = np.append(mins, mins[-1:]), np.append(maxs, maxs[-1:])
+            imin, imax = np.append(imin, imin[-1:]), np.append(imax, imax[-1:])
+        take_min = mins[1::2] < mins[0::2]
+        take_max = maxs[1::2] > maxs[0::2]
+        return (
+            np.where(take_min, mins[1::2], mins[0::2]),
+            np.where(take_max, maxs[1::2], maxs[0::2]),
+            np.where(take_min, imin[1::2], imin[0::2]),
+            np.where(take_max, imax[1::2], imax[0::2]),
+        )
+
+    def level_for(self, count, width):
+        """Coarsest level needed to show count samples in width pixels (one bucket per pixel)."""
+        if count <= 2 * width:
+            return 0
+        return min(int(np.ceil(np.log2(count / width))), len(self.levels) - 1)
+
+    def query(self, start=0, stop=None, width=1000):
+        """Sample indices and values to draw samples [start, stop) in width pixels."""
+        stop = len(self.values) if stop is None else min(stop, len(self.values))
+        start = max(start, 0)
+        if stop <= start:
+            return np.empty(0, dtype=np.int64), self.values[:0]
+        k = self.level_for(stop - start, width)
+        if k == 0:
+            return np.arange(start, stop), self.values[start:stop]
+        _, _, imin, imax = self.levels[k]
+        buckets = slice(start >> k, -(-stop >> k))
+        # Draw the minimum and maximum of every bucket in time order
+        index = np.sort(np.stack([imin[buckets], imax[buckets]], axis=1), axis=1).ravel()
+        return index, self.values[index]
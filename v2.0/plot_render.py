@@ -0,0 +1,130 @@
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator, FuncFormatter
+from plot_pyramid import MinMaxPyramid
+from time_index import break_lines, format_hms
+
+# One plot of the report: columns drawn against time and the PNG it is saved to
+PlotSpec = namedtuple("PlotSpec", ["columns", "colors", "ylabel", "filename", "title", "labels"], defaults=[None, None])
+
+PLOTS = [
+    PlotSpec(['Injection Pulse Width 1 (us)', 'Injection Pulse Width 2 (us)'], ['red', 'blue'], 'Pulse Width (us)', 'injection_pulse_width.png'),
+    PlotSpec(['RPM'], ['red'], 'RPM', 'rpm.png'),
+    PlotSpec(['Throttle Position (%)'], ['red'], 'Throttle Position %', 'throttle_position.png'),
+    PlotSpec(['Ignition Advance Angle (deg)'], ['green'], 'Degrees', 'ignition_advance.png'),
+    PlotSpec(['Injection Event Scheduling'], ['green'], 'Injection Event Scheduling', 'injection_event.png'),
+    PlotSpec(['Air-Fuel Ratio Target 1', 'Air-Fuel Ratio Target 2'], ['green', 'blue'], 'Air-Fuel Ratio', 'afr_target.png'),
+    PlotSpec(['WBO2 Enabled 1', 'WBO2 Enabled 2'], ['green', 'blue'], 'WBO Status', 'wbo_enabled.png'),
+    PlotSpec(['Barometric Pressure (kPa)', 'Manifold Absolute Pressure (kPa)'], ['red', 'blue'], 'Pressure (MPa)', 'pressure.png'),
+    PlotSpec(['Manifold Air Temperature (deg C)', 'Cylinder Temperature (deg C)'], ['red', 'blue'], 'Temperature (°C)', 'temperature.png'),
+    PlotSpec(['Battery Voltage (V)'], ['green'], 'Voltage (V)', 'battery_voltage.png'),
+]
+
+# Figure size in inches and resolution of the saved PNGs
+PLOT_SIZE = (20, 10)
+PLOT_DPI = 100
+
+# Type the plotted values are drawn from (flight time stays float64)
+VALUE_DTYPE = np.float32
+
+# Shading of detected events (flight_events) on the plots of their channel
+EVENT_COLOR = "orange"
+EVENT_ALPHA = 0.25
+
+
+def load_plots(path):
+    """Read a plot set from a JSON list of objects with the PlotSpec fields."""
+    with open(path) as f:
+        return [PlotSpec(**spec) for spec in json.load(f)]
+
+
+def _events_of(spec, events):
+    # Events on one of the plot's columns, as (label, start, end)
+    return [(event.rule, event.start, event.end) for event in events or () if event.channel in spec.columns]
+
+
+def _draw(spec, time, columns, output_path, rotation, events=(), segments=None):
+    width = int(PLOT_SIZE[0] * PLOT_DPI)
+    fig = Figure(figsize=PLOT_SIZE, dpi=PLOT_DPI)
+    ax = fig.add_subplot()
+    labels = spec.labels or spec.columns
+    for col, color, label in zip(spec.columns, spec.colors, labels):
+        index, values = MinMaxPyramid(columns[col]).query(width=width)
+        x, values = break_lines(time, segments, index, values) if segments is not None else (time[index], values)
+        ax.plot(x, values, label=label, color=color, linewidth=0.7)
+    shaded = set()
+    for label, start, end in events:
+        # Events of at least one second so single sample events stay visible
+        ax.axvspan(start, max(end, start + 1), color=EVENT_COLOR, alpha=EVENT_ALPHA,
+                   label=label if label not in shaded else "_nolegend_")
+        shaded.add(label)
+
+    ax.set_xlabel("Time")
+    ax.set_ylabel(spec.ylabel)
+    if spec.title:
+        ax.set_title(spec.title)
+    ax.legend()
+    ax.grid(True)
+
+    # Reduce the number of x-axis labels
+    ax.xaxis.set_major_locator(MaxNLocator(nbins=10, integer=True))
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: format_hms(x)))
+    ax.tick_params(axis="x", labelrotation=rotation)
+    fig.tight_layout()
+    fig.savefig(output_path)
+    return output_path
+
+
+def _render(spec, shm_name, layout, n, output_path, rotation, events, segments):
+    # Worker: attach to the shared columns, only the ones this plot needs are read
+    shm = SharedMemory(name=shm_name)
+    try:
+        views = {name: np.ndarray((n,), dtype=np.float64 if name == "__time__" else VALUE_DTYPE, buffer=shm.buf, offset=offset)
+                 for name, offset in layout.items()}
+        time = views.pop("__time__")
+        return _draw(spec, time, views, output_path, rotation, events, segments)
+    finally:
+        views = time = None
+        shm.close()
+
+
+def render_plots(columns, output_dir, time, plots=PLOTS, workers=None, rotation=90, events=None, segments=None):
+    """Render a plot set to PNGs in output_dir in a process pool.
+
+    The needed columns are copied once into shared memory as float32, every
+    worker maps only the columns of its plot. Events (flight_events.Event) are shaded on
+    the plots of their channel and lines break between segments (first
+    sample positions, see TimeIndex). Returns the output paths in plot order.
+    """
+    needed = list(dict.fromkeys(col for spec in plots for col in spec.columns))
+    n = len(time)
+    value_size = np.dtype(VALUE_DTYPE).itemsize
+    layout = {name: n * 8 + i * n * value_size for i, name in enumerate(needed)}
+    layout["__time__"] = 0
+    paths = [os.path.join(output_dir, spec.filename) for spec in plots]
+    if n == 0 or workers == 1:
+        time = np.asarray(time, dtype=np.float64)
+        data = {name: np.asarray(columns[name], dtype=VALUE_DTYPE) for name in needed}
+        return [_draw(spec, time, data, path, rotation, _events_of(spec, events), segments) for spec, path in zip(plots, paths)]
+
+    shm = SharedMemory(create=True, size=n * 8 + len(needed) * n * value_size)
+    try:
+        for name, offset in layout.items():
+            values = time if name == "__time__" else columns[name]
+            dtype = np.float64 if name == "__time__" else VALUE_DTYPE
+            np.ndarray((n,), dtype=dtype, buffer=shm.buf, offset=offset)[:] = np.asarray(values)
+        with ProcessPoolExecutor(max_workers=workers or min(len(plots), os.cpu_count() or 1)) as pool:
+            futures = [
+                pool.submit(_render, spec, shm.name, {name: layout[name] for name in ["__time__"] + list(spec.columns)}, n, path, rotation,
+                            _events_of(spec, events), segments)
+                for spec, path in zip(plots, paths)
+            ]
+            return [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
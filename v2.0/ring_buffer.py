@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """Fixed size, array backed buffer of the latest samples of one channel.
+
+    Memory is allocated once, appending overwrites the oldest samples.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        # Total number of samples ever appended, the write position is total % capacity
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, values):
+        """Append one value or an array of values."""
+        if np.ndim(values) == 0:
+            self.data[self.total % self.capacity] = values
+            self.total += 1
+            return
+        values = np.asarray(values, dtype=self.data.dtype)
+        n = len(values)
+        values = values[-self.capacity:]
+        start = (self.total + n - len(values)) % self.capacity
+        # At most two slice copies: up to the end of the array, then from the front
+        head = min(len(values), self.capacity - start)
+        self.data[start:start + head] = values[:head]
+        self.data[:len(values) - head] = values[head:]
+        self.total += n
+
+    def last(self, n=None):
+        """Copy of the latest n samples (all buffered samples by default), oldest first."""
+        n = len(self) if n is None else min(n, len(self))
+        return np.take(self.data, np.arange(self.total - n, self.total), mode="wrap")
+
+
+class ChannelBuffers:
+    """One RingBuffer per channel, written a whole sample at a time.
+
+    A lock keeps snapshots consistent when they are taken from another
+    thread (Tk, Gradio) while the ingester appends.
+    """
+
+    def __init__(self, dtypes, capacity):
+        self.channels = {name: RingBuffer(capacity, dtype) for name, dtype in dtypes.items()}
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(next(iter(self.channels.values()))) if self.channels else 0
+
+    @property
+    def total(self):
+        return next(iter(self.channels.values())).total if self.channels else 0
+
+    def append(self, columns):
+        """Append equally long columns (or scalars) for every channel."""
+        with self._lock:
+            for name, buffer in self.channels.items():
+                buffer.append(columns[name])
+
+    def snapshot(self, names=None, n=None):
+        """Copies of the latest n samples of the channels, all channels by default."""
+        with self._lock:
+            return {name: self.channels[name].last(n) for name in (names or self.channels)}
+
+    def latest(self):
+        """Latest value of every channel, None before the first sample."""
+        with self._lock:
+            if not self.total:
+                return None
+            return {name: buffer.data[(buffer.total - 1) % buffer.capacity].item() for name, buffer in self.channels.items()}
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import json
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+import ecu_frame
+import ecu_resync
+import ecu_validate
+import flight_coverage
+
+# The datalogger soft-AP serves the SD log here
+DEFAULT_URL = "http://192.168.4.1/download"
+
+FRAME_SIZE = ecu_frame.FRAME_SIZE
+
+
+def load_state(state_path):
+    """Sync state: byte offset where decoding resumes, whether a frame run is locked there
+    and the FrameValidator context and last row (for dropping repeats) of the frames before it."""
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"offset": 0, "locked": False, "validator": None, "last_row": None}
+
+
+def save_state(state_path, state):
+    tmp = state_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path)
+
+
+def _content_range(response_headers):
+    # (first byte, total size) from a Content-Range header, None if missing
+    match = re.match(r"bytes (\d+|\*)-?(\d*)/(\d+|\*)", response_headers.get("Content-Range", ""))
+    if not match:
+        return None, None
+    first = int(match.group(1)) if match.group(1) != "*" else None
+    total = int(match.group(3)) if match.group(3) != "*" else None
+    return first, total
+
+
+def _restart(local_path, csv_path, state):
+    # The log on the SD card was deleted or replaced, start the local copy over
+    open(local_path, "wb").close()
+    if os.path.exists(csv_path):
+        os.remove(csv_path)
+    state.update(offset=0, locked=False, validator=None, last_row=None)
+
+
+def fetch(url, local_path, csv_path, state, timeout=10):
+    """Append the new tail of the remote log to local_path, returns the number of new bytes.
+
+    Uses an HTTP Range request. If the server ignores Range and sends the
+    whole file, the local copy is cut back to the last decoded frame and
+    the download resumes from there.
+    """
+    size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+    request = urllib.request.Request(url, headers={"Range": f"bytes={size}-"})
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416:
+            raise
+        # Nothing new, unless the remote log is now shorter than ours
+        _, total = _content_range(e.headers)
+        if total is not None and total < size:
+            _restart(local_path, csv_path, state)
+            return fetch(url, local_path, csv_path, state, timeout)
+        return 0
+
+    with response:
+        first, total = _content_range(response.headers)
+        body_start = first if response.status == 206 and first is not None else 0
+        if response.status != 206:
+            length = response.headers.get("Content-Length")
+            total = int(length) if length is not None else None
+        if body_start == size:
+            resume = size
+        else:
+            # Range ignored: resume at the last full frame that was decoded
+            resume = min(state["offset"], size)
+            if (total is not None and total < resume) or body_start > resume:
+                _restart(local_path, csv_path, state)
+                if body_start:
+                    return fetch(url, local_path, csv_path, state, timeout)
+                resume = 0
+        skip = resume - body_start
+        new = 0
+        with open(local_path, "r+b" if os.path.exists(local_path) else "wb") as f:
+            f.truncate(resume)
+            f.seek(resume)
+            for block in iter(lambda: response.read(ecu_frame.BLOCK_SIZE), b""):
+                if skip:
+                    dropped = min(skip, len(block))
+                    block, skip = block[dropped:], skip - dropped
+                f.write(block)
+                new += len(block)
+        return max(resume + new - size, 0)
+
+
+def decode_new(local_path, csv_path, state, block_size=ecu_frame.BLOCK_SIZE):
+    """Decode frames appended to local_path since the last call and append them to csv_path.
+
+    Decoding restarts at the last accepted frame so runs continue across
+    calls, the final frame waits for its successor. The validator context
+    is kept in state so the spike checks see the frames of earlier calls and
+    the result matches a stream_csv of the whole log, repeated frames are
+    dropped like there too. Returns the number of new records.
+    """
+    records = 0
+    validator = ecu_validate.FrameValidator.restore(state.get("validator"))
+    deduplicator = flight_coverage.Deduplicator.restore(state.get("last_row"))
+    with open(local_path, "rb") as f, open(csv_path, "a", newline="") as out:
+        writer = csv.writer(out)
+        if out.tell() == 0:
+            writer.writerow(ecu_frame.CSV_HEADERS)
+        while True:
+            f.seek(state["offset"])
+            data = f.read(block_size)
+            at_end = len(data) < block_size
+            data = data[:ecu_frame.last_space(data) + 1]
+            tokens, ends = ecu_frame.hex_token_ends(data)
+
+            locked = state["locked"]
+            start = FRAME_SIZE if locked else 0
+            limit = len(tokens) - 2 * FRAME_SIZE + 1
+            if limit <= start:
+                break
+            starts, pos = ecu_resync.find_frames(tokens, start, limit, 1 if locked else 0, locked)
+            # The previously accepted frame is only context, do not write it again
+            if len(starts):
+                frames, reasons, _ = validator.push(ecu_resync.take_frames(tokens, starts))
+                kept = frames[reasons == 0]
+                kept = kept[deduplicator.push(flight_coverage.record_columns(ecu_validate.records(kept)[0]))]
+                columns, _ = ecu_frame.decode_frames(kept)
+                writer.writerows(ecu_frame.iter_rows(columns))
+                records += len(columns["Seconds"])
+
+            stop = int(max(pos, limit, start))
+            if len(starts):
+                last = int(starts[-1])
+                state["locked"] = bool(stop == last + FRAME_SIZE)
+                resume = last if state["locked"] else max(stop - ecu_resync.BACKTRACK, last + 1)
+            else:
+                state["locked"] = False
+                resume = max(stop - ecu_resync.BACKTRACK, 0)
+            advance = int(ends[resume - 1]) if 0 < resume <= len(ends) else 0
+            state["offset"] += advance
+            if advance == 0 or at_end:
+                break
+    state["validator"] = validator.state()
+    state["last_row"] = deduplicator.last_row
+    return records
+
+
+def sync(url, output_dir, timeout=10):
+    """Fetch the new part of the SD log into output_dir and decode it, returns (new bytes, new records)."""
+    os.makedirs(output_dir, exist_ok=True)
+    local_path = os.path.join(output_dir, "hello.txt")
+    csv_path = os.path.join(output_dir, "decrypted_data.csv")
+    state_path = os.path.join(output_dir, "sync_state.json")
+    state = load_state(state_path)
+    new_bytes = fetch(url, local_path, csv_path, state, timeout)
+    records = decode_new(local_path, csv_path, state) if os.path.exists(local_path) else 0
+    save_state(state_path, state)
+    return new_bytes, records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally download and decode the datalogger SD log.")
+    parser.add_argument("--url", default=DEFAULT_URL, help="download URL of the log")
+    parser.add_argument("-o", "--output", default="sync", help="folder for the local copy, CSV and sync state")
+    parser.add_argument("--interval", type=float, default=0, help="keep syncing every N seconds")
+    args = parser.parse_args(argv)
+
+    while True:
+        new_bytes, records = sync(args.url, args.output)
+        print(f"Fetched {new_bytes} bytes, decoded {records} new records")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
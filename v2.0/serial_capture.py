@@ -0,0 +1,186 @@
+import argparse
+import os
+import select
+import time
+from collections import deque
+import numpy as np
+import ecu_binlog
+import ecu_frame
+import ecu_resync
+from ring_buffer import RingBuffer
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+try:
+    import termios
+    import tty
+except ImportError:
+    # Not on Windows, pyserial is needed there
+    termios = tty = None
+
+FRAME_SIZE = ecu_frame.FRAME_SIZE
+
+# Same link settings as Serial2 on the datalogger
+BAUD_RATE = 115200
+REQUEST = b"a"
+
+# A response not complete after this many seconds is dropped and the request resent
+READ_TIMEOUT = 0.5
+
+# Frames collected before they are written out in one go
+BATCH_FRAMES = 256
+
+# Latencies kept for the report
+LATENCY_SAMPLES = 100000
+
+
+class PosixPort:
+    """Minimal raw serial port for POSIX when pyserial is not installed."""
+
+    def __init__(self, path, baud=BAUD_RATE, timeout=READ_TIMEOUT):
+        self.timeout = timeout
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, f"B{baud}")
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def read(self, size):
+        data = bytearray()
+        deadline = time.perf_counter() + self.timeout
+        while len(data) < size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                break
+            data += os.read(self.fd, size - len(data))
+        return bytes(data)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def reset_input_buffer(self):
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_port(path, baud=BAUD_RATE, timeout=READ_TIMEOUT):
+    """Open a serial port with pyserial, or with termios if it is not installed."""
+    if serial is not None:
+        return serial.Serial(path, baud, timeout=timeout)
+    return PosixPort(path, baud, timeout)
+
+
+def _aligned(frame):
+    # A response shifted by a lost byte fails the resync plausibility check
+    ok, _ = ecu_resync.plausible(np.frombuffer(frame, dtype=np.uint8).astype(np.int16))
+    return bool(ok[0])
+
+
+def _as_frames(records):
+    return np.frombuffer(b"".join(records), dtype=np.uint8).reshape(-1, FRAME_SIZE)
+
+
+def _drain(ser):
+    # Read until the line goes quiet so the next request starts on a frame boundary
+    while len(ser.read(FRAME_SIZE)) == FRAME_SIZE:
+        pass
+    ser.reset_input_buffer()
+
+
+def capture(port, output_path, duration=None, count=None, depth=1, batch=BATCH_FRAMES, timeout=READ_TIMEOUT):
+    """Poll the ECU as fast as it answers and append the raw frames to the binary log output_path.
+
+    depth requests are kept outstanding so the next response is already on
+    the way while one is read. Short responses and frames that fail the
+    plausibility check (bytes lost with requests in flight) are dropped and
+    the line is drained before polling resumes. Frames are written in
+    batches of batch frames. Returns a report dict with the achieved rate
+    and latencies.
+    """
+    latencies = RingBuffer(LATENCY_SAMPLES)
+    frames = timeouts = misaligned = 0
+    records = []
+    sent = deque()
+    ser = open_port(port, timeout=timeout)
+    started = time.perf_counter()
+    try:
+        with ecu_binlog.BinlogWriter(output_path) as out:
+            while (count is None or frames < count) and (duration is None or time.perf_counter() - started < duration):
+                while len(sent) < depth:
+                    ser.write(REQUEST)
+                    sent.append(time.perf_counter())
+                frame = ser.read(FRAME_SIZE)
+                if len(frame) < FRAME_SIZE or not _aligned(frame):
+                    # Lost or short response: drop it and start over with a clean line
+                    if len(frame) < FRAME_SIZE:
+                        timeouts += 1
+                    else:
+                        misaligned += 1
+                    sent.clear()
+                    _drain(ser)
+                    continue
+                latencies.append(time.perf_counter() - sent.popleft())
+                records.append(frame)
+                frames += 1
+                if len(records) >= batch:
+                    out.write(_as_frames(records))
+                    records.clear()
+            out.write(_as_frames(records))
+    finally:
+        ser.close()
+    elapsed = time.perf_counter() - started
+    latency = latencies.last() * 1000
+    return {
+        "frames": frames,
+        "timeouts": timeouts,
+        "misaligned": misaligned,
+        "elapsed": elapsed,
+        "rate": frames / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": float(latency.mean()) if len(latency) else None,
+            "p50": float(np.percentile(latency, 50)) if len(latency) else None,
+            "p99": float(np.percentile(latency, 99)) if len(latency) else None,
+            "max": float(latency.max()) if len(latency) else None,
+        },
+    }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"Captured {report['frames']} frames in {report['elapsed']:.1f} s ({report['rate']:.1f} Hz), "
+          f"{report['timeouts']} timeouts, {report['misaligned']} misaligned")
+    if latency["mean"] is not None:
+        print(f"Latency ms: mean {latency['mean']:.2f}  p50 {latency['p50']:.2f}  p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Capture ECU frames over a serial port at the highest rate the ECU answers.")
+    parser.add_argument("port", nargs="?", help="serial port, e.g. /dev/ttyUSB0 or COM3")
+    parser.add_argument("-o", "--output", default="capture.bin", help="binary log the frames are appended to (see ecu_binlog)")
+    parser.add_argument("--duration", type=float, help="stop after N seconds")
+    parser.add_argument("--count", type=int, help="stop after N frames")
+    parser.add_argument("--depth", type=int, default=1, help="requests kept outstanding")
+    parser.add_argument("--simulate", action="store_true", help="capture from a simulated ECU on a pseudo terminal")
+    args = parser.parse_args(argv)
+    if not args.port and not args.simulate:
+        parser.error("a port is required unless --simulate is given")
+    if args.duration is None and args.count is None:
+        args.duration = 10
+
+    if args.simulate:
+        from ecu_simulator import EcuSimulator
+        with EcuSimulator() as simulator:
+            report = capture(simulator.port, args.output, args.duration, args.count, args.depth)
+    else:
+        report = capture(args.port, args.output, args.duration, args.count, args.depth)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
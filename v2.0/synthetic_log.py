@@ -0,0 +1,86 @@
+import argparse
+import numpy as np
+import ecu_frame
+import flight_cache
+from ecu_simulator import SAMPLE_CSV
+
+# Consecutive recorded rows copied at a time, so values change like in a flight
+RUN_LENGTH = 50
+
+# Frames generated per chunk, bounds memory for logs of any size
+CHUNK_FRAMES = 100000
+
+# Longest run of bytes dropped or inserted by one corruption event
+MAX_CORRUPT_BYTES = 8
+
+
+def synthetic_frames(n, rng, columns, first_second=0):
+    """n frames built from runs of recorded rows, Seconds counting up from first_second."""
+    rows = len(columns["Seconds"])
+    run = min(RUN_LENGTH, rows)
+    starts = rng.integers(0, rows - run + 1, -(-n // run))
+    index = (starts[:, None] + np.arange(run)).ravel()[:n]
+    picked = {name: values[index] for name, values in columns.items()}
+    picked["Seconds"] = (first_second + np.arange(n)) % 0x10000
+    fill = rng.integers(0, 256, (n, ecu_frame.FRAME_SIZE), dtype=np.uint8)
+    return ecu_frame.encode_frames(picked, fill)
+
+
+def corrupt(data, rate, rng):
+    """Corrupt a flat byte array: about rate events per frame of flipped, dropped or inserted bytes."""
+    events = rng.binomial(len(data) // ecu_frame.FRAME_SIZE, rate)
+    kind = rng.integers(0, 3, events)
+    position = rng.integers(0, len(data), events)
+    length = rng.integers(1, MAX_CORRUPT_BYTES + 1, events)
+
+    data = data.copy()
+    flip = position[kind == 0]
+    data[flip] = rng.integers(0, 256, len(flip), dtype=np.uint8)
+
+    insert = kind == 1
+    data = np.insert(data, np.repeat(position[insert], length[insert]),
+                     rng.integers(0, 256, int(length[insert].sum()), dtype=np.uint8))
+
+    drop = kind == 2
+    dropped = (rng.integers(0, len(data), int(drop.sum()))[:, None] + np.arange(MAX_CORRUPT_BYTES)).ravel()
+    dropped = dropped[(np.arange(MAX_CORRUPT_BYTES) < length[drop][:, None]).ravel()]
+    keep = np.ones(len(data), dtype=bool)
+    keep[dropped[dropped < len(data)]] = False
+    return data[keep]
+
+
+def generate_log(path, frames, seed=0, corruption=0.0, csv_path=SAMPLE_CSV):
+    """Write a seeded synthetic raw hex log of the given number of frames, returns its size in bytes.
+
+    Values come from the recorded flight in csv_path, corruption is the
+    expected number of corruption events per frame.
+    """
+    columns = flight_cache.read_csv(csv_path)
+    chunks = np.random.SeedSequence(seed).spawn(-(-frames // CHUNK_FRAMES))
+    size = 0
+    with open(path, "wb") as f:
+        for i, chunk_seed in enumerate(chunks):
+            rng = np.random.default_rng(chunk_seed)
+            first = i * CHUNK_FRAMES
+            data = synthetic_frames(min(CHUNK_FRAMES, frames - first), rng, columns, first).ravel()
+            if corruption:
+                data = corrupt(data, corruption, rng)
+            text = ecu_frame.hex_text(data)
+            f.write(text)
+            size += len(text)
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw ECU hex log.")
+    parser.add_argument("output", help="log file to write")
+    parser.add_argument("-n", "--frames", type=int, default=100000, help="number of frames")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corruption", type=float, default=0.0, help="corruption events per frame, e.g. 0.01")
+    args = parser.parse_args(argv)
+    size = generate_log(args.output, args.frames, args.seed, args.corruption)
+    print(f"Wrote {args.frames} frames ({size / 1e6:.1f} MB) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import numpy as np
+
+# A backwards Seconds step across 65535 -> 0 of at most this many seconds is a rollover,
+# any other backwards step is an ECU reset
+WRAP_WINDOW = 600
+
+# The datalogger logs once a second, a longer forward Seconds step than this is a gap
+# in the data that starts a new segment (TimeIndex gap, flight_coverage)
+GAP_SECONDS = 5
+
+
+def format_hms(t):
+    """Format seconds as HH:MM:SS (hours keep counting past 24)."""
+    t = int(t)
+    sign = "-" if t < 0 else ""
+    t = abs(t)
+    return f"{sign}{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+
+
+def unwrap_steps(step):
+    """Flight time steps of Seconds differences, returns (steps, reset mask).
+
+    Rollovers add 65536 and an ECU reset counts as one second.
+    """
+    step = np.asarray(step, dtype=np.int64)
+    wrap = (step < 0) & (step + 0x10000 <= WRAP_WINDOW)
+    reset = (step < 0) & ~wrap
+    return np.where(wrap, step + 0x10000, np.where(reset, 1, step)), reset
+
+
+def unwrap_step(step):
+    """Flight time step of one Seconds difference, see unwrap_steps."""
+    if step >= 0:
+        return step
+    return step + 0x10000 if step + 0x10000 <= WRAP_WINDOW else 1
+
+
+def break_lines(time, segments, index, values):
+    """Times and values (float) of sample positions index with a NaN between
+    two segments (first sample positions), so plotted lines break there."""
+    cuts = np.flatnonzero(np.diff(np.searchsorted(segments, index, side="right"))) + 1
+    return (np.insert(np.asarray(time)[index].astype(np.float64), cuts, np.nan),
+            np.insert(np.asarray(values, dtype=np.float64), cuts, np.nan))
+
+
+class TimeIndex:
+    """Sorted numeric flight time built from the ECU uint16 Seconds column.
+
+    Rollovers are unwrapped and ECU resets start a new segment that
+    continues one second after the previous sample, so time never goes
+    backwards and time windows are found by binary search. With gap set,
+    steps longer than gap seconds start a new segment too.
+    """
+
+    def __init__(self, seconds, gap=None):
+        seconds = np.asarray(seconds, dtype=np.int64)
+        step, reset = unwrap_steps(np.diff(seconds))
+        self.time = np.concatenate([seconds[:1], seconds[:1] + np.cumsum(step)])
+        if gap is not None:
+            reset |= step > gap
+        # Index of the first sample of every segment
+        self.segments = np.concatenate([[0], np.flatnonzero(reset) + 1]) if len(seconds) else np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.time)
+
+    def slice(self, t0=None, t1=None):
+        """Slice of the samples with t0 <= time <= t1."""
+        start = 0 if t0 is None else int(np.searchsorted(self.time, t0, side="left"))
+        stop = len(self.time) if t1 is None else int(np.searchsorted(self.time, t1, side="right"))
+        return slice(start, max(start, stop))
+
+    def select(self, columns, names, t0=None, t1=None):
+        """Columns between t0 and t1 (views, nothing outside the window is touched)."""
+        window = self.slice(t0, t1)
+        return {name: np.asarray(columns[name])[window] for name in names}
+
+    def segment_of(self, index):
+        """Segment number of sample positions."""
+        return np.searchsorted(self.segments, index, side="right") - 1
+
+    def labels(self, index):
+        """HH:MM:SS labels for sample positions."""
+        return [format_hms(t) for t in self.time[index]]
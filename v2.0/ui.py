@@ -2,17 +2,19 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-import csv
+import flight_coverage
+import jobs
+import metrics as run_metrics
+import pipeline
+import plot_render
 
-# Configure matplotlib to use non-GUI backend
-plt.switch_backend('Agg')
+# How often the window polls the background job for progress (ms)
+POLL_MS = 100
 
 class DataLoggerApp:
-    def __init__(self, master):
+    def __init__(self, master, plots=plot_render.PLOTS):
         self.master = master
+        self.plots = plots
         master.title("Data Logger Processor")
         
         # UI Elements
@@ -22,185 +24,104 @@ class DataLoggerApp:
         self.btn_select = tk.Button(self.frame, text="Select Input TXT File", command=self.select_file)
         self.btn_select.pack(pady=10)
         
+        self.keep_processed = tk.BooleanVar(value=False)
+        self.chk_processed = tk.Checkbutton(self.frame, text="Keep processed_data.txt", variable=self.keep_processed)
+        self.chk_processed.pack(pady=5)
+        
+        self.btn_cancel = tk.Button(self.frame, text="Cancel", command=self.cancel_job, state=tk.DISABLED)
+        self.btn_cancel.pack(pady=5)
+        
         self.status_label = tk.Label(self.frame, text="Status: Ready")
         self.status_label.pack(pady=5)
+        
+        self.metrics = run_metrics.DISABLED
+        self.coverage = ""
+        self.step = ""
+        
+        # The pipeline runs on a worker thread, the window only polls the job
+        self.runner = jobs.JobRunner("pipeline")
+        self.job = None
 
     def select_file(self):
-        file_path = filedialog.askopenfilename(title="Select Input TXT File", filetypes=[("Text files", "*.txt")])
+        file_path = filedialog.askopenfilename(title="Select Input TXT File", filetypes=[("Text files", "*.txt"), ("Binary logs", "*.bin")])
         if file_path:
             self.process_file(file_path)
 
     def process_file(self, input_path):
-        try:
-            self.update_status("Processing: Step 1/3 - Formatting bytes...")
-            txt_output = self.process_line82bytes(input_path)
-            
-            self.update_status("Processing: Step 2/3 - Decrypting CSV...")
-            csv_output = self.process_decrypt_csv(txt_output)
-            
-            self.update_status("Processing: Step 3/3 - Generating plots...")
-            self.process_csv_reader(csv_output)
-            
-            self.update_status("Processing complete!")
-            messagebox.showinfo("Success", "Processing completed successfully!")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.update_status("Error occurred")
-
-    def process_line82bytes(self, input_file):
-        output_file = os.path.join(os.path.dirname(input_file), "processed_data.txt")
-        with open(input_file, "r") as f:
-            data = f.read().split()
-        
-        chunks = [data[i:i+82] for i in range(0, len(data), 82)]
-        
-        with open(output_file, "w") as f:
-            for chunk in chunks:
-                if len(chunk) != 82:
-                    print(f"Warning: Skipping line with {len(chunk)} values")
-                    continue
-                
-                # Modified filtering logic
-                if chunk[0] != "00" and chunk[0] != "f0" :  # Keep lines with pattern "XX 00"
-                    if chunk[2] != "00":
-                        f.write(" ".join(chunk) + "\n")
-                        # print(f"Kept valid line: {chunk[0]} {chunk[1]}...")
-                # else:
-                    # print(f"Removed garbage line: {chunk[0]} {chunk[1]}...")
-
-        return output_file
-
-    def process_decrypt_csv(self, input_txt):
-        output_csv = os.path.join(os.path.dirname(input_txt), "decrypted_data.csv")
-        parsed_data = []
-        
-        with open(input_txt, 'r') as f:
-            for line in f:
-                result = self.parse_data_line(line)
-                if result:
-                    parsed_data.append(result[1])
-        
-        # Define CSV headers
-        headers = [
-            "Seconds", "Injection Pulse Width 1 (us)", "Injection Pulse Width 2 (us)",
-            "RPM", "Ignition Advance Angle (deg)", "Injection Event Scheduling",
-            "Engine Status Ready", "Engine Status Crank", "Engine Status StartW",
-            "Engine Status Warmup", "Engine Status TPSAEN", "Engine Status TPSDEN",
-            "Air-Fuel Ratio Target 1", "Air-Fuel Ratio Target 2", "WBO2 Enabled 1",
-            "WBO2 Enabled 2", "Barometric Pressure (kPa)", "Manifold Absolute Pressure (kPa)",
-            "Manifold Air Temperature (deg C)", "Cylinder Temperature (deg C)",
-            "Throttle Position (%)", "Battery Voltage (V)"
-        ]
-        
-        with open(output_csv, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)
-            writer.writerows(parsed_data)
+        # Runs in the background, the window stays responsive and can cancel
+        if self.job is not None and not self.job.done:
+            messagebox.showwarning("Busy", "A log is still being processed.")
+            return
+        self.btn_select.config(state=tk.DISABLED)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.update_status("Processing: starting...")
+        self.job = self.runner.submit(self.run_pipeline, input_path, self.keep_processed.get())
+        self.master.after(POLL_MS, self.poll_job)
+
+    def run_pipeline(self, job, input_path, keep_processed):
+        # Worker thread: no Tk calls here, progress goes through the job
+        # Stage timers and rejection counters, shown live and saved as run_report.json
+        self.metrics = run_metrics.Metrics(on_update=lambda metrics: self.show_progress(metrics, job))
+        self.step = "Step 1/2 - Decoding log to CSV"
+        job.progress(f"Processing: {self.step}...")
+        csv_output, columns = self.process_stream(input_path, keep_processed)
         
-        return output_csv
-
-    def parse_data_line(self, line):
-        # Helper functions from decryptCSV
-        def fahrenheit_to_celsius(f):
-            return (f - 32) * 5 / 9
-
-        def shift_and_combine(h, l):
-            return (int(h, 16) << 8) | int(l, 16)
+        job.check()
+        self.step = "Step 2/2 - Generating plots"
+        job.progress(f"Processing: {self.step}...")
+        output_dir = self.process_csv_reader(csv_output, columns)
+        # Record the flight in the catalog for cross-flight queries (flight_catalog.py)
+        pipeline.catalog_flight(input_path, csv_output, output_dir, self.metrics, columns=columns)
+        self.metrics.write_report(os.path.join(output_dir, "run_report.json"), input=input_path)
+        return self.metrics.get("events")
+
+    def poll_job(self):
+        job = self.job
+        if not job.done:
+            if job.message:
+                self.update_status(job.message)
+            self.master.after(POLL_MS, self.poll_job)
+            return
+        self.btn_select.config(state=tk.NORMAL)
+        self.btn_cancel.config(state=tk.DISABLED)
+        if job.state == "done":
+            self.update_status(f"Processing complete! {self.coverage}")
+            messagebox.showinfo("Success", f"Processing completed successfully! {job.result} engine events detected (events.csv).")
+        elif job.state == "cancelled":
+            self.update_status("Cancelled")
+        else:
+            messagebox.showerror("Error", str(job.error))
+            self.update_status("Error occurred")
 
-        def shift_and_combine_signed(h, l):
-            combined = (int(h, 16) << 8) | int(l, 16)
-            return combined - 0x10000 if combined >= 0x8000 else combined
+    def cancel_job(self):
+        if self.job is not None and not self.job.done:
+            self.job.cancel()
+            self.update_status("Cancelling...")
 
-        # Parsing logic
-        try:
-            hex_values = [v.zfill(2) for v in line.strip().split()]
-            
-            # Convert various values
-            seconds = shift_and_combine(hex_values[1], hex_values[0])
-            pw1 = shift_and_combine(hex_values[3], hex_values[2])
-            pw2 = shift_and_combine(hex_values[5], hex_values[4])
-            rpm = shift_and_combine(hex_values[7], hex_values[6])
-            adv_deg = shift_and_combine(hex_values[9], hex_values[8]) / 10
-            baro = shift_and_combine_signed(hex_values[17], hex_values[16]) / 10
-            map_ = shift_and_combine_signed(hex_values[19], hex_values[18]) / 10
-            mat = fahrenheit_to_celsius(shift_and_combine_signed(hex_values[21], hex_values[20]) / 10)
-            clt = fahrenheit_to_celsius(shift_and_combine_signed(hex_values[23], hex_values[22]) / 10)
-            tps = shift_and_combine_signed(hex_values[25], hex_values[24]) / 10
-            batt = shift_and_combine_signed(hex_values[27], hex_values[26]) / 10
-            
-            # Engine status parsing
-            engine = int(hex_values[11], 16)
-            engine_status = [
-                bool(engine & (1 << i)) for i in range(6)
-            ]
-            
-            return (None, [
-                seconds, pw1, pw2, rpm, adv_deg, int(hex_values[10], 16),
-                *engine_status,
-                int(hex_values[12], 16), int(hex_values[13], 16),
-                int(hex_values[14], 16), int(hex_values[15], 16),
-                baro, map_, mat, clt, tps, batt
-            ])
-        except Exception as e:
-            print(f"Error parsing line: {e}")
-            return None
+    def process_stream(self, input_file, keep_processed=False):
+        # Single pass format + decrypt, the intermediate text file is optional
+        output_csv, counts, columns = pipeline.decode_log(input_file, os.path.dirname(input_file), keep_processed, self.metrics)
+        # Shown in the status once the run is done
+        self.coverage = flight_coverage.format_coverage(counts["coverage"])
+        return output_csv, columns
 
-    def process_csv_reader(self, csv_path):
-        # Read and process data
-        column_names = [
-            "Seconds", "Injection Pulse Width 1 (us)", "Injection Pulse Width 2 (us)", "RPM", 
-            "Ignition Advance Angle (deg)", "Injection Event Scheduling", "Engine Status Ready", 
-            "Engine Status Crank", "Engine Status StartW", "Engine Status Warmup", "Engine Status TPSAEN", 
-            "Engine Status TPSDEN", "Air-Fuel Ratio Target 1", "Air-Fuel Ratio Target 2", 
-            "WBO2 Enabled 1", "WBO2 Enabled 2", "Barometric Pressure (kPa)", "Manifold Absolute Pressure (kPa)",
-            "Manifold Air Temperature (deg C)", "Cylinder Temperature (deg C)", "Throttle Position (%)", 
-            "Battery Voltage (V)"
-        ]
-        
-        df = pd.read_csv(csv_path, names=column_names, header=0)
-        df['Time'] = pd.to_timedelta(df['Seconds'], unit='s').astype(str).str.slice(start=7)
-        df['Barometric Pressure (kPa)'] /= 1000
-        df['Manifold Absolute Pressure (kPa)'] /= 1000
-        
-        # Create output directory
+    def process_csv_reader(self, csv_path, flight):
+        # Create output directory, the stages share the columns decode_log returned
         output_dir = os.path.join(os.path.dirname(csv_path), datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-        os.makedirs(output_dir, exist_ok=True)
         
-        # Generate plots
-        self.generate_plots(df, output_dir)
-
-    def generate_plots(self, df, output_dir):
-        plots = [
-            (['Injection Pulse Width 1 (us)', 'Injection Pulse Width 2 (us)'], ['red', 'blue'], 'Pulse Width (us)', 'injection_pulse_width.png'),
-            (['RPM'], ['red'], 'RPM', 'rpm.png'),
-            (['Throttle Position (%)'], ['red'], 'Throttle Position %', 'throttle_position.png'),
-            (['Ignition Advance Angle (deg)'], ['green'], 'Degrees', 'ignition_advance.png'),            
-            (['Injection Event Scheduling'], ['green'], 'Injection Event Scheduling', 'injection_event.png'),
-            (['Air-Fuel Ratio Target 1', 'Air-Fuel Ratio Target 2'], ['green', 'blue'], 'Air-Fuel Ratio', 'afr_target.png'),
-            (['WBO2 Enabled 1', 'WBO2 Enabled 2'], ['green', 'blue'], 'WBO Status', 'wbo_enabled.png'),
-            (['Barometric Pressure (kPa)', 'Manifold Absolute Pressure (kPa)'], ['red', 'blue'], 'Pressure (MPa)', 'pressure.png'),
-            (['Manifold Air Temperature (deg C)', 'Cylinder Temperature (deg C)'], ['red', 'blue'], 'Temperature (°C)', 'temperature.png'),
-            (['Battery Voltage (V)'], ['green'], 'Voltage (V)', 'battery_voltage.png'),
-        ]
-
-        for columns, colors, ylabel, filename in plots:
-            plt.figure(figsize=(20, 10))
-            for col, color in zip(columns, colors):
-                plt.plot(df['Time'], df[col], label=col, color=color, linewidth=0.7)
-
-            plt.xlabel("Time")  
-            plt.ylabel(ylabel)
-            plt.legend()
-            plt.grid(True)
-
-            # Reduce the number of x-axis labels
-            plt.gca().xaxis.set_major_locator(MaxNLocator(nbins=10))  
-
-            plt.xticks(rotation=90)  
-            plt.tight_layout()
-            plt.savefig(os.path.join(output_dir, filename))
-            plt.close()
-
+        # Detect engine events, written to events.csv and shaded on the plots
+        events = pipeline.detect_events(flight, output_dir, metrics=self.metrics)
+        
+        # Generate plots, figures are rendered in parallel
+        pipeline.plot_flight(flight, output_dir, self.plots, metrics=self.metrics, events=events)
+        # Flight summary (RPM bands, temperatures, Engine Status times, injector duty) next to the plots
+        pipeline.write_flight_stats(flight, output_dir, self.metrics)
+        return output_dir
+
+    def show_progress(self, metrics, job):
+        # Called by the metrics while decoding, also where a cancel takes effect
+        job.progress(f"Processing: {self.step} - {metrics.get('frames')} frames, {metrics.rejected()} rejected")
+        job.check()
 
     def update_status(self, message):
         self.status_label.config(text=message)